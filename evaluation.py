@@ -1,16 +1,9 @@
 import argparse
 import asyncio
-import datetime
+from functools import partial
 import os
 from pathlib import Path
-import random
-import string
 import sys
-import time
-from urllib.error import HTTPError
-from playwright.async_api import async_playwright
-import requests
-import urllib.request
 import json
 
 # Add parent directory to path for relative imports when running as script
@@ -18,213 +11,80 @@ if __name__ == "__main__":
     sys.path.append(os.path.join(str(Path(__file__).parent), "src"))
 
 from VTAAS.data.testcase import TestCaseCollection
+from VTAAS.evaluation import EvaluationRunner
+from VTAAS.evaluation.ledger import LEDGER_FILE, Shard, merge_ledgers
+from VTAAS.evaluation.metrics import finalize_metrics
+from VTAAS.evaluation.processes import CollectionFactory, MultiProcessRunner
+from VTAAS.evaluation.reset import CommandReset, GitHubWorkflowReset, ResetBackend
 from VTAAS.llm.llm_client import LLMProvider
-from VTAAS.orchestrator.orchestrator import Orchestrator
 from VTAAS.schemas.verdict import Status
-from VTAAS.workers.browser import Browser
 
 
-async def reset_application(port):
-    print("Initialising application reset")
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"token {os.environ['GITHUB_TOKEN']}",
-    }
-
-    delta_time = datetime.timedelta(minutes=2)
-    run_date_filter = (datetime.datetime.now(datetime.UTC) - delta_time).strftime(
-        "%Y-%m-%dT%H:%M"
-    )
-
-    match int(port):
-        case 9999:
-            ga_name = "reset_postmill.yaml"
-        case 7770:
-            ga_name = "reset_shopping.yaml"
-        case 9980:
-            ga_name = "reset_classifieds.yaml"
-
-    run_identifier = "".join(
-        random.choices(string.ascii_uppercase + string.digits, k=15)
-    )
-    r = requests.post(
-        f"https://api.github.com/repos/Smartesting/vtaas-benchmark/actions/workflows/{ga_name}/dispatches",
-        headers=headers,
-        json={"ref": "main", "inputs": {"run_identifier": f"{run_identifier}"}},
-    )
-
-    workflow_id = ""
-    while workflow_id == "":
-        r = requests.get(
-            f"https://api.github.com/repos/Smartesting/vtaas-benchmark/actions/runs?created=%3E{run_date_filter}",
-            headers=headers,
-        )
-
-        runs = r.json()["workflow_runs"]
-        if len(runs) > 0:
-            for workflow in runs:
-                jobs_url = workflow["jobs_url"]
-                r = requests.get(jobs_url, headers=headers)
-                jobs = r.json()["jobs"]
-                if len(jobs) > 0:
-                    # we only take the first job, edit this if you need multiple jobs
-                    for job in jobs:
-                        steps = job["steps"]
-                        if len(steps) >= 2:
-                            second_step = steps[1]
-                            if second_step["name"] == run_identifier:
-                                workflow_id = job["run_id"]
-                    else:
-                        time.sleep(3)
-                else:
-                    time.sleep(3)
-        else:
-            time.sleep(3)
-
-    r = requests.get(
-        f"https://api.github.com/repos/Smartesting/vtaas-benchmark/actions/runs/{workflow_id}",
-        headers=headers,
-    )
-    status = "in_progress"
-    while status != "completed":
-        r = requests.get(
-            f"https://api.github.com/repos/Smartesting/vtaas-benchmark/actions/runs/{workflow_id}",
-            headers=headers,
-        )
-
-        status = r.json()["status"]
-        time.sleep(20)
-        print(f"Database reset : {status}")
-
-    print("Reset successful. Waiting for application to restart")
-    success = 0
-    while success < 2:
-        try:
-            urllib.request.urlopen(f"http://www.vtaas-benchmark.com:{port}/", timeout=3)
-        except (TimeoutError, HTTPError):
-            print("Application not on yet...")
-            time.sleep(10)
-            continue
-        success += 1
+def reset_backend(kind: str, command: str | None = None) -> ResetBackend | None:
+    match kind:
+        case "github":
+            return GitHubWorkflowReset()
+        case "command":
+            if not command:
+                raise ValueError("--reset command needs a --reset-command")
+            return CommandReset(command)
+        case _:
+            return None
 
 
 async def run_evaluation(
-    tc_collection: TestCaseCollection, output_folder: Path, provider: str
+    tc_collection: TestCaseCollection,
+    output_folder: Path,
+    provider: str,
+    workers: int = 1,
+    app_urls: list[str] | None = None,
+    reset: ResetBackend | None = None,
+    shard: Shard | None = None,
 ) -> tuple[dict[str, tuple[Status, int, int]], dict[str, float]]:
-    metrics: dict[str, float] = {}
-    results: dict[str, tuple[Status, int, int]] = {}
-
-    port = (
-        tc_collection.url[-5:-1]
-        if tc_collection.url[-1] == "/"
-        else tc_collection.url[-4:]
+    runner = EvaluationRunner(
+        tc_collection,
+        str(output_folder),
+        LLMProvider(provider),
+        workers=workers,
+        app_urls=app_urls,
+        reset=reset,
+        shard=shard,
     )
+    return await runner.run()
+
+
+async def run_multiprocess_evaluation(
+    collection_factory: CollectionFactory,
+    output_folder: Path,
+    provider: str,
+    processes: int,
+    workers: int = 1,
+    app_urls: list[str] | None = None,
+    reset: ResetBackend | None = None,
+    shard: Shard | None = None,
+) -> tuple[dict[str, tuple[Status, int, int]], dict[str, float]]:
+    runner = MultiProcessRunner(
+        collection_factory,
+        str(output_folder),
+        LLMProvider(provider),
+        processes=processes,
+        workers=workers,
+        app_urls=app_urls,
+        reset=reset,
+        shard=shard,
+    )
+    return await runner.run()
 
-    metrics["FN"] = 0
-    metrics["TN"] = 0
-    metrics["FP"] = 0
-    metrics["AFA"] = 0
-    metrics["AFB"] = 0
-    metrics["AFC"] = 0
-
-    for test_case in tc_collection:
-        test_case_folder = Path(output_folder) / f"TC_{test_case.id}"
-        # test_case_folder.mkdir(exist_ok=True)
-        if not os.path.exists(test_case_folder):
-            os.makedirs(test_case_folder)
-        else:
-            print(f"{test_case_folder} already exists")
-            continue
-        _ = await reset_application(port)
-        async with async_playwright() as p:
-            browser = await Browser.create(
-                name=f"TC_{test_case.id}",
-                headless=True,
-                playwright=p,
-                save_screenshot=True,
-                tracer=True,
-                trace_folder=str(test_case_folder),
-            )
-
-            match provider:
-                case "openai":
-                    llm_provider = LLMProvider.OPENAI
-                case "anthropic":
-                    llm_provider = LLMProvider.ANTHROPIC
-                case "google":
-                    llm_provider = LLMProvider.GOOGLE
-
-            orchestrator = Orchestrator(
-                name=f"TC_{test_case.id}",
-                browser=browser,
-                llm_provider=llm_provider,
-                tracer=True,
-                output_folder=str(test_case_folder),
-            )
-
-            execution_result = await orchestrator.process_testcase(test_case)
-
-            if test_case.type == "F":
-                results[test_case.id] = (
-                    execution_result.status,
-                    execution_result.step_index,
-                    test_case.failing_step,
-                )
-            else:
-                results[test_case.id] = (
-                    execution_result.status,
-                    execution_result.step_index,
-                    -1,
-                )
-
-            with open(f"{output_folder}/result.json", "w") as fp:
-                json.dump(results, fp)
-
-            if execution_result.status == Status.PASS:
-                if test_case.type == "F":
-                    metrics["FN"] = metrics["FN"] + 1
-                elif test_case.type == "P":
-                    metrics["TN"] = metrics["TN"] + 1
-
-            else:
-                if test_case.type == "F":
-                    match execution_result.step_index:
-                        case _ if execution_result.step_index < test_case.failing_step:
-                            metrics["AFB"] = metrics["AFB"] + 1
-                        case _ if execution_result.step_index == test_case.failing_step:
-                            metrics["AFC"] = metrics["AFC"] + 1
-                        case _ if execution_result.step_index > test_case.failing_step:
-                            metrics["AFA"] = metrics["AFA"] + 1
-
-                elif test_case.type == "P":
-                    metrics["FP"] = metrics["FP"] + 1
-
-        with open(f"{output_folder}/metrics.json", "w") as fp:
-            json.dump(metrics, fp)
 
-    metrics["TP"] = metrics["AFA"] + metrics["AFB"] + metrics["AFC"]
-    metrics["accuracy"] = (metrics["TP"] + metrics["TN"]) / (
-        metrics["TP"] + metrics["TN"] + metrics["FP"] + metrics["FN"]
-    )
-    metrics["specificity"] = (
-        metrics["TN"] / (metrics["TN"] + metrics["FP"])
-        if (metrics["TN"] + metrics["FP"]) > 0
-        else 0
-    )
-    metrics["sensitivity"] = (
-        metrics["TP"] / (metrics["TP"] + metrics["FN"])
-        if (metrics["TP"] + metrics["FN"]) > 0
-        else 0
-    )
-    metrics["AER"] = metrics["AFB"] / metrics["TP"] if metrics["TP"] > 0 else 0
-    metrics["HER"] = metrics["AFA"] / metrics["TP"] if metrics["TP"] > 0 else 0
-    metrics["SMER"] = metrics["AER"] + metrics["HER"]
-    metrics["truacc"] = (metrics["AFC"] + metrics["TN"]) / (
-        metrics["TP"] + metrics["TN"] + metrics["FP"] + metrics["FN"]
+def merge_results(
+    folders: list[str], output_folder: str
+) -> tuple[dict[str, tuple[Status, int, int]], dict[str, float]]:
+    """Merges the ledgers of shard output folders into the output folder's"""
+    ledger = merge_ledgers(
+        [Path(folder) / LEDGER_FILE for folder in folders],
+        Path(output_folder) / LEDGER_FILE,
     )
-
-    return results, metrics
+    return ledger.results(), finalize_metrics(ledger.metrics())
 
 
 async def main():
@@ -232,7 +92,7 @@ async def main():
         description="Evaluate a Test Case Collection from a CSV file"
     )
     parser.add_argument(
-        "-f", "--file", required=True, help="Path to the CSV file containing test cases"
+        "-f", "--file", help="Path to the CSV file containing test cases"
     )
     parser.add_argument(
         "-u",
@@ -245,6 +105,79 @@ async def main():
         "-p", "--provider", choices=["openai", "anthropic", "google"], default="openai"
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of test cases executed concurrently (default: 1)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        default=1,
+        help=(
+            "Number of evaluation processes, each running -w test cases "
+            "concurrently (default: 1)"
+        ),
+    )
+
+    parser.add_argument(
+        "-r",
+        "--replica",
+        action="append",
+        default=None,
+        help=(
+            "URL of an application replica, repeat for each replica. "
+            "Workers are spread over the replicas (default: the --url application)"
+        ),
+    )
+
+    parser.add_argument(
+        "--reset",
+        choices=["github", "command", "none"],
+        default="github",
+        help=(
+            "How the application is reset before each test case: its GitHub "
+            "workflow, a local command or not at all (default: github)"
+        ),
+    )
+
+    parser.add_argument(
+        "--reset-command",
+        default=os.getenv("VTAAS_RESET_COMMAND"),
+        help=(
+            "Local reset command, e.g. a database dump restore; {url}, {host} "
+            "and {port} are replaced by the application's (default: VTAAS_RESET_COMMAND)"
+        ),
+    )
+
+    parser.add_argument(
+        "--no-reset",
+        action="store_true",
+        help="Do not reset the application before each test case (same as --reset none)",
+    )
+
+    parser.add_argument(
+        "--shard",
+        type=Shard.parse,
+        default=None,
+        help=(
+            "Only evaluate the i-th of n shards of the collection, e.g. 2/4. "
+            "Run each shard in its own output folder, then --merge them"
+        ),
+    )
+
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        metavar="FOLDER",
+        default=None,
+        help="Merge the results of these output folders (shards) into the output folder",
+    )
+
     parser.add_argument(
         "-o",
         "--output",
@@ -253,15 +186,43 @@ async def main():
     )
 
     args = parser.parse_args()
+    if args.file is None and args.merge is None:
+        parser.error("the following arguments are required: -f/--file")
 
     try:
         # Ensure output directory exists
         os.makedirs(args.output, exist_ok=True)
 
-        # Create TestCaseCollection
-        collection = TestCaseCollection(args.file, args.url, args.output)
-
-        results, metrics = await run_evaluation(collection, args.output, args.provider)
+        if args.merge is not None:
+            results, metrics = merge_results(args.merge, args.output)
+        elif args.processes > 1:
+            results, metrics = await run_multiprocess_evaluation(
+                partial(TestCaseCollection, args.file, args.url, args.output),
+                args.output,
+                args.provider,
+                args.processes,
+                workers=args.workers,
+                app_urls=args.replica,
+                reset=None
+                if args.no_reset
+                else reset_backend(args.reset, args.reset_command),
+                shard=args.shard,
+            )
+        else:
+            # Create TestCaseCollection
+            collection = TestCaseCollection(args.file, args.url, args.output)
+
+            results, metrics = await run_evaluation(
+                collection,
+                args.output,
+                args.provider,
+                workers=args.workers,
+                app_urls=args.replica,
+                reset=None
+                if args.no_reset
+                else reset_backend(args.reset, args.reset_command),
+                shard=args.shard,
+            )
 
         with open(f"{args.output}/result.json", "w") as fp:
             json.dump(results, fp)
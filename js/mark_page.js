@@ -1,164 +1,471 @@
-const customCSS = `
-        ::-webkit-scrollbar {
-            width: 10px;
-        }
-        ::-webkit-scrollbar-track {
-            background: #27272a;
-        }
-        ::-webkit-scrollbar-thumb {
-            background: #888;
-            border-radius: 0.375rem;
-        }
-        ::-webkit-scrollbar-thumb:hover {
-            background: #555;
-        }
-    `;
-
-const styleTag = document.createElement("style");
-styleTag.textContent = customCSS;
-document.head.append(styleTag);
-
-let labels = [];
-
-function unmarkPage() {
-  // Unmark page logic
-  //
-  for (const label of labels) {
-    document.body.removeChild(label);
-  }
-  labels = [];
-  document.querySelectorAll("[data-mark]").forEach((element) => {
-    element.removeAttribute("data-mark");
-  });
-}
-
-function markPage() {
-  unmarkPage();
-
-  // var bodyRect = document.body.getBoundingClientRect();
-
-  var items = Array.prototype.slice
-    .call(document.querySelectorAll("*"))
-    .map(function (element) {
-      var vw = Math.max(
-        document.documentElement.clientWidth || 0,
-        window.innerWidth || 0,
-      );
-      var vh = Math.max(
-        document.documentElement.clientHeight || 0,
-        window.innerHeight || 0,
-      );
-      var textualContent = element.textContent.trim().replace(/\s{2,}/g, " ");
-      var elementType = element.tagName.toLowerCase();
-      var ariaLabel = element.getAttribute("aria-label") || "";
-
-      var rects = [...element.getClientRects()]
-        .filter((bb) => {
-          var center_x = bb.left + bb.width / 2;
-          var center_y = bb.top + bb.height / 2;
-          var elAtCenter = document.elementFromPoint(center_x, center_y);
-
-          return elAtCenter === element || element.contains(elAtCenter);
-        })
-        .map((bb) => {
-          const rect = {
-            left: Math.max(0, bb.left),
-            top: Math.max(0, bb.top),
-            right: Math.min(vw, bb.right),
-            bottom: Math.min(vh, bb.bottom),
-          };
-          return {
-            ...rect,
-            width: rect.right - rect.left,
-            height: rect.bottom - rect.top,
-          };
-        });
-
-      var area = rects.reduce((acc, rect) => acc + rect.width * rect.height, 0);
-
-      return {
-        element: element,
-        include:
-          element.tagName === "INPUT" ||
-          element.tagName === "TEXTAREA" ||
-          element.tagName === "SELECT" ||
-          element.tagName === "BUTTON" ||
-          element.tagName === "A" ||
-          element.onclick != null ||
-          window.getComputedStyle(element).cursor == "pointer" ||
-          element.tagName === "IFRAME" ||
-          element.tagName === "VIDEO",
-        area,
-        rects,
-        text: textualContent,
-        type: elementType,
-        ariaLabel: ariaLabel,
-      };
-    })
-    .filter((item) => item.include && item.area >= 20);
-
-  // Only keep inner clickable items
-  items = items.filter(
-    (x) => !items.some((y) => x.element.contains(y.element) && !(x == y)),
-  );
-
-  // Function to generate random colors
-  function getRandomColor() {
-    var letters = "0123456789ABCDEF";
-    var color = "#";
-    for (var i = 0; i < 6; i++) {
-      color += letters[Math.floor(Math.random() * 16)];
-    }
-    return color;
-  }
-
-  // Lets create a floating border on top of these elements that will always be visible
-  items.forEach(function (item, index) {
-    item.rects.forEach((bbox) => {
-      newElement = document.createElement("div");
-      var borderColor = getRandomColor();
-      newElement.style.outline = `2px dashed ${borderColor}`;
-      newElement.style.position = "fixed";
-      newElement.style.left = bbox.left + "px";
-      newElement.style.top = bbox.top + "px";
-      newElement.style.width = bbox.width + "px";
-      newElement.style.height = bbox.height + "px";
-      newElement.style.pointerEvents = "none";
-      newElement.style.boxSizing = "border-box";
-      newElement.style.zIndex = 2147483647;
-      // newElement.style.background = `${borderColor}80`;
-
-      // Add floating label at the corner
-      var label = document.createElement("span");
-      label.textContent = index;
-      label.style.position = "absolute";
-      // These we can tweak if we want
-      label.style.top = "-19px";
-      label.style.left = "0px";
-      label.style.background = borderColor;
-      // label.style.background = "black";
-      label.style.color = "white";
-      label.style.padding = "2px 4px";
-      label.style.fontSize = "12px";
-      label.style.borderRadius = "2px";
-      newElement.appendChild(label);
-
-      document.body.appendChild(newElement);
-      labels.push(newElement);
-      // item.element.setAttribute("-ai-label", label.textContent);
-    });
-    item.element.setAttribute("data-mark", `${index}`);
-  });
-  const coordinates = items.flatMap((item) =>
-    item.rects.map(({ left, top, width, height }) => ({
-      x: (left + left + width) / 2,
-      y: (top + top + height) / 2,
-      type: item.type,
-      text: item.text,
-      ariaLabel: item.ariaLabel,
-    })),
-  );
-  return coordinates;
-}
-
-wndow.markPage = markPage;
+const customCSS = `
+        ::-webkit-scrollbar {
+            width: 10px;
+        }
+        ::-webkit-scrollbar-track {
+            background: #27272a;
+        }
+        ::-webkit-scrollbar-thumb {
+            background: #888;
+            border-radius: 0.375rem;
+        }
+        ::-webkit-scrollbar-thumb:hover {
+            background: #555;
+        }
+    `;
+
+function injectStyle() {
+  const styleTag = document.createElement("style");
+  styleTag.textContent = customCSS;
+  document.head.append(styleTag);
+}
+
+// Init scripts run before the document is parsed: wait for a <head>
+if (document.head) {
+  injectStyle();
+} else {
+  document.addEventListener("DOMContentLoaded", injectStyle, { once: true });
+}
+
+const CLICKABLE_TAGS = new Set([
+  "INPUT",
+  "TEXTAREA",
+  "SELECT",
+  "BUTTON",
+  "A",
+  "IFRAME",
+  "VIDEO",
+]);
+// Subtrees that never render anything we could label
+const SKIPPED_TAGS = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE", "HEAD"]);
+const CLIPPING_OVERFLOWS = new Set(["hidden", "clip", "scroll", "auto"]);
+const MIN_AREA = 20;
+const LAYOUT_ATTRIBUTES = new Set(["style", "class", "hidden", "open"]);
+// What changes the page without a DOM mutation: :hover and :focus-within
+// styles (the mouse stays over the clicked element), CSS transitions and
+// animations
+const UNOBSERVED_CHANGE_EVENTS = [
+  "pointerover",
+  "pointerout",
+  "focusin",
+  "focusout",
+  "transitionend",
+  "animationend",
+];
+
+// Marking state, kept between calls so that re-marking can be incremental
+const markState = {
+  // marked element -> { index, rects, color, overlays }
+  items: new Map(),
+  nextIndex: 0,
+  // roots of the subtrees mutated since the last marking
+  dirtyRoots: new Set(),
+  // since the last marking, something may have moved, appeared or been
+  // uncovered outside of the mutated subtrees: the whole page is walked again
+  layoutDirty: true,
+  observer: null,
+  container: null,
+};
+
+function recordMutations(records) {
+  for (const record of records) {
+    if (record.type === "attributes" && record.attributeName === "data-mark") {
+      continue;
+    }
+    const target =
+      record.type === "characterData" ? record.target.parentElement : record.target;
+    if (target && !markState.container?.contains(target)) {
+      markState.dirtyRoots.add(target);
+      if (mayChangeLayoutAround(record)) {
+        markState.layoutDirty = true;
+      }
+    }
+  }
+}
+
+// Removed nodes and restyled elements (e.g. an overlay moved or closed) may
+// uncover or move elements outside of their subtree
+function mayChangeLayoutAround(record) {
+  if (record.type === "childList") {
+    return record.removedNodes.length > 0;
+  }
+  return record.type === "attributes" && LAYOUT_ATTRIBUTES.has(record.attributeName);
+}
+
+function setLayoutDirty() {
+  markState.layoutDirty = true;
+}
+
+function startTracking() {
+  if (markState.observer) {
+    return;
+  }
+  markState.observer = new MutationObserver(recordMutations);
+  markState.observer.observe(document.documentElement, {
+    childList: true,
+    subtree: true,
+    attributes: true,
+    characterData: true,
+  });
+  window.addEventListener("scroll", setLayoutDirty, { capture: true, passive: true });
+  window.addEventListener("resize", setLayoutDirty, { passive: true });
+  for (const type of UNOBSERVED_CHANGE_EVENTS) {
+    document.addEventListener(type, setLayoutDirty, { capture: true, passive: true });
+  }
+}
+
+function stopTracking() {
+  markState.observer?.disconnect();
+  markState.observer = null;
+  window.removeEventListener("scroll", setLayoutDirty, { capture: true });
+  window.removeEventListener("resize", setLayoutDirty);
+  for (const type of UNOBSERVED_CHANGE_EVENTS) {
+    document.removeEventListener(type, setLayoutDirty, { capture: true });
+  }
+}
+
+function unmarkPage() {
+  // Unmark page logic
+  //
+  stopTracking();
+  markState.container?.remove();
+  markState.container = null;
+  markState.items.clear();
+  markState.nextIndex = 0;
+  markState.dirtyRoots.clear();
+  markState.layoutDirty = true;
+  document.querySelectorAll("[data-mark]").forEach((element) => {
+    element.removeAttribute("data-mark");
+  });
+}
+
+function isOutsideViewport(rect, vw, vh) {
+  return (
+    rect.bottom <= 0 || rect.right <= 0 || rect.top >= vh || rect.left >= vw
+  );
+}
+
+// Visible, on-screen portions of the element, i.e. the ones we can label
+function visibleRects(element, vw, vh) {
+  return [...element.getClientRects()]
+    .filter((bb) => {
+      if (bb.width === 0 || bb.height === 0 || isOutsideViewport(bb, vw, vh)) {
+        return false;
+      }
+      var center_x = bb.left + bb.width / 2;
+      var center_y = bb.top + bb.height / 2;
+      var elAtCenter = document.elementFromPoint(center_x, center_y);
+
+      return elAtCenter === element || element.contains(elAtCenter);
+    })
+    .map((bb) => {
+      const rect = {
+        left: Math.max(0, bb.left),
+        top: Math.max(0, bb.top),
+        right: Math.min(vw, bb.right),
+        bottom: Math.min(vh, bb.bottom),
+      };
+      return {
+        ...rect,
+        width: rect.right - rect.left,
+        height: rect.bottom - rect.top,
+      };
+    });
+}
+
+// Whether the box is the containing block of its absolutely positioned
+// descendants: otherwise they escape its overflow clip
+function isContainingBlock(style) {
+  return (
+    style.position !== "static" ||
+    style.transform !== "none" ||
+    style.perspective !== "none" ||
+    style.filter !== "none" ||
+    /paint|layout|strict|content/.test(style.contain)
+  );
+}
+
+function acceptElement(element, vw, vh, stats) {
+  stats.visited++;
+  if (SKIPPED_TAGS.has(element.tagName) || element === markState.container) {
+    return NodeFilter.FILTER_REJECT;
+  }
+  const style = window.getComputedStyle(element);
+  if (style.display === "none") {
+    return NodeFilter.FILTER_REJECT;
+  }
+  if (
+    CLIPPING_OVERFLOWS.has(style.overflowX) &&
+    CLIPPING_OVERFLOWS.has(style.overflowY) &&
+    style.position !== "fixed" &&
+    isContainingBlock(style)
+  ) {
+    // Descendants of a clipping box cannot be drawn outside of it, provided
+    // it is the containing block of the positioned ones (fixed descendants
+    // aside, which are rare enough)
+    const rect = element.getBoundingClientRect();
+    if (isOutsideViewport(rect, vw, vh)) {
+      stats.pruned++;
+      return NodeFilter.FILTER_REJECT;
+    }
+  }
+  const include =
+    CLICKABLE_TAGS.has(element.tagName) ||
+    element.onclick != null ||
+    style.cursor == "pointer";
+  return include ? NodeFilter.FILTER_ACCEPT : NodeFilter.FILTER_SKIP;
+}
+
+function measure(element, vw, vh) {
+  if (window.getComputedStyle(element).visibility === "hidden") {
+    return null;
+  }
+  const rects = visibleRects(element, vw, vh);
+  const area = rects.reduce((acc, rect) => acc + rect.width * rect.height, 0);
+  return area >= MIN_AREA ? rects : null;
+}
+
+// Walk the subtree once, in document order, pruning the subtrees that cannot
+// contain a visible clickable element. Only reads layout: no DOM writes here.
+function collectClickables(root, vw, vh, stats) {
+  const candidates = [];
+  if (root !== document.body && !root.checkVisibility()) {
+    return candidates;
+  }
+  const rootVerdict = acceptElement(root, vw, vh, stats);
+  if (rootVerdict === NodeFilter.FILTER_REJECT) {
+    return candidates;
+  }
+  const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT, {
+    acceptNode: (element) => acceptElement(element, vw, vh, stats),
+  });
+  let element = rootVerdict === NodeFilter.FILTER_ACCEPT ? root : walker.nextNode();
+  for (; element; element = walker.nextNode()) {
+    const rects = measure(element, vw, vh);
+    if (rects) {
+      candidates.push({ element, rects });
+    }
+  }
+  return candidates;
+}
+
+// Outermost connected dirty roots, in document order
+function dirtySubtrees() {
+  // a mutation above <body> (e.g. <body> replaced) means rescanning all of it
+  const dirty = new Set(
+    [...markState.dirtyRoots]
+      .filter((root) => root.isConnected)
+      .map((root) => (root.contains(document.body) ? document.body : root))
+      .filter((root) => document.body.contains(root)),
+  );
+  const roots = [...dirty].filter((root) => {
+    for (let parent = root.parentElement; parent; parent = parent.parentElement) {
+      if (dirty.has(parent)) {
+        return false;
+      }
+    }
+    return true;
+  });
+  return roots.sort((a, b) =>
+    a.compareDocumentPosition(b) & Node.DOCUMENT_POSITION_FOLLOWING ? -1 : 1,
+  );
+}
+
+// Only keep inner clickable items: drop every candidate that contains another
+// one. Ancestors are flagged walking up from each candidate, stopping at the
+// first ancestor already flagged, so every node is flagged at most once.
+function keepInnermost(candidates) {
+  const hasClickableDescendant = new Set();
+  for (const { element } of candidates) {
+    let ancestor = element.parentElement;
+    while (ancestor && !hasClickableDescendant.has(ancestor)) {
+      hasClickableDescendant.add(ancestor);
+      ancestor = ancestor.parentElement;
+    }
+  }
+  return candidates.filter(
+    ({ element }) => !hasClickableDescendant.has(element),
+  );
+}
+
+// Color of a label: random-looking but fixed for an index, so that the same
+// page is always marked (and screenshotted) the same way
+function getLabelColor(index) {
+  const hue = (index * 137.508) % 360;
+  return `hsl(${hue.toFixed(1)}, 85%, 35%)`;
+}
+
+// Lets create a floating border on top of these elements that will always be visible
+function createOverlay(bbox, index, borderColor) {
+  const overlay = document.createElement("div");
+  overlay.style.outline = `2px dashed ${borderColor}`;
+  overlay.style.position = "fixed";
+  overlay.style.left = bbox.left + "px";
+  overlay.style.top = bbox.top + "px";
+  overlay.style.width = bbox.width + "px";
+  overlay.style.height = bbox.height + "px";
+  overlay.style.pointerEvents = "none";
+  overlay.style.boxSizing = "border-box";
+  overlay.style.zIndex = 2147483647;
+
+  // Add floating label at the corner
+  var label = document.createElement("span");
+  label.textContent = index;
+  label.style.position = "absolute";
+  // These we can tweak if we want
+  label.style.top = "-19px";
+  label.style.left = "0px";
+  label.style.background = borderColor;
+  label.style.color = "white";
+  label.style.padding = "2px 4px";
+  label.style.fontSize = "12px";
+  label.style.borderRadius = "2px";
+  overlay.appendChild(label);
+  return overlay;
+}
+
+function sameRects(a, b) {
+  return (
+    a.length === b.length &&
+    a.every(
+      (rect, i) =>
+        rect.left === b[i].left &&
+        rect.top === b[i].top &&
+        rect.width === b[i].width &&
+        rect.height === b[i].height,
+    )
+  );
+}
+
+// Incremental mode keeps the labels of untouched elements: only the subtrees
+// mutated since the last call are walked again, the already marked elements
+// outside of them are just measured again (they may have moved or be covered).
+// When more may have changed (scroll, resize, hover, focus, end of a CSS
+// transition or animation, removal or restyling of an element), the whole
+// page is walked but indices are kept.
+// The first call, or a call without incremental, labels everything from 0.
+function markPage({ incremental = false } = {}) {
+  const start = performance.now();
+  const previous = markState.items;
+  incremental = incremental && markState.observer !== null;
+  if (markState.observer) {
+    recordMutations(markState.observer.takeRecords());
+  }
+  if (!incremental) {
+    unmarkPage();
+  }
+  startTracking();
+
+  const stats = {
+    visited: 0,
+    pruned: 0,
+    candidates: 0,
+    marked: 0,
+    reused: 0,
+    incremental,
+    duration: 0,
+  };
+  var vw = Math.max(
+    document.documentElement.clientWidth || 0,
+    window.innerWidth || 0,
+  );
+  var vh = Math.max(
+    document.documentElement.clientHeight || 0,
+    window.innerHeight || 0,
+  );
+
+  // Read phase: every layout read happens before the first DOM write
+  let candidates = [];
+  if (!incremental || markState.layoutDirty) {
+    candidates = collectClickables(document.body, vw, vh, stats);
+  } else {
+    const roots = dirtySubtrees();
+    const insideDirty = (element) => roots.some((root) => root.contains(element));
+    for (const element of previous.keys()) {
+      if (!element.isConnected || insideDirty(element)) {
+        continue;
+      }
+      const rects = measure(element, vw, vh);
+      if (rects) {
+        candidates.push({ element, rects });
+      }
+    }
+    for (const root of roots) {
+      candidates.push(...collectClickables(root, vw, vh, stats));
+    }
+  }
+  stats.candidates = candidates.length;
+  const kept = keepInnermost(candidates);
+  stats.marked = kept.length;
+
+  // Write phase
+  if (!markState.container?.isConnected) {
+    markState.container = document.createElement("div");
+    markState.container.setAttribute("data-marks-overlay", "");
+    markState.container.style.position = "fixed";
+    markState.container.style.top = "0px";
+    markState.container.style.left = "0px";
+    markState.container.style.pointerEvents = "none";
+    markState.container.style.zIndex = 2147483647;
+    for (const item of previous.values()) {
+      item.overlays = [];
+    }
+  }
+  const items = new Map();
+  const fragment = document.createDocumentFragment();
+  for (const { element, rects } of kept) {
+    const item = previous.get(element);
+    if (item) {
+      stats.reused++;
+      previous.delete(element);
+      if (element.getAttribute("data-mark") !== `${item.index}`) {
+        element.setAttribute("data-mark", `${item.index}`);
+      }
+      if (item.overlays.length > 0 && sameRects(item.rects, rects)) {
+        items.set(element, item);
+        continue;
+      }
+      item.overlays.forEach((overlay) => overlay.remove());
+      items.set(element, { ...item, rects, overlays: [] });
+    } else {
+      const index = markState.nextIndex++;
+      element.setAttribute("data-mark", `${index}`);
+      items.set(element, { index, rects, color: getLabelColor(index), overlays: [] });
+    }
+    const current = items.get(element);
+    current.overlays = rects.map((bbox) =>
+      fragment.appendChild(createOverlay(bbox, current.index, current.color)),
+    );
+  }
+  // Elements that are no longer visible (or clickable) lose their label
+  for (const [element, item] of previous) {
+    item.overlays.forEach((overlay) => overlay.remove());
+    element.removeAttribute("data-mark");
+  }
+  markState.container.appendChild(fragment);
+  if (!markState.container.isConnected) {
+    document.body.appendChild(markState.container);
+  }
+  markState.items = items;
+  markState.dirtyRoots.clear();
+  markState.layoutDirty = false;
+  // Our own writes are not changes to relabel
+  markState.observer.takeRecords();
+
+  const coordinates = [...items.entries()]
+    .sort(([, a], [, b]) => a.index - b.index)
+    .flatMap(([element, item]) =>
+      item.rects.map(({ left, top, width, height }) => ({
+        x: (left + left + width) / 2,
+        y: (top + top + height) / 2,
+        type: element.tagName.toLowerCase(),
+        text: element.textContent.trim().replace(/\s{2,}/g, " "),
+        ariaLabel: element.getAttribute("aria-label") || "",
+      })),
+    );
+  stats.duration = performance.now() - start;
+  return { coordinates, stats };
+}
+
+window.markPage = markPage;
+window.unmarkPage = unmarkPage;
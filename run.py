@@ -12,6 +12,7 @@ if __name__ == "__main__":
 
 from VTAAS.data.testcase import TestCase
 from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.registry import close_sdk_clients
 from VTAAS.orchestrator.orchestrator import Orchestrator
 from VTAAS.schemas.verdict import Status
 from VTAAS.workers.browser import Browser
@@ -77,6 +78,7 @@ async def run_testcase(test_case: TestCase, output_folder: str, provider: str):
             orchestrator.logger.info("SUCCESS!")
         else:
             orchestrator.logger.info(f"FAIL at step {execution_result.step_index}!")
+    await close_sdk_clients()
 
 
 async def main():
@@ -0,0 +1 @@
+from .runner import EvaluationRunner as EvaluationRunner
@@ -0,0 +1,172 @@
+from collections.abc import Iterable, Iterator
+from dataclasses import asdict, dataclass, field
+import json
+import os
+from pathlib import Path
+
+from ..schemas.verdict import Status
+from .metrics import EvaluationResults, empty_metrics, outcome
+
+LEDGER_FILE = "results.jsonl"
+
+
+@dataclass(frozen=True)
+class LedgerEntry:
+    """The outcome of one test case execution"""
+
+    test_case: str
+    type: str
+    failing_step: int
+    status: Status
+    step_index: int
+    timing: dict[str, float] = field(default_factory=dict)
+    """seconds spent resetting the application, warming up and testing"""
+    llm: dict[str, float] = field(default_factory=dict)
+    """llm_* usage totals of the test case"""
+    shard: str | None = None
+    finished_at: float = 0.0
+    position: int = -1
+    """index of the test case in its collection, -1 if unknown"""
+
+    @property
+    def result(self) -> tuple[Status, int, int]:
+        return (self.status, self.step_index, self.failing_step)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, line: str) -> "LedgerEntry":
+        fields = json.loads(line)
+        fields["status"] = Status(fields["status"])
+        return cls(**fields)
+
+
+def read_entries(path: str | Path) -> Iterator[LedgerEntry]:
+    """Entries of a ledger file; a last line cut short by a crash is skipped"""
+    with open(path) as fp:
+        for line in fp:
+            if not line.endswith("\n"):
+                break
+            if line.strip():
+                yield LedgerEntry.from_json(line)
+
+
+class ResultsLedger:
+    """
+    Append-only JSON lines file of the test case results of an output folder:
+    what ran there, what to resume from, and what its metrics are computed
+    from. Each entry is on disk before the next test case is recorded. A test
+    case's latest entry replaces the previous ones; metrics are updated entry
+    by entry instead of being recomputed.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path: Path = Path(path)
+        self.entries: dict[str, LedgerEntry] = {}
+        self._counts: dict[str, float] = empty_metrics()
+        self._totals: dict[str, float] = {}
+        if self.path.exists():
+            for entry in read_entries(self.path):
+                self._add(entry)
+
+    def __contains__(self, test_case_id: str) -> bool:
+        return test_case_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, entry: LedgerEntry) -> None:
+        self.extend([entry])
+
+    def extend(self, entries: Iterable[LedgerEntry]) -> None:
+        entries = list(entries)
+        with open(self.path, "a") as fp:
+            for entry in entries:
+                _ = fp.write(entry.to_json() + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        for entry in entries:
+            self._add(entry)
+
+    def _add(self, entry: LedgerEntry) -> None:
+        previous = self.entries.pop(entry.test_case, None)
+        if previous is not None:
+            self._count(previous, -1)
+        self.entries[entry.test_case] = entry
+        self._count(entry, 1)
+
+    def _count(self, entry: LedgerEntry, sign: int) -> None:
+        key = outcome(entry.type, entry.failing_step, entry.status, entry.step_index)
+        if key is not None:
+            self._counts[key] += sign
+        totals = {
+            "reset_time": entry.timing.get("reset", 0.0),
+            "test_time": entry.timing.get("test", 0.0),
+            **entry.llm,
+        }
+        for name, value in totals.items():
+            self._totals[name] = self._totals.get(name, 0.0) + sign * value
+
+    def metrics(self) -> dict[str, float]:
+        """
+        Outcome counts, with the reset and test time totals when the
+        application was reset and the LLM usage totals when LLMs were called
+        """
+        metrics = dict(self._counts)
+        if self._totals.get("reset_time"):
+            metrics["reset_time"] = self._totals["reset_time"]
+            metrics["test_time"] = self._totals["test_time"]
+        if self._totals.get("llm_calls"):
+            metrics.update(
+                {k: v for k, v in self._totals.items() if k.startswith("llm_")}
+            )
+        return metrics
+
+    def results(self, order: Iterable[str] | None = None) -> EvaluationResults:
+        """Results of the recorded test cases, in the given or collection order"""
+        ids = (
+            sorted(self.entries, key=lambda id: self.entries[id].position)
+            if order is None
+            else order
+        )
+        return {id: self.entries[id].result for id in ids if id in self.entries}
+
+
+@dataclass(frozen=True)
+class Shard:
+    """The index-th of count slices of a collection, e.g. 2/4 (1-based)"""
+
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, spec: str) -> "Shard":
+        index, _, count = spec.partition("/")
+        shard = cls(int(index), int(count))
+        if not 1 <= shard.index <= shard.count:
+            raise ValueError(f"Invalid shard {spec}, expected i/n with 1 <= i <= n")
+        return shard
+
+    def includes(self, position: int) -> bool:
+        """Test cases are dealt round robin, by position in the collection"""
+        return position % self.count == self.index - 1
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def merge_ledgers(
+    sources: Iterable[str | Path], destination: str | Path
+) -> ResultsLedger:
+    """
+    Merges ledgers (of shards, or of successive runs) into the destination
+    one. The latest entry of each test case wins.
+    """
+    entries = sorted(
+        (entry for source in sources for entry in read_entries(source)),
+        key=lambda entry: entry.finished_at,
+    )
+    ledger = ResultsLedger(destination)
+    ledger.extend(entries)
+    return ledger
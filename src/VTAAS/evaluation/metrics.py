@@ -0,0 +1,53 @@
+from ..data.testcase import TestCase
+from ..schemas.verdict import Status
+
+EvaluationResults = dict[str, tuple[Status, int, int]]
+
+
+def empty_metrics() -> dict[str, float]:
+    """Raw counters tracked while a collection is being evaluated."""
+    return {"FN": 0, "TN": 0, "FP": 0, "AFA": 0, "AFB": 0, "AFC": 0}
+
+
+def failing_step(test_case: TestCase) -> int:
+    """The step a failing test case is expected to fail at, -1 for the others."""
+    return test_case.failing_step if test_case.type == "F" else -1
+
+
+def outcome(
+    type: str, failing_step: int, status: Status, step_index: int
+) -> str | None:
+    """The raw counter a verdict falls in, for a test case of this type."""
+    if status == Status.PASS:
+        return {"F": "FN", "P": "TN"}.get(type)
+    if type == "F":
+        if step_index < failing_step:
+            return "AFB"
+        if step_index == failing_step:
+            return "AFC"
+        return "AFA"
+    if type == "P":
+        return "FP"
+    return None
+
+
+def finalize_metrics(metrics: dict[str, float]) -> dict[str, float]:
+    """Derive the aggregated scores from the raw counters."""
+    metrics["TP"] = metrics["AFA"] + metrics["AFB"] + metrics["AFC"]
+    total = metrics["TP"] + metrics["TN"] + metrics["FP"] + metrics["FN"]
+    metrics["accuracy"] = (metrics["TP"] + metrics["TN"]) / total if total > 0 else 0
+    metrics["specificity"] = (
+        metrics["TN"] / (metrics["TN"] + metrics["FP"])
+        if (metrics["TN"] + metrics["FP"]) > 0
+        else 0
+    )
+    metrics["sensitivity"] = (
+        metrics["TP"] / (metrics["TP"] + metrics["FN"])
+        if (metrics["TP"] + metrics["FN"]) > 0
+        else 0
+    )
+    metrics["AER"] = metrics["AFB"] / metrics["TP"] if metrics["TP"] > 0 else 0
+    metrics["HER"] = metrics["AFA"] / metrics["TP"] if metrics["TP"] > 0 else 0
+    metrics["SMER"] = metrics["AER"] + metrics["HER"]
+    metrics["truacc"] = (metrics["AFC"] + metrics["TN"]) / total if total > 0 else 0
+    return metrics
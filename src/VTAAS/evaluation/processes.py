@@ -0,0 +1,249 @@
+import asyncio
+from collections.abc import Callable
+import multiprocessing
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+import os
+import queue
+import traceback
+from typing import Any, final, override
+
+from ..data.testcase import TestCase, TestCaseCollection
+from ..llm.accounting import CallRecord
+from ..llm.llm_client import LLMProvider
+from ..llm.retry import drop_rate_limiters
+from ..llm.scheduler import DEFAULT_MAX_IN_FLIGHT, drop_llm_scheduler
+from .ledger import LedgerEntry, Shard
+from .reset import ResetBackend
+from .runner import EvaluationRunner
+
+CollectionFactory = Callable[[], TestCaseCollection]
+"""Builds the collection in each process, e.g. partial(TestCaseCollection, file, url)"""
+
+
+def process_limits(processes: int) -> dict[str, str]:
+    """
+    Each process's share of the per-provider LLM limits, as the environment
+    variables that set them (VTAAS_MAX_IN_FLIGHT_<PROVIDER>, at least 1, and
+    VTAAS_RPM_<PROVIDER>): every process would otherwise use the whole limit.
+    """
+    limits: dict[str, str] = {}
+    for provider in LLMProvider:
+        in_flight = os.getenv(f"VTAAS_MAX_IN_FLIGHT_{provider.name}")
+        share = (int(in_flight) if in_flight else DEFAULT_MAX_IN_FLIGHT) // processes
+        limits[f"VTAAS_MAX_IN_FLIGHT_{provider.name}"] = str(max(1, share))
+        rpm = os.getenv(f"VTAAS_RPM_{provider.name}")
+        if rpm:
+            limits[f"VTAAS_RPM_{provider.name}"] = str(float(rpm) / processes)
+    return limits
+
+
+def _use_limits(limits: dict[str, str]) -> None:
+    """
+    Applies the process's limits. A forked process inherits the scheduler and
+    rate limiters of the coordinator: they are dropped, to be built again.
+    """
+    os.environ.update(limits)
+    drop_llm_scheduler()
+    drop_rate_limiters()
+
+
+@final
+class _ProcessRunner(EvaluationRunner):
+    """
+    Runs the test cases assigned to an evaluation process and streams their
+    ledger entries to the coordinator, which owns the ledger
+    """
+
+    def __init__(
+        self,
+        index: int,
+        assigned: list[str],
+        results: "Queue[tuple[Any, ...]]",
+        collection: TestCaseCollection,
+        output_folder: str,
+        llm_provider: LLMProvider,
+        workers: int,
+        app_urls: list[str],
+        reset: ResetBackend | None,
+        shard: Shard | None,
+    ):
+        super().__init__(
+            collection, output_folder, llm_provider, workers, app_urls, reset, shard
+        )
+        self.index: int = index
+        self.assigned: set[str] = set(assigned)
+        self.results: "Queue[tuple[Any, ...]]" = results
+
+    @override
+    def _pending(self) -> list[TestCase]:
+        """The coordinator selected the test cases and claimed their folders"""
+        return [
+            test_case for test_case in self.collection if test_case.id in self.assigned
+        ]
+
+    @override
+    def record(self, entry: LedgerEntry) -> None:
+        self.results.put(("entry", entry))
+
+    @override
+    def _write_summaries(self) -> None:
+        """The coordinator writes them"""
+
+
+def _process_main(
+    index: int,
+    assigned: list[str],
+    results: "Queue[tuple[Any, ...]]",
+    collection_factory: CollectionFactory,
+    output_folder: str,
+    llm_provider: LLMProvider,
+    workers: int,
+    app_urls: list[str],
+    reset: ResetBackend | None,
+    shard: Shard | None,
+    limits: dict[str, str],
+) -> None:
+    """
+    Entry point of an evaluation process, with its own event loop and its
+    share of the LLM limits. Its last message is always ("done", index, LLM
+    call records, LLM reports, error).
+    """
+    records: list[CallRecord] = []
+    reports: dict[str, object] = {}
+    error: str | None = None
+    try:
+        _use_limits(limits)
+        runner = _ProcessRunner(
+            index,
+            assigned,
+            results,
+            collection_factory(),
+            output_folder,
+            llm_provider,
+            workers,
+            app_urls,
+            reset,
+            shard,
+        )
+        try:
+            _ = asyncio.run(runner.run())
+        finally:
+            records, reports = runner.llm_usage.records, runner.llm_reports()
+    except BaseException:
+        error = traceback.format_exc()
+    results.put(("done", index, records, reports, error))
+
+
+@final
+class MultiProcessRunner(EvaluationRunner):
+    """
+    Spreads the test cases over several processes, each with its own event
+    loop, browser pool and workers, so that validation, screenshot
+    processing and logging use several cores. The processes stream their
+    results to this coordinator, which owns the ledger and the metrics.
+    With a reset backend, each process gets its own application replicas.
+    The per-provider LLM limits (requests in flight, requests per minute) are
+    shared out between the processes.
+    """
+
+    def __init__(
+        self,
+        collection_factory: CollectionFactory,
+        output_folder: str,
+        llm_provider: LLMProvider,
+        processes: int = 2,
+        workers: int = 1,
+        app_urls: list[str] | None = None,
+        reset: ResetBackend | None = None,
+        shard: Shard | None = None,
+        start_method: str = "spawn",
+    ):
+        super().__init__(
+            collection_factory(),
+            output_folder,
+            llm_provider,
+            workers,
+            app_urls,
+            reset,
+            shard,
+        )
+        if processes < 1:
+            raise ValueError("at least one process is required")
+        if reset is not None and len(self.app_urls) < processes:
+            raise ValueError("with a reset backend, give each process a replica")
+        self.collection_factory: CollectionFactory = collection_factory
+        self.processes: int = processes
+        self.start_method: str = start_method
+        self._reports: dict[str, dict[str, object]] = {}
+
+    def _app_urls(self, index: int) -> list[str]:
+        """Replicas are shared, unless resets need them exclusive"""
+        if self.reset is None:
+            return self.app_urls
+        return self.app_urls[index :: self.processes]
+
+    @override
+    async def _execute(self, test_cases: list[TestCase]) -> None:
+        context = multiprocessing.get_context(self.start_method)
+        results: Queue[tuple[Any, ...]] = context.Queue()
+        processes: list[BaseProcess] = []
+        limits = process_limits(min(self.processes, len(test_cases)) or 1)
+        for index in range(self.processes):
+            assigned = [
+                test_case.id for test_case in test_cases[index :: self.processes]
+            ]
+            if not assigned:
+                continue
+            process = context.Process(
+                target=_process_main,
+                name=f"evaluation-{index + 1}",
+                args=(
+                    index + 1,
+                    assigned,
+                    results,
+                    self.collection_factory,
+                    self.output_folder,
+                    self.llm_provider,
+                    self.workers,
+                    self._app_urls(index),
+                    self.reset,
+                    self.shard,
+                    limits,
+                ),
+            )
+            process.start()
+            processes.append(process)
+
+        running = len(processes)
+        while running > 0:
+            try:
+                message = await asyncio.to_thread(results.get, True, 1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    print(f"{running} evaluation process(es) exited without results")
+                    break
+                continue
+            match message:
+                case ("entry", LedgerEntry() as entry):
+                    self.record(entry)
+                case ("done", int(index), list(records), dict(reports), error):
+                    running -= 1
+                    for record in records:
+                        self.llm_usage.add(record)
+                    if reports:
+                        self._reports[f"process {index}"] = reports
+                    if error is not None:
+                        print(f"Evaluation process {index} failed:\n{error}")
+                case _:
+                    raise ValueError(f"Unexpected message from a process: {message}")
+        for process in processes:
+            await asyncio.to_thread(process.join)
+
+    @override
+    def llm_reports(self) -> dict[str, object]:
+        """The reports of each process"""
+        return {
+            name: {process: reports[name] for process, reports in self._reports.items()}
+            for name in ("llm_queue.json", "llm_decoding.json")
+        }
@@ -0,0 +1,211 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+import datetime
+import os
+import random
+import shlex
+import string
+import time
+from typing import Any, Protocol, final, runtime_checkable
+from urllib.error import URLError
+from urllib.parse import urlparse
+import urllib.request
+
+import requests
+
+ResetCallback = Callable[[str], Awaitable[None]]
+
+
+class ResetError(RuntimeError):
+    """The application could not be reset, or did not come back"""
+
+
+@runtime_checkable
+class ResetBackend(Protocol):
+    """Brings an application instance back to its initial state"""
+
+    async def reset(self, url: str) -> None: ...
+
+
+@final
+class NoReset:
+    """Leaves the application as it is"""
+
+    async def reset(self, url: str) -> None:
+        pass
+
+
+@final
+class FakeReset:
+    """Records the resets and takes `delay` seconds, for tests"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay: float = delay
+        self.resets: list[str] = []
+
+    async def reset(self, url: str) -> None:
+        self.resets.append(url)
+        await asyncio.sleep(self.delay)
+
+
+@final
+class CallbackReset:
+    """Adapts a plain async function"""
+
+    def __init__(self, callback: ResetCallback):
+        self.callback: ResetCallback = callback
+
+    async def reset(self, url: str) -> None:
+        await self.callback(url)
+
+
+def as_reset_backend(reset: ResetBackend | ResetCallback) -> ResetBackend:
+    """Plain async functions are still accepted as backends"""
+    return reset if isinstance(reset, ResetBackend) else CallbackReset(reset)
+
+
+async def wait_until_ready(
+    url: str,
+    timeout: float = 600.0,
+    interval: float = 2.0,
+    successes: int = 2,
+) -> None:
+    """
+    Readiness probe: the application must answer `successes` requests in a
+    row. Probes run in a thread, the event loop is never blocked.
+    """
+
+    def probe() -> bool:
+        try:
+            with urllib.request.urlopen(url, timeout=3):
+                return True
+        except (URLError, TimeoutError, OSError):
+            return False
+
+    deadline = time.monotonic() + timeout
+    in_a_row = 0
+    while in_a_row < successes:
+        if await asyncio.to_thread(probe):
+            in_a_row += 1
+            continue
+        in_a_row = 0
+        if time.monotonic() > deadline:
+            raise ResetError(f"{url} is not ready after {timeout:.0f}s")
+        await asyncio.sleep(interval)
+
+
+@final
+class CommandReset:
+    """
+    Resets with local commands, e.g. a database dump restore or a container
+    checkpoint restore, then waits for the application to answer. The command
+    is a template: {url}, {host} and {port} are replaced by the instance's.
+    """
+
+    def __init__(
+        self,
+        command: str,
+        ready_timeout: float = 600.0,
+        probe_interval: float = 2.0,
+    ):
+        self.command: str = command
+        self.ready_timeout: float = ready_timeout
+        self.probe_interval: float = probe_interval
+
+    def render(self, url: str) -> str:
+        parsed = urlparse(url)
+        return self.command.format(
+            url=shlex.quote(url),
+            host=shlex.quote(parsed.hostname or ""),
+            port=parsed.port or "",
+        )
+
+    async def reset(self, url: str) -> None:
+        command = self.render(url)
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            raise ResetError(
+                f"`{command}` exited with {process.returncode}:\n"
+                + output.decode(errors="replace")[-2000:]
+            )
+        await wait_until_ready(url, self.ready_timeout, self.probe_interval)
+
+
+GITHUB_WORKFLOWS = {
+    9999: "reset_postmill.yaml",
+    7770: "reset_shopping.yaml",
+    9980: "reset_classifieds.yaml",
+}
+
+
+@final
+class GitHubWorkflowReset:
+    """
+    Resets the benchmark applications with their GitHub Actions workflow,
+    identified by the port of the application. Needs GITHUB_TOKEN. A reset
+    takes minutes: the API is polled without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        repository: str = "Smartesting/vtaas-benchmark",
+        token: str | None = None,
+    ):
+        self.api: str = f"https://api.github.com/repos/{repository}/actions"
+        self.token: str | None = token
+
+    async def _get(self, url: str) -> Any:
+        response = await asyncio.to_thread(requests.get, url, headers=self._headers())
+        return response.json()
+
+    def _headers(self) -> dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"token {self.token or os.environ['GITHUB_TOKEN']}",
+        }
+
+    async def reset(self, url: str) -> None:
+        port = urlparse(url).port
+        if port not in GITHUB_WORKFLOWS:
+            raise ValueError(f"No reset workflow for application port {port}")
+        print(f"Initialising application reset ({url})")
+        run_date_filter = (
+            datetime.datetime.now(datetime.UTC) - datetime.timedelta(minutes=2)
+        ).strftime("%Y-%m-%dT%H:%M")
+        run_identifier = "".join(
+            random.choices(string.ascii_uppercase + string.digits, k=15)
+        )
+        _ = await asyncio.to_thread(
+            requests.post,
+            f"{self.api}/workflows/{GITHUB_WORKFLOWS[port]}/dispatches",
+            headers=self._headers(),
+            json={"ref": "main", "inputs": {"run_identifier": run_identifier}},
+        )
+        run_id = await self._find_run(run_date_filter, run_identifier)
+
+        status = "in_progress"
+        while status != "completed":
+            await asyncio.sleep(20)
+            status = (await self._get(f"{self.api}/runs/{run_id}"))["status"]
+            print(f"Database reset : {status}")
+
+        print("Reset successful. Waiting for application to restart")
+        await wait_until_ready(url, interval=10)
+
+    async def _find_run(self, created_after: str, run_identifier: str) -> str:
+        """The workflow run whose second step is named after run_identifier"""
+        while True:
+            runs = await self._get(f"{self.api}/runs?created=%3E{created_after}")
+            for workflow in runs["workflow_runs"]:
+                jobs = (await self._get(workflow["jobs_url"]))["jobs"]
+                for job in jobs:
+                    steps = job["steps"]
+                    if len(steps) >= 2 and steps[1]["name"] == run_identifier:
+                        return job["run_id"]
+            await asyncio.sleep(3)
@@ -0,0 +1,353 @@
+import asyncio
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import time
+import traceback
+
+from playwright.async_api import async_playwright
+
+from ..data.testcase import TestCase, TestCaseCollection
+from ..llm.accounting import UsageRecorder, call_tags, recording_usage
+from ..llm.batch import drop_batch_collectors
+from ..llm.llm_client import LLMProvider
+from ..llm.registry import close_sdk_clients
+from ..llm.decoding import decode_stats
+from ..llm.scheduler import llm_scheduler
+from ..orchestrator.orchestrator import Orchestrator
+from ..schemas.verdict import Status, TestCaseVerdict
+from ..utils.logger import release_worker_loggers
+from ..workers.browser import Browser
+from ..workers.browser_pool import BrowserPool
+from .ledger import LEDGER_FILE, LedgerEntry, ResultsLedger, Shard
+from .metrics import EvaluationResults, failing_step, finalize_metrics
+from .reset import ResetBackend, ResetCallback, as_reset_backend
+
+
+@dataclass
+class Environment:
+    """What a test case runs on, prepared ahead of time"""
+
+    test_case: TestCase
+    app_url: str
+    browser: Browser
+    timing: dict[str, float]
+    """seconds spent resetting the application, warming up and testing"""
+
+
+async def _close_quietly(browser: Browser) -> None:
+    """Closes a browser left open by a failure, which may have closed it already"""
+    try:
+        await browser.close()
+    except Exception:
+        pass
+
+
+class EvaluationRunner:
+    """
+    Runs the test cases of a collection, or of a shard of it, on a bounded
+    pool of workers. Results go to the ledger of the output folder as soon
+    as each test case is over: an interrupted run resumes from it.
+    Each test case gets its own browser context of a pool of Chromium
+    processes, so executions are isolated. While a worker runs a test case,
+    the environment of its next one (reset application, browser context
+    already on the application) is prepared.
+    With a reset backend, a test case holds its application instance
+    exclusively from the reset until it is over: give more urls (application
+    replicas) than workers so that resets overlap test executions. Reset,
+    warm-up and test times are measured separately.
+    """
+
+    def __init__(
+        self,
+        collection: TestCaseCollection,
+        output_folder: str,
+        llm_provider: LLMProvider,
+        workers: int = 1,
+        app_urls: list[str] | None = None,
+        reset: ResetBackend | ResetCallback | None = None,
+        shard: Shard | None = None,
+    ):
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+        self.collection: TestCaseCollection = collection
+        self.output_folder: str = output_folder
+        self.llm_provider: LLMProvider = llm_provider
+        self.workers: int = workers
+        self.app_urls: list[str] = app_urls or [collection.url]
+        self.reset: ResetBackend | None = (
+            as_reset_backend(reset) if reset is not None else None
+        )
+        self.shard: Shard | None = shard
+        self._positions: dict[str, int] = {
+            test_case.id: position for position, test_case in enumerate(collection)
+        }
+        self.ledger: ResultsLedger = ResultsLedger(Path(output_folder) / LEDGER_FILE)
+        self.llm_usage: UsageRecorder = UsageRecorder()
+        self._free_apps: asyncio.Queue[str] = asyncio.Queue()
+        self._untaken: int = 0
+        """prepared or queued test cases no worker has taken yet"""
+
+    async def run(self) -> tuple[EvaluationResults, dict[str, float]]:
+        """
+        Evaluate every test case of the shard that is not in the ledger of the
+        output folder yet. Results and metrics cover the whole ledger.
+        """
+        os.makedirs(self.output_folder, exist_ok=True)
+        test_cases = self._pending()
+        try:
+            await self._execute(test_cases)
+        finally:
+            self._write_summaries()
+        return self._ordered_results(), finalize_metrics(self.ledger.metrics())
+
+    def _pending(self) -> list[TestCase]:
+        """The test cases of the shard missing from the ledger, in fresh folders"""
+        self._seed_ledger()
+        test_cases: list[TestCase] = []
+        for position, test_case in enumerate(self.collection):
+            if self.shard is not None and not self.shard.includes(position):
+                continue
+            if test_case.id in self.ledger:
+                print(f"TC_{test_case.id} already evaluated")
+                continue
+            self._claim_folder(test_case)
+            test_cases.append(test_case)
+        return test_cases
+
+    async def _execute(self, test_cases: list[TestCase]) -> None:
+        """Runs the test cases on the workers of this process"""
+        queue: asyncio.Queue[TestCase] = asyncio.Queue()
+        for test_case in test_cases:
+            queue.put_nowait(test_case)
+        self._free_apps = asyncio.Queue()
+        for url in self.app_urls:
+            self._free_apps.put_nowait(url)
+
+        try:
+            with recording_usage(self.llm_usage):
+                async with (
+                    async_playwright() as p,
+                    BrowserPool(p, log_folder=self.output_folder) as pool,
+                    asyncio.TaskGroup() as tg,
+                ):
+                    ready: asyncio.Queue[Environment | None] = asyncio.Queue(1)
+                    self._untaken = queue.qsize()
+                    for slot in range(min(self.workers, queue.qsize())):
+                        app_url = self.app_urls[slot % len(self.app_urls)]
+                        _ = tg.create_task(self._preparer(pool, queue, ready, app_url))
+                        _ = tg.create_task(self._worker(ready))
+        finally:
+            await close_sdk_clients()
+            drop_batch_collectors()
+
+    async def _preparer(
+        self,
+        pool: BrowserPool,
+        queue: asyncio.Queue[TestCase],
+        ready: asyncio.Queue[Environment | None],
+        app_url: str,
+    ) -> None:
+        """
+        Prepares the environments of the queued test cases, the next one as
+        soon as the previous one is taken by a worker. A test case whose
+        environment could not be prepared is handed over as None.
+        """
+        while not queue.empty():
+            test_case = queue.get_nowait()
+            try:
+                environment = await self._prepare(pool, test_case, app_url)
+            except Exception:
+                self._report_failure(test_case, "preparation")
+                environment = None
+            await ready.put(environment)
+
+    async def _worker(self, ready: asyncio.Queue[Environment | None]) -> None:
+        """
+        Runs the prepared test cases, whichever preparer they come from. A
+        failing test case does not stop the others: it is left out of the
+        ledger, so that a resumed run executes it again.
+        """
+        while self._untaken > 0:
+            self._untaken -= 1
+            environment = await ready.get()
+            if environment is None:
+                continue
+            try:
+                verdict = await self._timed_test_case(environment)
+            except Exception:
+                self._report_failure(environment.test_case, "execution")
+                await _close_quietly(environment.browser)
+                continue
+            finally:
+                self._release(environment.app_url)
+            self._record(environment, verdict)
+
+    async def _prepare(
+        self, pool: BrowserPool, test_case: TestCase, app_url: str
+    ) -> Environment:
+        """
+        Resets an application instance, opens a browser context of the pool
+        and loads the application in it. With a reset backend, the instance is the first free
+        one, held until the test case is over; otherwise it is app_url.
+        """
+        timing = {"reset": 0.0, "warmup": 0.0, "test": 0.0}
+        if self.reset is not None:
+            app_url = await self._free_apps.get()
+        browser: Browser | None = None
+        try:
+            if self.reset is not None:
+                start = time.perf_counter()
+                await self.reset.reset(app_url)
+                timing["reset"] = time.perf_counter() - start
+            test_case.url = app_url
+            start = time.perf_counter()
+            browser = await Browser.create(
+                name=f"TC_{test_case.id}",
+                headless=True,
+                pool=pool,
+                save_screenshot=True,
+                tracer=True,
+                trace_folder=str(self._test_case_folder(test_case)),
+            )
+            _ = await browser.preload(app_url)
+            timing["warmup"] = time.perf_counter() - start
+        except BaseException:
+            self._release(app_url)
+            if browser is not None:
+                await _close_quietly(browser)
+            raise
+        return Environment(test_case, app_url, browser, timing)
+
+    def _report_failure(self, test_case: TestCase, stage: str) -> None:
+        """Logs the exception being handled to the test case folder"""
+        error_log = self._test_case_folder(test_case) / "error.log"
+        os.makedirs(error_log.parent, exist_ok=True)
+        with open(error_log, "a") as fp:
+            _ = fp.write(f"{stage} failed:\n{traceback.format_exc()}\n")
+        print(f"TC_{test_case.id} {stage} failed, see {error_log}")
+
+    def _release(self, app_url: str) -> None:
+        if self.reset is not None:
+            self._free_apps.put_nowait(app_url)
+
+    async def _timed_test_case(self, environment: Environment) -> TestCaseVerdict:
+        start = time.perf_counter()
+        try:
+            return await self.run_test_case(environment)
+        finally:
+            environment.timing["test"] = time.perf_counter() - start
+
+    async def run_test_case(self, environment: Environment) -> TestCaseVerdict:
+        test_case = environment.test_case
+        output_folder = str(self._test_case_folder(test_case))
+        orchestrator = Orchestrator(
+            name=f"TC_{test_case.id}",
+            browser=environment.browser,
+            llm_provider=self.llm_provider,
+            tracer=True,
+            output_folder=output_folder,
+        )
+        try:
+            with call_tags(test_case=test_case.id):
+                return await orchestrator.process_testcase(test_case)
+        finally:
+            release_worker_loggers(output_folder)
+
+    def _record(self, environment: Environment, verdict: TestCaseVerdict) -> None:
+        test_case = environment.test_case
+        self.record(
+            LedgerEntry(
+                test_case=test_case.id,
+                type=test_case.type,
+                failing_step=failing_step(test_case),
+                status=verdict.status,
+                step_index=verdict.step_index,
+                timing=environment.timing,
+                llm=self.llm_usage.totals(test_case.id),
+                shard=str(self.shard) if self.shard else None,
+                finished_at=time.time(),
+                position=self._positions[test_case.id],
+            )
+        )
+
+    def record(self, entry: LedgerEntry) -> None:
+        """Appends the test case to the ledger, then updates metrics.json"""
+        self.ledger.append(entry)
+        with open(f"{self.output_folder}/metrics.json", "w") as fp:
+            json.dump(self.ledger.metrics(), fp)
+
+    def _write_summaries(self) -> None:
+        """Results, metrics and LLM reports of the output folder, once the run is over"""
+        with open(f"{self.output_folder}/result.json", "w") as fp:
+            json.dump(self._ordered_results(), fp)
+        with open(f"{self.output_folder}/metrics.json", "w") as fp:
+            json.dump(self.ledger.metrics(), fp)
+        with open(f"{self.output_folder}/timings.json", "w") as fp:
+            json.dump(
+                {
+                    test_case.id: self.ledger.entries[test_case.id].timing
+                    for test_case in self.collection
+                    if test_case.id in self.ledger
+                },
+                fp,
+                indent=2,
+            )
+        for name, report in self.llm_reports().items():
+            with open(f"{self.output_folder}/{name}", "w") as fp:
+                json.dump(report, fp, indent=2)
+        self.llm_usage.dump(f"{self.output_folder}/llm_usage.json")
+
+    def llm_reports(self) -> dict[str, object]:
+        """LLM queue and decoding reports, by file name"""
+        return {
+            "llm_queue.json": llm_scheduler().metrics(),
+            "llm_decoding.json": decode_stats().summary(),
+        }
+
+    def _ordered_results(self) -> EvaluationResults:
+        """Results in collection order, whatever the completion order was"""
+        return self.ledger.results(test_case.id for test_case in self.collection)
+
+    def _seed_ledger(self) -> None:
+        """
+        An output folder evaluated before it had a ledger only has result.json:
+        its results start the ledger, so that they are neither run again nor
+        moved aside
+        """
+        result_file = Path(self.output_folder) / "result.json"
+        if self.ledger.path.exists() or not result_file.exists():
+            return
+        with open(result_file) as fp:
+            results = json.load(fp)
+        finished_at = result_file.stat().st_mtime
+        entries = [
+            LedgerEntry(
+                test_case=test_case.id,
+                type=test_case.type,
+                failing_step=failing_step(test_case),
+                status=Status(results[test_case.id][0]),
+                step_index=results[test_case.id][1],
+                finished_at=finished_at,
+                position=position,
+            )
+            for position, test_case in enumerate(self.collection)
+            if test_case.id in results
+        ]
+        print(f"Starting the ledger with the {len(entries)} results of {result_file}")
+        self.ledger.extend(entries)
+
+    def _claim_folder(self, test_case: TestCase) -> None:
+        """A fresh folder: what an unfinished execution left there is moved aside"""
+        test_case_folder = self._test_case_folder(test_case)
+        if test_case_folder.exists():
+            unfinished = test_case_folder.with_name(
+                f"{test_case_folder.name}.unfinished-{time.strftime('%Y%m%d-%H%M%S')}"
+            )
+            print(f"Moving the unfinished execution in {test_case_folder} aside")
+            _ = test_case_folder.rename(unfinished)
+        os.makedirs(test_case_folder)
+
+    def _test_case_folder(self, test_case: TestCase) -> Path:
+        return Path(self.output_folder) / f"TC_{test_case.id}"
@@ -0,0 +1,295 @@
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field, replace
+from functools import cache
+import json
+from logging import Logger
+import os
+
+from VTAAS.llm.images import EncodedImage
+from VTAAS.llm.screenshot_store import screenshot_store
+from VTAAS.llm.usage import TokenUsage
+from VTAAS.schemas.llm import Message
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """USD per million tokens"""
+
+    input: float
+    output: float
+    cached_input: float | None = None
+    """defaults to the input price"""
+    cache_write: float | None = None
+    """defaults to the input price"""
+
+    def cost(self, usage: TokenUsage) -> float:
+        cached_input = self.input if self.cached_input is None else self.cached_input
+        cache_write = self.input if self.cache_write is None else self.cache_write
+        uncached = usage.input_tokens - usage.cached_tokens - usage.cache_write_tokens
+        return (
+            max(0, uncached) * self.input
+            + usage.cached_tokens * cached_input
+            + usage.cache_write_tokens * cache_write
+            + usage.output_tokens * self.output
+        ) / 1_000_000
+
+
+PRICES: dict[str, ModelPrice] = {
+    "gpt-4o-2024-11-20": ModelPrice(input=2.5, output=10.0, cached_input=1.25),
+    "claude-3-5-sonnet-latest": ModelPrice(
+        input=3.0, output=15.0, cached_input=0.3, cache_write=3.75
+    ),
+    "gemini-2.0-pro-exp-02-05": ModelPrice(input=0.0, output=0.0),
+    "pixtral-large-latest": ModelPrice(input=2.0, output=6.0),
+    "gpt-4o-mini-2024-07-18": ModelPrice(input=0.15, output=0.6, cached_input=0.075),
+    "claude-3-5-haiku-latest": ModelPrice(
+        input=0.8, output=4.0, cached_input=0.08, cache_write=1.0
+    ),
+    "gemini-2.0-flash": ModelPrice(input=0.1, output=0.4),
+    "pixtral-12b-latest": ModelPrice(input=0.15, output=0.15),
+}
+"""Default models' list prices. Models missing here are not costed."""
+
+
+@cache
+def _price_overrides(path: str) -> dict[str, ModelPrice]:
+    """The prices of a VTAAS_LLM_PRICES file, read once"""
+    with open(path) as fp:
+        prices: dict[str, dict[str, float]] = json.load(fp)
+    return {model: ModelPrice(**fields) for model, fields in prices.items()}
+
+
+def model_price(model: str) -> ModelPrice | None:
+    """
+    Price of a model: VTAAS_LLM_PRICES (a JSON file mapping model names to
+    ModelPrice fields) first, then the defaults
+    """
+    path = os.getenv("VTAAS_LLM_PRICES")
+    if path:
+        price = _price_overrides(path).get(model)
+        if price is not None:
+            return price
+    return PRICES.get(model)
+
+
+@dataclass(frozen=True)
+class CallTags:
+    """What a LLM call was made for"""
+
+    test_case: str | None = None
+    step: int | None = None
+
+
+_tags: ContextVar[CallTags] = ContextVar("llm_call_tags", default=CallTags())
+
+
+@contextmanager
+def call_tags(**tags: str | int | None) -> Iterator[None]:
+    """LLM calls made within this block (and the tasks it starts) get these tags"""
+    token = _tags.set(replace(_tags.get(), **tags))
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+@dataclass
+class CallRecord:
+    """One LLM request, retries included"""
+
+    provider: str
+    model: str
+    method: str
+    worker: str
+    test_case: str | None = None
+    step: int | None = None
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    cache_write_tokens: int = 0
+    output_tokens: int = 0
+    images: int = 0
+    image_bytes: int = 0
+    latency: float = 0.0
+    """seconds from the first try to the parsed answer, waits included"""
+    waited: float = 0.0
+    """seconds spent waiting for in-flight slots and rate limits"""
+    retries: int = 0
+    failed: bool = False
+    cost: float | None = None
+    price_factor: float = 1.0
+    """discount of the endpoint, e.g. batches"""
+
+    def add_usage(self, usage: TokenUsage) -> None:
+        """Usage of one try: every try of the request is billed"""
+        self.input_tokens += usage.input_tokens
+        self.cached_tokens += usage.cached_tokens
+        self.cache_write_tokens += usage.cache_write_tokens
+        self.output_tokens += usage.output_tokens
+
+    @property
+    def usage(self) -> TokenUsage:
+        return TokenUsage(
+            self.input_tokens,
+            self.output_tokens,
+            self.cached_tokens,
+            self.cache_write_tokens,
+        )
+
+
+_TOTALS = (
+    "input_tokens",
+    "cached_tokens",
+    "cache_write_tokens",
+    "output_tokens",
+    "images",
+    "image_bytes",
+    "latency",
+    "waited",
+    "retries",
+)
+
+
+def _aggregate(records: Sequence[CallRecord]) -> dict[str, float]:
+    totals: dict[str, float] = {"calls": len(records)}
+    for name in _TOTALS:
+        totals[name] = sum(getattr(record, name) for record in records)
+    totals["failed"] = sum(1 for record in records if record.failed)
+    totals["cost"] = sum(record.cost or 0.0 for record in records)
+    totals["uncosted_calls"] = sum(1 for record in records if record.cost is None)
+    return totals
+
+
+@dataclass
+class UsageRecorder:
+    """The LLM calls of a run, with their tokens, images, latency and cost"""
+
+    records: list[CallRecord] = field(default_factory=list)
+
+    def add(self, record: CallRecord) -> None:
+        self.records.append(record)
+
+    def totals(self, test_case: str | None = None) -> dict[str, float]:
+        """Run totals, or a test case's, as flat llm_* metrics"""
+        records = [
+            record
+            for record in self.records
+            if test_case is None or record.test_case == test_case
+        ]
+        return {f"llm_{name}": value for name, value in _aggregate(records).items()}
+
+    def summary(self) -> dict[str, object]:
+        """Totals, then breakdowns by method, worker kind and test case"""
+
+        def by(key: str) -> dict[str, dict[str, float]]:
+            groups: dict[str, list[CallRecord]] = {}
+            for record in self.records:
+                value = getattr(record, key)
+                if key == "worker":
+                    value = value.split("-")[0]
+                groups.setdefault(str(value), []).append(record)
+            return {name: _aggregate(group) for name, group in sorted(groups.items())}
+
+        return {
+            "total": _aggregate(self.records),
+            "by_method": by("method"),
+            "by_worker": by("worker"),
+            "by_test_case": by("test_case"),
+        }
+
+    def dump(self, path: str) -> None:
+        """Summary and every call, as JSON"""
+        with open(path, "w") as fp:
+            json.dump(
+                {
+                    **self.summary(),
+                    "calls": [asdict(record) for record in self.records],
+                },
+                fp,
+                indent=2,
+            )
+
+
+_process_recorder = UsageRecorder()
+_recorder: ContextVar[UsageRecorder | None] = ContextVar(
+    "llm_usage_recorder", default=None
+)
+
+
+def usage_recorder() -> UsageRecorder:
+    """Recorder of the current run, else the process-wide one"""
+    return _recorder.get() or _process_recorder
+
+
+@contextmanager
+def recording_usage(recorder: UsageRecorder) -> Iterator[UsageRecorder]:
+    """LLM calls made within this block are recorded by this recorder"""
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+_current: ContextVar[CallRecord | None] = ContextVar("llm_call", default=None)
+
+
+def current_call() -> CallRecord | None:
+    return _current.get()
+
+
+@contextmanager
+def recording_call(
+    provider: str,
+    model: str,
+    method: str,
+    worker: str,
+    images: Sequence[EncodedImage] = (),
+) -> Iterator[CallRecord]:
+    """Records the call made within this block, once it is over"""
+    tags = _tags.get()
+    record = CallRecord(
+        provider=provider,
+        model=model,
+        method=method,
+        worker=worker,
+        test_case=tags.test_case,
+        step=tags.step,
+        images=len(images),
+        image_bytes=sum(len(image.data) for image in images),
+    )
+    token = _current.set(record)
+    try:
+        yield record
+    finally:
+        _current.reset(token)
+        price = model_price(record.model)
+        record.cost = (
+            price.cost(record.usage) * record.price_factor
+            if price is not None
+            else None
+        )
+        usage_recorder().add(record)
+
+
+def log_usage(logger: Logger, label: str, usage: TokenUsage | None) -> None:
+    """
+    One line per call, to follow how much of the prompts the cache serves.
+    The usage is added to the call being recorded.
+    """
+    if usage is None:
+        return
+    logger.info(f"{label} usage: {usage.describe()}")
+    record = _current.get()
+    if record is not None:
+        record.add_usage(usage)
+
+
+def conversation_images(conversation: list[Message]) -> list[EncodedImage]:
+    """The images a conversation uploads, as prepared by the screenshot store"""
+    return [
+        screenshot_store().get(screenshot).image
+        for message in conversation
+        for screenshot in message.screenshot or []
+    ]
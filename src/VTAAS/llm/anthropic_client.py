@@ -1,25 +1,36 @@
-import ast
-import base64
-from collections.abc import Iterable
-import json
+from collections.abc import AsyncIterator, Callable, Iterable
 import time
-from typing import final, override
-from uuid import uuid4
+from typing import TypeVar, cast, final, override
 
 from anthropic import AsyncAnthropic
-from anthropic.types import TextBlock
+from anthropic.types import TextBlock, Usage
+from anthropic.types.cache_control_ephemeral_param import CacheControlEphemeralParam
 from anthropic.types.image_block_param import ImageBlockParam, Source
 from anthropic.types.message_param import MessageParam
+from anthropic.types.messages.batch_create_params import Request
 from anthropic.types.text_block_param import TextBlockParam
 from pydantic import BaseModel
 
-from VTAAS.llm.llm_client import LLMClient
+from VTAAS.llm.accounting import conversation_images, log_usage
+from VTAAS.llm.batch import BatchRequest, BatchResult
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.images import EncodedImage, describe_savings
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.registry import shared_sdk_client
+from VTAAS.llm.retry import Attempt, RequestExecutor
+from VTAAS.llm.scheduler import request_priority
+from VTAAS.llm.schema_prompts import schema_prompt
+from VTAAS.llm.screenshot_store import screenshot_store
+from VTAAS.llm.streaming import StreamEnd, stream_act
+from VTAAS.llm.usage import TokenUsage
 
 
 from ..schemas.llm import (
+    Command,
     Message,
     MessageRole,
     LLMActResponse,
+    LLMStreamedActResponse,
     LLMAssertResponse,
     LLMDataExtractionResponse,
     LLMTestStepFollowUpResponse,
@@ -27,370 +38,342 @@ from ..schemas.llm import (
     LLMTestStepRecoverResponse,
 )
 
-from ..utils.logger import get_logger
+from ..utils.logger import get_worker_logger
 from ..utils.config import load_config
 import sys
 
+R = TypeVar("R", bound=BaseModel)
+
+CACHE_BREAKPOINT = CacheControlEphemeralParam(type="ephemeral")
+
+MAX_TOKENS = 1000
+"""Answer budget of a request, online or batched"""
+DATA_EXTRACTION_MAX_TOKENS = 1024
+
+
+def max_tokens(response_format: type[BaseModel]) -> int:
+    """Extracted data may take a little more room than the other answers"""
+    if response_format is LLMDataExtractionResponse:
+        return DATA_EXTRACTION_MAX_TOKENS
+    return MAX_TOKENS
+
+
+class AnthropicBatchBackend:
+    """The Message Batches API, answered within 24h"""
+
+    def __init__(self, client: AsyncAnthropic):
+        self.client: AsyncAnthropic = client
+        self._prefills: dict[str, dict[str, str]] = {}
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        batch = await self.client.messages.batches.create(
+            requests=[
+                cast(
+                    Request,
+                    {"custom_id": request.custom_id, "params": request.body},
+                )
+                for request in requests
+            ]
+        )
+        # answers continue their prefilled assistant turn
+        self._prefills[batch.id] = {
+            request.custom_id: AnthropicBatchBackend._prefill(request.body)
+            for request in requests
+        }
+        return batch.id
+
+    async def poll(self, batch_id: str) -> list[BatchResult] | None:
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return None
+        prefills = self._prefills.pop(batch_id, {})
+        results: list[BatchResult] = []
+        async for entry in await self.client.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                results.append(BatchResult(entry.custom_id, error=entry.result.type))
+                continue
+            message = entry.result.message
+            text = "".join(
+                block.text for block in message.content if isinstance(block, TextBlock)
+            )
+            results.append(
+                BatchResult(
+                    entry.custom_id,
+                    text=prefills.get(entry.custom_id, "") + text,
+                    usage=AnthropicLLMClient._usage(message.usage),
+                )
+            )
+        return results
+
+    @staticmethod
+    def _prefill(body: dict[str, object]) -> str:
+        messages = cast(list[MessageParam], body.get("messages") or [])
+        if messages and messages[-1]["role"] == "assistant":
+            content = messages[-1]["content"]
+            return content if isinstance(content, str) else ""
+        return ""
+
 
 @final
 class AnthropicLLMClient(LLMClient):
     """Communication with OpenAI"""
 
-    def __init__(self, name: str, start_time: float, output_folder: str):
+    def __init__(
+        self,
+        name: str,
+        start_time: float,
+        output_folder: str,
+        model: str = "claude-3-5-sonnet-latest",
+        worker: str = "main",
+    ):
         load_config()
         self.start_time = start_time
         self.output_folder = output_folder
+        self.model = model
         self.name: str = name
-        self.logger = get_logger(
-            "Anthropic LLM Client - " + self.name + " - " + uuid4().hex,
+        self.logger = get_worker_logger(
+            "Anthropic LLM Client - " + self.name,
+            worker,
             self.start_time,
             self.output_folder,
         )
-        self.max_tries = 3
+        self.executor = RequestExecutor(
+            LLMProvider.ANTHROPIC, self.model, self.logger, worker=worker
+        )
         try:
-            self.aclient = AsyncAnthropic(max_retries=4)
+            # retries are left to the executor, which shares the rate limit
+            self.aclient = shared_sdk_client(
+                LLMProvider.ANTHROPIC,
+                self.model,
+                lambda: AsyncAnthropic(max_retries=0),
+            )
         except Exception as e:
             self.logger.fatal(e, exc_info=True)
             sys.exit(1)
 
+    def _prompt(
+        self, conversation: list[Message], response_format: type[BaseModel]
+    ) -> tuple[list[TextBlockParam], list[MessageParam]]:
+        """
+        System blocks and messages of a request, the stable part first so
+        that the provider caches it: the system prompt and response schema,
+        then the task (first user message), each ending with a cache
+        breakpoint. The variable turns follow, and the answer is prefilled
+        with '{"'. The conversation itself is left untouched.
+        """
+        system_prompt = "\n\n".join(
+            msg.content for msg in conversation if msg.role == MessageRole.System
+        )
+        expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
+            response_format
+        )
+        system = [
+            TextBlockParam(
+                type="text",
+                text=(system_prompt + "\n" + expected_format).strip(),
+                cache_control=CACHE_BREAKPOINT,
+            )
+        ]
+        messages = self.to_anthropic_messages(conversation)
+        task = next((msg for msg in messages if msg["role"] == "user"), None)
+        if task is not None and not isinstance(task["content"], str):
+            blocks = list(task["content"])
+            blocks[-1] = cast(
+                TextBlockParam | ImageBlockParam,
+                {**blocks[-1], "cache_control": CACHE_BREAKPOINT},
+            )
+            task["content"] = blocks
+        messages.append(MessageParam(role="assistant", content='{"'))
+        return system, messages
+
+    def batch_backend(self) -> AnthropicBatchBackend:
+        return AnthropicBatchBackend(self.aclient)
+
+    def batch_body(
+        self, conversation: list[Message], response_format: type[BaseModel]
+    ) -> dict[str, object]:
+        """The parameters of _request, for the Message Batches API"""
+        system, messages = self._prompt(conversation, response_format)
+        return {
+            "max_tokens": max_tokens(response_format),
+            "model": self.model,
+            "system": system,
+            "messages": messages,
+            "temperature": 0,
+        }
+
+    async def _request(
+        self,
+        label: str,
+        conversation: list[Message],
+        response_format: type[R],
+    ) -> R:
+        """JSON request, retried by the executor"""
+        system, messages = self._prompt(conversation, response_format)
+        truncated = False
+
+        async def send(_: Attempt) -> str:
+            nonlocal truncated
+            response = await self.aclient.messages.create(
+                max_tokens=max_tokens(response_format),
+                model=self.model,
+                system=system,
+                messages=messages,
+                temperature=0,
+            )
+            log_usage(self.logger, label, self._usage(response.usage))
+            truncated = response.stop_reason == "max_tokens"
+            if len(response.content) == 0:
+                raise ValueError(f"{label.upper()} - anthropic response is empty")
+            outcome = response.content[0]
+            if not isinstance(outcome, TextBlock):
+                raise ValueError(f"{label.upper()} - anthropic response is not text")
+            return '{"' + outcome.text
+
+        def parse(text: str) -> R:
+            return decode_response(text, response_format, truncated)
+
+        return await self.executor.run(
+            label,
+            send,
+            parse,
+            request_priority(response_format),
+            conversation_images(conversation),
+        )
+
     @override
     async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
         """Get list of act/assert workers from LLM."""
-        attempts = 1
         self.logger.debug(f"Init Plan Step Message:\n{conversation[-1].content}")
-        expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
-            LLMTestStepPlanResponse
+        llm_response = await self._request(
+            "plan step", conversation, LLMTestStepPlanResponse
         )
-        conversation[-1].content += expected_format
-        preshot_assistant = Message(
-            role=MessageRole.Assistant,
-            content='{"',
+        self.logger.info(
+            f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
         )
-        conversation.append(preshot_assistant)
-        while attempts <= self.max_tries:
-            try:
-                response = await self.aclient.messages.create(
-                    max_tokens=1000,
-                    model="claude-3-5-sonnet-latest",
-                    temperature=0,
-                    messages=AnthropicLLMClient.to_anthropic_messages(conversation),
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if len(response.content) == 0:
-                    raise ValueError("PLAN - anthropic response is empty")
-                outcome = response.content[0]
-                if not isinstance(outcome, TextBlock):
-                    raise ValueError("PLAN - anthropic response is not text")
-                response_str = AnthropicLLMClient.extract_json('{"' + outcome.text)
-                llm_response = LLMTestStepPlanResponse.model_validate(
-                    ast.literal_eval(response_str)
-                )
-                self.logger.info(
-                    f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning request")
+        return llm_response
 
     @override
     async def followup_step(
         self, conversation: list[Message]
     ) -> LLMTestStepFollowUpResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
         self.logger.debug(f"FollowUp Plan Step Message:\n{conversation[-1].content}")
-        expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
-            LLMTestStepFollowUpResponse
+        llm_response = await self._request(
+            "plan followup", conversation, LLMTestStepFollowUpResponse
         )
-        conversation[-1].content += expected_format
-        preshot_assistant = Message(
-            role=MessageRole.Assistant,
-            content='{"',
+        self.logger.info(
+            f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
         )
-        conversation.append(preshot_assistant)
-        while attempts <= self.max_tries:
-            try:
-                response = await self.aclient.messages.create(
-                    max_tokens=1000,
-                    model="claude-3-5-sonnet-latest",
-                    messages=self.to_anthropic_messages(conversation),
-                    temperature=0,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan followup call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if len(response.content) == 0:
-                    raise ValueError("FOLLOWUP - anthropic response is empty")
-                outcome = response.content[0]
-                if not isinstance(outcome, TextBlock):
-                    raise ValueError("FOLLOWUP - anthropic response is not text")
-                response_str = AnthropicLLMClient.extract_json('{"' + outcome.text)
-                llm_response = LLMTestStepFollowUpResponse.model_validate(
-                    ast.literal_eval(response_str or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan followup parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send step planning followup request")
+        return llm_response
 
     @override
     async def recover_step(
         self, conversation: list[Message]
     ) -> LLMTestStepRecoverResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
         self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
-        expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
-            LLMTestStepRecoverResponse
+        llm_response = await self._request(
+            "plan recover", conversation, LLMTestStepRecoverResponse
         )
-        conversation[-1].content += expected_format
-        preshot_assistant = Message(
-            role=MessageRole.Assistant,
-            content='{"',
+        self.logger.info(
+            f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
         )
-        conversation.append(preshot_assistant)
-        while attempts <= self.max_tries:
-            try:
-                response = await self.aclient.messages.create(
-                    max_tokens=1000,
-                    model="claude-3-5-sonnet-latest",
-                    messages=self.to_anthropic_messages(conversation),
-                    temperature=0,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan recover call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if len(response.content) == 0:
-                    raise ValueError("RECOVER - anthropic response is empty")
-                outcome = response.content[0]
-                if not isinstance(outcome, TextBlock):
-                    raise ValueError("RECOVER - anthropic response is not text")
-                response_str = AnthropicLLMClient.extract_json('{"' + outcome.text)
-                llm_response = LLMTestStepRecoverResponse.model_validate(
-                    ast.literal_eval(response_str or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                if llm_response.plan:
-                    self.logger.info(
-                        f"[Recover] Received {len(llm_response.plan.workers)} worker configurations from LLM"
-                    )
-                else:
-                    self.logger.info("[Recover] Test step is considered FAIL")
-
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan recover parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning recover request")
+        if llm_response.plan:
+            self.logger.info(
+                f"[Recover] Received {len(llm_response.plan.workers)} worker configurations from LLM"
+            )
+        else:
+            self.logger.info("[Recover] Test step is considered FAIL")
+
+        return llm_response
 
     @override
     async def act(self, conversation: list[Message]) -> LLMActResponse:
         """Actor call"""
-        attempts = 1
         self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
-        expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
-            LLMActResponse
-        )
-        conversation[-1].content += expected_format
-        preshot_assistant = Message(
-            role=MessageRole.Assistant,
-            content='{"',
+        llm_response = await self._request("act", conversation, LLMActResponse)
+        self.logger.info(
+            f"Received Actor response {llm_response.model_dump_json(indent=4)}"
         )
-        conversation.append(preshot_assistant)
-        while attempts <= self.max_tries:
-            try:
-                response = await self.aclient.messages.create(
-                    max_tokens=1000,
-                    model="claude-3-5-sonnet-latest",
-                    messages=self.to_anthropic_messages(conversation),
-                    temperature=0,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if len(response.content) == 0:
-                    raise ValueError("ACT - anthropic response is empty")
-                outcome = response.content[0]
-                if not isinstance(outcome, TextBlock):
-                    raise ValueError("ACT - anthropic response is not text")
-                response_str = AnthropicLLMClient.extract_json('{"' + outcome.text)
-                self.logger.info(f"Received Actor response {response_str}")
-                llm_response = LLMActResponse.model_validate(
-                    ast.literal_eval(response_str or "")
-                )
-                return llm_response
+        return llm_response
 
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Act request")
+    async def act_stream(
+        self, conversation: list[Message], on_command: Callable[[Command], None]
+    ) -> LLMActResponse:
+        """Actor call, streamed: on_command gets the command as soon as it is complete"""
+        self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
+        system, messages = self._prompt(conversation, LLMStreamedActResponse)
+
+        async def chunks(end: StreamEnd) -> AsyncIterator[str]:
+            yield '{"'
+            async with self.aclient.messages.stream(
+                max_tokens=max_tokens(LLMStreamedActResponse),
+                model=self.model,
+                system=system,
+                messages=messages,
+                temperature=0,
+            ) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                final = await stream.get_final_message()
+                log_usage(self.logger, "act", self._usage(final.usage))
+                end.truncated = final.stop_reason == "max_tokens"
+
+        llm_response = await stream_act(
+            self.executor, chunks, on_command, conversation_images(conversation)
+        )
+        self.logger.info(
+            f"Received Actor response {llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
         """Assertor call"""
-        attempts = 1
         self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
-        expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
-            LLMAssertResponse
+        llm_response = await self._request("assert", conversation, LLMAssertResponse)
+        self.logger.info(
+            f"Received Assertor response {llm_response.model_dump_json(indent=4)}"
         )
-        conversation[-1].content += expected_format
-        preshot_assistant = Message(
-            role=MessageRole.Assistant,
-            content='{"',
-        )
-        conversation.append(preshot_assistant)
-        while attempts <= self.max_tries:
-            try:
-                response = await self.aclient.messages.create(
-                    max_tokens=1000,
-                    model="claude-3-5-sonnet-latest",
-                    messages=self.to_anthropic_messages(conversation),
-                    temperature=0,
-                )
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if len(response.content) == 0:
-                    raise ValueError("ASSERT - anthropic response is empty")
-                outcome = response.content[0]
-                if not isinstance(outcome, TextBlock):
-                    raise ValueError("ASSERT - anthropic response is not text")
-                response_str = AnthropicLLMClient.extract_json('{"' + outcome.text)
-                self.logger.info(f"Received Assertor response {response_str}")
-                llm_response = LLMAssertResponse.model_validate(
-                    ast.literal_eval(response_str or "")
-                )
-                self.logger.info(
-                    f"Received Assertor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Assert request")
+        return llm_response
 
     @override
     async def step_postprocess(
         self, system: str, user: str, screenshots: list[bytes]
     ) -> LLMDataExtractionResponse:
         """Data Extraction call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            conversation: list[Message] = [
-                Message(role=MessageRole.System, content=system),
-                Message(
-                    role=MessageRole.User,
-                    content=user,
-                    screenshot=screenshots,
-                ),
-            ]
-            expected_format = AnthropicLLMClient.generate_prompt_from_pydantic(
-                LLMDataExtractionResponse
-            )
-            conversation[-1].content += expected_format
-            preshot_assistant = Message(
-                role=MessageRole.Assistant,
-                content='{"',
-            )
-            conversation.append(preshot_assistant)
-            try:
-                response = await self.aclient.messages.create(
-                    max_tokens=1024,
-                    model="claude-3-5-sonnet-latest",
-                    messages=self.to_anthropic_messages(conversation),
-                    temperature=0,
-                )
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction call: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if len(response.content) == 0:
-                    raise ValueError("Data Extraction - anthropic response is empty")
-                outcome = response.content[0]
-                if not isinstance(outcome, TextBlock):
-                    raise ValueError("Data Extraction - anthropic response is not text")
-                response_str = AnthropicLLMClient.extract_json('{"' + outcome.text)
-                llm_response = LLMDataExtractionResponse.model_validate(
-                    ast.literal_eval(response_str or "")
-                )
-
-                self.logger.info(
-                    f"Received Data Extraction response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Data extraction request")
+        conversation: list[Message] = [
+            Message(role=MessageRole.System, content=system),
+            Message(
+                role=MessageRole.User,
+                content=user,
+                screenshot=screenshots,
+            ),
+        ]
+        llm_response = await self._request(
+            "data extraction", conversation, LLMDataExtractionResponse
+        )
+        self.logger.info(
+            f"Received Data Extraction response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @staticmethod
-    def to_anthropic_messages(conversation: list[Message]) -> Iterable[MessageParam]:
-        messages: Iterable[MessageParam] = []
+    def _usage(usage: Usage) -> TokenUsage:
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_write = usage.cache_creation_input_tokens or 0
+        return TokenUsage(
+            input_tokens=usage.input_tokens + cache_read + cache_write,
+            output_tokens=usage.output_tokens,
+            cached_tokens=cache_read,
+            cache_write_tokens=cache_write,
+        )
+
+    def to_anthropic_messages(self, conversation: list[Message]) -> list[MessageParam]:
+        """Conversation turns: the system prompt goes in the system parameter"""
+        messages: list[MessageParam] = []
+        images: list[EncodedImage] = []
         for msg in conversation:
             match msg.role:
                 case MessageRole.System:
@@ -402,16 +385,17 @@ class AnthropicLLMClient(LLMClient):
                     content.append(TextBlockParam(type="text", text=msg.content))
                     if msg.screenshot:
                         for screenshot in msg.screenshot:
-                            base64_screenshot = str(
-                                base64.b64encode(screenshot), "utf-8"
-                            )
+                            stored = screenshot_store().get(screenshot)
+                            images.append(stored.image)
                             image = Source(
-                                media_type="image/png",
-                                data=base64_screenshot,
+                                media_type=stored.image.mime_type,
+                                data=stored.base64,
                                 type="base64",
                             )
                             content.append(ImageBlockParam(source=image, type="image"))
                     messages.append(MessageParam(content=content, role="user"))
+        if images:
+            self.logger.debug(describe_savings(images))
         return messages
 
     @staticmethod
@@ -419,16 +403,4 @@ class AnthropicLLMClient(LLMClient):
         """
         Anthropic does not support structured outputs. Let's ask the model to adhere to the format in the prompt
         """
-        schema = model.model_json_schema()
-        prompt = (
-            "\nYour response must be a json.loads parsable JSON object, following this Pydantic JSON schema:\n"
-            f"{json.dumps(schema, indent=2)}"
-            "\n please omit properties that have a default null if you don't plan on valuing them"
-        )
-        return prompt
-
-    @staticmethod
-    def extract_json(response: str) -> str:
-        json_start = response.index("{")
-        json_end = response.rfind("}")
-        return response[json_start : json_end + 1]
+        return schema_prompt(LLMProvider.ANTHROPIC, model).text
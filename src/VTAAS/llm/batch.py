@@ -0,0 +1,321 @@
+import asyncio
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+import itertools
+from logging import Logger
+import os
+from typing import Protocol, TypeVar, final, override, runtime_checkable
+
+from pydantic import BaseModel
+
+from VTAAS.llm.accounting import conversation_images, log_usage, recording_call
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.retry import PARSE_ERRORS, RequestExecutor
+from VTAAS.llm.usage import TokenUsage
+from VTAAS.schemas.llm import (
+    LLMActResponse,
+    LLMAssertResponse,
+    LLMDataExtractionResponse,
+    LLMTestStepFollowUpResponse,
+    LLMTestStepPlanResponse,
+    LLMTestStepRecoverResponse,
+    Message,
+    MessageRole,
+)
+
+R = TypeVar("R", bound=BaseModel)
+
+BATCH_PRICE_FACTOR = 0.5
+"""OpenAI and Anthropic bill batched requests half price"""
+
+
+@dataclass(frozen=True)
+class BatchRequest:
+    custom_id: str
+    body: dict[str, object]
+    """the provider's request parameters"""
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    custom_id: str
+    text: str | None = None
+    error: str | None = None
+    usage: TokenUsage | None = None
+
+
+class BatchFailedError(RuntimeError):
+    """The whole batch failed, expired or was cancelled"""
+
+
+class BatchBackend(Protocol):
+    """A provider's batch endpoint"""
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        """Returns the batch id"""
+        ...
+
+    async def poll(self, batch_id: str) -> list[BatchResult] | None:
+        """The results once the batch has ended, None while it runs"""
+        ...
+
+
+@runtime_checkable
+class BatchableLLMClient(Protocol):
+    """A LLM client whose requests can also go through its provider's batch endpoint"""
+
+    executor: RequestExecutor
+
+    def batch_backend(self) -> BatchBackend: ...
+
+    def batch_body(
+        self, conversation: list[Message], response_format: type[BaseModel]
+    ) -> dict[str, object]: ...
+
+
+@final
+class FakeBatchBackend:
+    """
+    Local stand-in for a provider's batch endpoint: answers every request
+    with respond() once the batch has been polled `polls` times
+    """
+
+    def __init__(self, respond: Callable[[BatchRequest], str], polls: int = 1):
+        self.respond: Callable[[BatchRequest], str] = respond
+        self.polls: int = polls
+        self.batches: dict[str, list[BatchRequest]] = {}
+        self._polled: dict[str, int] = {}
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        batch_id = f"batch_{len(self.batches) + 1}"
+        self.batches[batch_id] = requests
+        self._polled[batch_id] = 0
+        return batch_id
+
+    async def poll(self, batch_id: str) -> list[BatchResult] | None:
+        self._polled[batch_id] += 1
+        if self._polled[batch_id] < self.polls:
+            return None
+        results: list[BatchResult] = []
+        for request in self.batches[batch_id]:
+            try:
+                text = self.respond(request)
+            except Exception as e:
+                results.append(BatchResult(request.custom_id, error=str(e)))
+            else:
+                results.append(BatchResult(request.custom_id, text=text))
+        return results
+
+
+@dataclass(frozen=True)
+class BatchConfig:
+    methods: frozenset[str] = frozenset()
+    """the deferred LLMClient methods"""
+    max_size: int = 50
+    max_wait: float = 10.0
+    """seconds a request waits for others before its batch is submitted"""
+    poll_interval: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "BatchConfig":
+        """
+        VTAAS_LLM_BATCH: comma separated methods to defer (step_postprocess,
+        assert_), VTAAS_LLM_BATCH_SIZE, VTAAS_LLM_BATCH_WAIT and
+        VTAAS_LLM_BATCH_POLL (seconds)
+        """
+        default = cls()
+        methods = os.getenv("VTAAS_LLM_BATCH", "")
+        return cls(
+            methods=frozenset(m.strip() for m in methods.split(",") if m.strip()),
+            max_size=int(os.getenv("VTAAS_LLM_BATCH_SIZE", default.max_size)),
+            max_wait=float(os.getenv("VTAAS_LLM_BATCH_WAIT", default.max_wait)),
+            poll_interval=float(
+                os.getenv("VTAAS_LLM_BATCH_POLL", default.poll_interval)
+            ),
+        )
+
+
+class BatchCollector:
+    """
+    Collects the deferred requests of every test case. A batch is submitted
+    once it is full, or max_wait after its first request, then polled until
+    it ends; each caller gets its own result.
+    """
+
+    def __init__(self, backend: BatchBackend, config: BatchConfig, logger: Logger):
+        self.backend: BatchBackend = backend
+        self.config: BatchConfig = config
+        self.logger: Logger = logger
+        self._pending: list[tuple[BatchRequest, asyncio.Future[BatchResult]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._ids: Iterator[int] = itertools.count(1)
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def run(self, body: dict[str, object]) -> BatchResult:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[BatchResult] = loop.create_future()
+        self._pending.append((BatchRequest(f"req-{next(self._ids)}", body), future))
+        if len(self._pending) >= self.config.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.config.max_wait, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """Submit the pending requests now"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending = [(r, f) for r, f in self._pending if not f.done()]
+        self._pending = []
+        if not pending:
+            return
+        task = asyncio.create_task(self._process(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(
+        self, pending: list[tuple[BatchRequest, asyncio.Future[BatchResult]]]
+    ) -> None:
+        try:
+            batch_id = await self.backend.submit([request for request, _ in pending])
+            self.logger.info(f"Submitted batch {batch_id} of {len(pending)} requests")
+            while (results := await self.backend.poll(batch_id)) is None:
+                await asyncio.sleep(self.config.poll_interval)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_id = {result.custom_id: result for result in results}
+        for request, future in pending:
+            if not future.done():
+                future.set_result(
+                    by_id.get(request.custom_id)
+                    or BatchResult(request.custom_id, error="missing from the results")
+                )
+
+
+_collectors: dict[tuple[LLMProvider, str], BatchCollector] = {}
+
+
+def batch_collector(client: BatchableLLMClient, config: BatchConfig) -> BatchCollector:
+    """Process-wide collector of a (provider, model) pair"""
+    key = (client.executor.provider, client.executor.model)
+    if key not in _collectors:
+        _collectors[key] = BatchCollector(
+            client.batch_backend(), config, client.executor.logger
+        )
+    return _collectors[key]
+
+
+def drop_batch_collectors() -> None:
+    """Forget the collectors, along with the SDK clients of their backends"""
+    _collectors.clear()
+
+
+@final
+class BatchingLLMClient(LLMClient):
+    """
+    Sends the deferrable calls (not latency critical, e.g. data extraction
+    in offline evaluations) through the provider's batch endpoint, at lower
+    cost and higher rate limits. A request the batch failed to answer is
+    sent again online. Other calls go straight to the inner client.
+    """
+
+    def __init__(
+        self,
+        inner: LLMClient,
+        collector: BatchCollector,
+        methods: frozenset[str],
+    ):
+        if not isinstance(inner, BatchableLLMClient):
+            raise TypeError(f"{type(inner).__name__} has no batch endpoint")
+        self.inner: LLMClient = inner
+        self.batchable: BatchableLLMClient = inner
+        self.collector: BatchCollector = collector
+        self.methods: frozenset[str] = methods
+        self.model: str = inner.model
+        self.logger = inner.logger
+
+    async def _batched(
+        self, label: str, conversation: list[Message], response_format: type[R]
+    ) -> R | None:
+        """The batched response, None if the batch did not provide one"""
+        executor = self.batchable.executor
+        with recording_call(
+            executor.provider.value,
+            executor.model,
+            f"{label} (batch)",
+            executor.worker,
+            conversation_images(conversation),
+        ) as record:
+            record.price_factor = BATCH_PRICE_FACTOR
+            try:
+                result = await self.collector.run(
+                    self.batchable.batch_body(conversation, response_format)
+                )
+            except Exception as e:
+                record.failed = True
+                self.logger.error(f"Batch of {label} failed: {str(e)}")
+                return None
+            log_usage(self.logger, f"{label} (batch)", result.usage)
+            if result.text is None:
+                record.failed = True
+                self.logger.error(f"Batched {label} failed: {result.error}")
+                return None
+            try:
+                return decode_response(result.text, response_format)
+            except PARSE_ERRORS as e:
+                record.failed = True
+                self.logger.error(f"Batched {label} could not be parsed: {str(e)}")
+                return None
+
+    @override
+    async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
+        return await self.inner.plan_step(conversation)
+
+    @override
+    async def followup_step(
+        self, conversation: list[Message]
+    ) -> LLMTestStepFollowUpResponse:
+        return await self.inner.followup_step(conversation)
+
+    @override
+    async def recover_step(
+        self, conversation: list[Message]
+    ) -> LLMTestStepRecoverResponse:
+        return await self.inner.recover_step(conversation)
+
+    @override
+    async def act(self, conversation: list[Message]) -> LLMActResponse:
+        return await self.inner.act(conversation)
+
+    @override
+    async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
+        if "assert_" in self.methods:
+            response = await self._batched("assert", conversation, LLMAssertResponse)
+            if response is not None:
+                return response
+        return await self.inner.assert_(conversation)
+
+    @override
+    async def step_postprocess(
+        self, system: str, user: str, screenshots: list[bytes]
+    ) -> LLMDataExtractionResponse:
+        if "step_postprocess" in self.methods:
+            conversation = [
+                Message(role=MessageRole.System, content=system),
+                Message(role=MessageRole.User, content=user, screenshot=screenshots),
+            ]
+            response = await self._batched(
+                "data extraction", conversation, LLMDataExtractionResponse
+            )
+            if response is not None:
+                return response
+        return await self.inner.step_postprocess(system, user, screenshots)
+
+    @override
+    def close(self):
+        self.inner.close()
@@ -0,0 +1,244 @@
+from collections.abc import Awaitable, Callable
+from enum import Enum
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import TypeVar, final, override
+
+from pydantic import BaseModel
+
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.schemas.llm import (
+    LLMActResponse,
+    LLMAssertResponse,
+    LLMDataExtractionResponse,
+    LLMTestStepFollowUpResponse,
+    LLMTestStepPlanResponse,
+    LLMTestStepRecoverResponse,
+    Message,
+    MessageRole,
+)
+
+R = TypeVar("R", bound=BaseModel)
+
+
+class CacheMode(str, Enum):
+    RECORD = "record"
+    """Always call the LLM, store (or overwrite) its response"""
+    REPLAY = "replay"
+    """Never call the LLM: a request that was not recorded is an error"""
+    RECORD_MISSING = "record-missing"
+    """Replay what was recorded, call the LLM and record the rest"""
+
+
+class CacheMissError(LookupError):
+    """A request was not recorded and the cache is in replay mode"""
+
+
+class ResponseStore:
+    """
+    On-disk store of LLM responses, one JSON file per request key.
+    Files are written atomically (concurrent workers may record the same
+    request). Past max_entries, the least recently used responses are evicted.
+    """
+
+    def __init__(self, folder: str | Path, max_entries: int = 20000):
+        self.folder: Path = Path(folder)
+        self.max_entries: int = max_entries
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._last_used: dict[str, float] = {
+            path.stem: path.stat().st_mtime for path in self.folder.glob("*/*.json")
+        }
+
+    def __len__(self) -> int:
+        return len(self._last_used)
+
+    def _path(self, key: str) -> Path:
+        return self.folder / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> dict[str, object] | None:
+        if key not in self._last_used:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry: dict[str, object] = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            _ = self._last_used.pop(key, None)
+            return None
+        self._last_used[key] = time.time()
+        os.utime(path)
+        return entry
+
+    def put(self, key: str, entry: dict[str, object]) -> None:
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self._last_used[key] = time.time()
+        self._evict()
+
+    def _evict(self) -> None:
+        excess = len(self._last_used) - self.max_entries
+        if excess <= 0:
+            return
+        for key in sorted(self._last_used, key=self._last_used.__getitem__)[:excess]:
+            del self._last_used[key]
+            self._path(key).unlink(missing_ok=True)
+
+
+def _digest(screenshot: bytes) -> str:
+    return hashlib.sha256(screenshot).hexdigest()
+
+
+def conversation_key(
+    method: str, provider: LLMProvider, model: str, conversation: list[Message]
+) -> str:
+    """Hash of a request: message texts and screenshot digests, not the bytes"""
+    normalized = [
+        [msg.role, msg.content.strip(), [_digest(s) for s in msg.screenshot or []]]
+        for msg in conversation
+    ]
+    payload = json.dumps([method, provider, model, normalized])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@final
+class CachingLLMClient(LLMClient):
+    """
+    Record/replay wrapper around a LLM client.
+    Re-running the same test cases against the same application state replays
+    the recorded responses instead of calling the provider.
+    """
+
+    def __init__(
+        self,
+        inner: LLMClient,
+        provider: LLMProvider,
+        store: ResponseStore,
+        mode: CacheMode,
+    ):
+        self.inner: LLMClient = inner
+        self.provider: LLMProvider = provider
+        self.model: str = inner.model
+        self.store: ResponseStore = store
+        self.mode: CacheMode = mode
+        self.logger = inner.logger
+
+    async def _cached(
+        self,
+        method: str,
+        response_type: type[R],
+        request: list[Message],
+        call: Callable[[], Awaitable[R]],
+    ) -> R:
+        key = conversation_key(method, self.provider, self.model, request)
+        if self.mode != CacheMode.RECORD:
+            entry = self.store.get(key)
+            if entry is not None:
+                self.logger.info(f"Replaying recorded {method} response {key[:12]}")
+                return response_type.model_validate(entry["response"])
+            if self.mode == CacheMode.REPLAY:
+                raise CacheMissError(f"No recorded {method} response for {key}")
+        response = await call()
+        self.store.put(
+            key,
+            {
+                "method": method,
+                "provider": self.provider.value,
+                "model": self.model,
+                "response": response.model_dump(mode="json"),
+            },
+        )
+        return response
+
+    @override
+    async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
+        return await self._cached(
+            "plan_step",
+            LLMTestStepPlanResponse,
+            conversation,
+            lambda: self.inner.plan_step(conversation),
+        )
+
+    @override
+    async def followup_step(
+        self, conversation: list[Message]
+    ) -> LLMTestStepFollowUpResponse:
+        return await self._cached(
+            "followup_step",
+            LLMTestStepFollowUpResponse,
+            conversation,
+            lambda: self.inner.followup_step(conversation),
+        )
+
+    @override
+    async def recover_step(
+        self, conversation: list[Message]
+    ) -> LLMTestStepRecoverResponse:
+        return await self._cached(
+            "recover_step",
+            LLMTestStepRecoverResponse,
+            conversation,
+            lambda: self.inner.recover_step(conversation),
+        )
+
+    @override
+    async def act(self, conversation: list[Message]) -> LLMActResponse:
+        return await self._cached(
+            "act",
+            LLMActResponse,
+            conversation,
+            lambda: self.inner.act(conversation),
+        )
+
+    @override
+    async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
+        return await self._cached(
+            "assert_",
+            LLMAssertResponse,
+            conversation,
+            lambda: self.inner.assert_(conversation),
+        )
+
+    @override
+    async def step_postprocess(
+        self, system: str, user: str, screenshots: list[bytes]
+    ) -> LLMDataExtractionResponse:
+        request = [
+            Message(role=MessageRole.System, content=system),
+            Message(role=MessageRole.User, content=user, screenshot=screenshots),
+        ]
+        return await self._cached(
+            "step_postprocess",
+            LLMDataExtractionResponse,
+            request,
+            lambda: self.inner.step_postprocess(system, user, screenshots),
+        )
+
+    @override
+    def close(self):
+        self.inner.close()
+
+
+_stores: dict[Path, ResponseStore] = {}
+
+
+def cache_mode() -> CacheMode | None:
+    """VTAAS_LLM_CACHE: record, replay or record-missing (unset: no cache)"""
+    mode = os.getenv("VTAAS_LLM_CACHE")
+    return CacheMode(mode.lower()) if mode else None
+
+
+def response_store() -> ResponseStore:
+    """Process-wide store in VTAAS_LLM_CACHE_DIR (default: .llm_cache)"""
+    folder = Path(os.getenv("VTAAS_LLM_CACHE_DIR", ".llm_cache")).resolve()
+    if folder not in _stores:
+        _stores[folder] = ResponseStore(
+            folder, int(os.getenv("VTAAS_LLM_CACHE_MAX_ENTRIES", 20000))
+        )
+    return _stores[folder]
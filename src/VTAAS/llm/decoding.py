@@ -0,0 +1,123 @@
+import ast
+from collections import Counter
+import json
+import re
+from typing import Any, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+R = TypeVar("R", bound=BaseModel)
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class DecodeStats:
+    """How LLM answers were decoded, by response model"""
+
+    def __init__(self):
+        self.counts: dict[str, Counter[str]] = {}
+
+    def add(self, response_format: type[BaseModel], outcome: str) -> None:
+        self.counts.setdefault(response_format.__name__, Counter())[outcome] += 1
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        """Per response model: json (fast path), repaired and failed answers"""
+        return {
+            name: {
+                outcome: counts[outcome] for outcome in ("json", "repaired", "failed")
+            }
+            for name, counts in sorted(self.counts.items())
+        }
+
+
+_stats = DecodeStats()
+
+
+def decode_stats() -> DecodeStats:
+    """Process-wide decoding counters"""
+    return _stats
+
+
+def _close_truncated(text: str) -> str:
+    """
+    Closes the arrays and objects left open by an answer cut short by the
+    token limit. An answer cut in a string, or right after one, is rejected:
+    the string may be incomplete, e.g. the value of a fill command.
+    """
+    closers: list[str] = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]" and closers:
+            _ = closers.pop()
+    if in_string or text.rstrip().endswith('"'):
+        raise ValueError("LLM response was truncated in a string")
+    return text + "".join(reversed(closers))
+
+
+def repair_json(text: str, truncated: bool = False) -> Any:
+    """
+    Best effort decoding of an answer that is not plain JSON: markdown fences,
+    prose around the object, trailing commas and Python literals (single
+    quotes, True/None). Objects left open are only closed when the provider
+    reports that the answer hit the token limit (truncated). Raises ValueError
+    when nothing works.
+    """
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("LLM response does not contain a JSON object")
+    end = text.rfind("}")
+    candidate = text[start : end + 1] if end > start else text[start:]
+    candidate = _TRAILING_COMMA.sub(r"\1", candidate)
+    attempts = [candidate]
+    if truncated:
+        attempts.append(_TRAILING_COMMA.sub(r"\1", _close_truncated(text[start:])))
+    for attempt in attempts:
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            pass
+        try:
+            return ast.literal_eval(attempt)
+        except (ValueError, SyntaxError):
+            pass
+    raise ValueError("LLM response could not be repaired into a JSON object")
+
+
+def decode_response(text: str, response_format: type[R], truncated: bool = False) -> R:
+    """
+    Validates a LLM answer against its response model, straight from the JSON
+    text. Answers that are not valid JSON go through repair_json; what could
+    not be decoded raises the fast path's error (a ValueError), so that the
+    request is retried. truncated: the answer hit the token limit.
+    """
+    if not text:
+        raise ValueError("LLM response is empty")
+    try:
+        response = response_format.model_validate_json(text)
+        _stats.add(response_format, "json")
+        return response
+    except ValidationError as e:
+        error = e
+    try:
+        response = response_format.model_validate(repair_json(text, truncated))
+    except ValueError:
+        _stats.add(response_format, "failed")
+        raise error from None
+    _stats.add(response_format, "repaired")
+    return response
@@ -1,14 +1,19 @@
-import ast
 from copy import deepcopy
-import json
-import time
-from typing import final, override
-from uuid import uuid4
+from typing import TypeVar, final, override
 from google import genai
 from google.genai import types
 from pydantic import BaseModel
 
-from VTAAS.llm.llm_client import LLMClient
+from VTAAS.llm.accounting import conversation_images, log_usage
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.images import EncodedImage, describe_savings
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.registry import shared_sdk_client
+from VTAAS.llm.screenshot_store import screenshot_store
+from VTAAS.llm.usage import TokenUsage
+from VTAAS.llm.retry import Attempt, RequestExecutor, error_suffix
+from VTAAS.llm.scheduler import request_priority
+from VTAAS.llm.schema_prompts import schema_prompt
 
 from ..schemas.llm import (
     Message,
@@ -21,355 +26,215 @@ from ..schemas.llm import (
     LLMTestStepRecoverResponse,
 )
 
-from ..utils.logger import get_logger
+from ..utils.logger import get_worker_logger
 from ..utils.config import load_config
 
+R = TypeVar("R", bound=BaseModel)
+
 
 @final
 class GoogleLLMClient(LLMClient):
-    """Communication with OpenAI"""
+    """Communication with Google, through the async surface of the genai SDK"""
 
-    def __init__(self, name: str, start_time: float, output_folder: str):
+    def __init__(
+        self,
+        name: str,
+        start_time: float,
+        output_folder: str,
+        model: str = "gemini-2.0-pro-exp-02-05",
+        worker: str = "main",
+    ):
         load_config()
         self.start_time = start_time
         self.output_folder = output_folder
-        self.max_tries = 3
+        self.model = model
         self.name: str = name
-        self.logger = get_logger(
-            "Google LLM Client - " + self.name + " - " + uuid4().hex,
+        self.logger = get_worker_logger(
+            "Google LLM Client - " + self.name,
+            worker,
             self.start_time,
             self.output_folder,
         )
-        self.client = genai.Client()
+        self.executor = RequestExecutor(
+            LLMProvider.GOOGLE, self.model, self.logger, worker=worker
+        )
+        self.client = shared_sdk_client(LLMProvider.GOOGLE, self.model, genai.Client)
 
-    @override
-    async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
-        """Get list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"Init Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-pro-exp-02-05",
-                    contents=self._to_google_messages(conversation),
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=LLMTestStepPlanResponse,
-                        temperature=0,
-                        seed=192837465,
-                    ),
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                time.sleep(20)
-                attempts += 1
-                continue
+    async def _request(
+        self,
+        label: str,
+        conversation: list[Message],
+        response_format: type[R],
+        adaptive: bool = False,
+    ) -> R:
+        """
+        JSON request, retried by the executor. Adaptive requests go without a
+        response schema: it is described in the system instruction, ahead of
+        the conversation so that the provider can cache it. On a parse failure,
+        the model is told why its last answer was rejected and the temperature
+        is raised, to get a different output.
+        """
+        contents = self._to_google_messages(conversation)
+        system_instruction = (
+            GoogleLLMClient.generate_prompt_from_pydantic(response_format).strip()
+            if adaptive
+            else None
+        )
+        truncated = False
 
-            try:
-                llm_response = LLMTestStepPlanResponse.model_validate(
-                    ast.literal_eval(response.text or "")
-                )
+        async def send(attempt: Attempt) -> str:
+            nonlocal truncated
+            temperature = 0.0
+            request_contents = contents
+            if adaptive and attempt.last_parse_error is not None:
+                convo = deepcopy(conversation)
+                convo[-1].content += error_suffix(attempt.last_parse_error)
                 self.logger.info(
-                    f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
+                    f"user message after error_suffix:\n{convo[-1].content}"
                 )
-                return llm_response
+                request_contents = self._to_google_messages(convo)
+                temperature = 0.2 * (attempt.number - 1)
+            response = await self.client.aio.models.generate_content(
+                model=self.model,
+                contents=request_contents,
+                config=types.GenerateContentConfig(
+                    system_instruction=system_instruction,
+                    response_mime_type="application/json",
+                    response_schema=None if adaptive else response_format,
+                    temperature=temperature,
+                    seed=192837465,
+                ),
+            )
+            log_usage(self.logger, label, self._usage(response.usage_metadata))
+            truncated = bool(response.candidates) and (
+                response.candidates[0].finish_reason == types.FinishReason.MAX_TOKENS
+            )
+            return response.text or ""
 
-            except Exception as e:
-                self.logger.info(f"Raw response:\n{response.text}")
-                self.logger.error(f"Error #{attempts} in plan step parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning request")
+        def parse(text: str) -> R:
+            return decode_response(text, response_format, truncated)
+
+        return await self.executor.run(
+            label,
+            send,
+            parse,
+            request_priority(response_format),
+            conversation_images(conversation),
+        )
+
+    @override
+    async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
+        """Get list of act/assert workers from LLM."""
+        self.logger.debug(f"Init Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan step", conversation, LLMTestStepPlanResponse
+        )
+        self.logger.info(
+            f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def followup_step(
         self, conversation: list[Message]
     ) -> LLMTestStepFollowUpResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"FollowUp Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-pro-exp-02-05",
-                    contents=self._to_google_messages(conversation),
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=LLMTestStepFollowUpResponse,
-                        temperature=0,
-                        seed=192837465,
-                    ),
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan followup call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                time.sleep(20)
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepFollowUpResponse.model_validate(
-                    ast.literal_eval(response.text or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.info(f"Raw response:\n{response.text}")
-                self.logger.error(
-                    f"Error #{attempts} in plan followup parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send step planning followup request")
+        self.logger.debug(f"FollowUp Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan followup", conversation, LLMTestStepFollowUpResponse
+        )
+        self.logger.info(
+            f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def recover_step(
         self, conversation: list[Message]
     ) -> LLMTestStepRecoverResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-pro-exp-02-05",
-                    contents=self._to_google_messages(conversation),
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=LLMTestStepRecoverResponse,
-                        temperature=0,
-                        seed=192837465,
-                    ),
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan recover call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                time.sleep(20)
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepRecoverResponse.model_validate(
-                    ast.literal_eval(response.text or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                if llm_response.plan:
-                    self.logger.info(
-                        f"[Recover] Received {len(llm_response.plan.workers)} worker configurations from LLM"
-                    )
-                else:
-                    self.logger.info("[Recover] Test step is considered FAIL")
-
-                return llm_response
+        self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan recover", conversation, LLMTestStepRecoverResponse
+        )
+        self.logger.info(
+            f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        if llm_response.plan:
+            self.logger.info(
+                f"[Recover] Received {len(llm_response.plan.workers)} worker configurations from LLM"
+            )
+        else:
+            self.logger.info("[Recover] Test step is considered FAIL")
 
-            except Exception as e:
-                self.logger.info(f"Raw response:\n{response.text}")
-                self.logger.error(
-                    f"Error #{attempts} in plan recover parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning recover request")
+        return llm_response
 
     @override
     async def act(self, conversation: list[Message]) -> LLMActResponse:
         """Actor call"""
-        attempts = 1
-        error_suffix = ""
-        expected_format = GoogleLLMClient.generate_prompt_from_pydantic(LLMActResponse)
-        conversation[-1].content += expected_format
-        while attempts <= self.max_tries:
-            convo = deepcopy(conversation)
-            convo[-1].content += error_suffix
-            if error_suffix:
-                self.logger.info(
-                    f"user message after error_suffix:\n{convo[-1].content}"
-                )
-            try:
-                # self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-pro-exp-02-05",
-                    contents=self._to_google_messages(convo),
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        # response_schema=LLMActGoogleResponse,
-                        temperature=0
-                        + (
-                            0.2 * (attempts - 1)
-                        ),  # We increase the temp with the failures to expect a different output
-                        seed=192837465,
-                    ),
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                time.sleep(20)
-                attempts += 1
-                continue
-            try:
-                if not response.text:
-                    raise Exception("LLM response is empty")
-                self.logger.debug(f"Received Actor raw response:\n{response.text}")
-                llm_response = LLMActResponse.model_validate(
-                    ast.literal_eval(response.text or "")
-                )
-                self.logger.info(
-                    f"Actor response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.info(f"Raw response:\n{response.text}")
-                self.logger.error(f"Error #{attempts} in act parsing: {str(e)}")
-                error_suffix = (
-                    "\nNote that your last answer could not be parsed by pydantic:"
-                    f"\n{str(e)}\nPlease ensure you respect the provided response schema. "
-                    "In case of a failed status, make sure to explicitely mention the finish command."
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Act request")
+        self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "act", conversation, LLMActResponse, adaptive=True
+        )
+        self.logger.info(f"Actor response:\n{llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
         """Assertor call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-pro-exp-02-05",
-                    contents=self._to_google_messages(conversation),
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=LLMAssertResponse,
-                        temperature=0,
-                        seed=192837465,
-                    ),
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                time.sleep(20)
-                attempts += 1
-                continue
-            try:
-                if not response.text:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMAssertResponse.model_validate(
-                    ast.literal_eval(response.text or "")
-                )
-                self.logger.info(
-                    f"Received Assertor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.info(f"Raw response:\n{response.text}")
-                self.logger.error(f"Error #{attempts} in assert parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Assert request")
+        self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request("assert", conversation, LLMAssertResponse)
+        self.logger.info(
+            f"Received Assertor response {llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def step_postprocess(
         self, system: str, user: str, screenshots: list[bytes]
     ) -> LLMDataExtractionResponse:
         """Data Extraction call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            conversation: list[Message] = [
-                Message(role=MessageRole.System, content=system),
-                Message(
-                    role=MessageRole.User,
-                    content=user,
-                    screenshot=screenshots,
-                ),
-            ]
-            try:
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-pro-exp-02-05",
-                    contents=self._to_google_messages(conversation),
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema=LLMDataExtractionResponse,
-                        temperature=0,
-                        seed=192837465,
-                    ),
-                )
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction call: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                time.sleep(20)
-                attempts += 1
-                continue
-            try:
-                resp_msg = response.text
-                if not resp_msg:
-                    raise Exception("Data extraction response is empty")
-                llm_response = LLMDataExtractionResponse.model_validate(
-                    ast.literal_eval(response.text or "")
-                )
-
-                self.logger.info(
-                    f"Received Data Extraction response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
+        conversation: list[Message] = [
+            Message(role=MessageRole.System, content=system),
+            Message(
+                role=MessageRole.User,
+                content=user,
+                screenshot=screenshots,
+            ),
+        ]
+        llm_response = await self._request(
+            "data extraction", conversation, LLMDataExtractionResponse
+        )
+        self.logger.info(
+            f"Received Data Extraction response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
-            except Exception as e:
-                self.logger.info(f"Raw response:\n{response.text}")
-                self.logger.error(
-                    f"Error #{attempts} in data extraction parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Data extraction request")
+    @staticmethod
+    def _usage(
+        usage: types.GenerateContentResponseUsageMetadata | None,
+    ) -> TokenUsage | None:
+        """Repeated prompt prefixes are cached implicitly by the API"""
+        if usage is None:
+            return None
+        return TokenUsage(
+            input_tokens=usage.prompt_token_count or 0,
+            output_tokens=usage.candidates_token_count or 0,
+            cached_tokens=usage.cached_content_token_count or 0,
+        )
 
     @staticmethod
     def generate_prompt_from_pydantic(model: type[BaseModel]) -> str:
         """
         Google has trouble adhering to certain schemas, especially for the act call
         """
-        schema = model.model_json_schema()
-        prompt = (
-            "\nYour response must be a json.loads parsable JSON object, following this Pydantic JSON schema:\n"
-            f"{json.dumps(schema, indent=2)}"
-            "\n please omit properties that have a default null if you don't plan on valuing them"
-        )
-        return prompt
+        return schema_prompt(LLMProvider.GOOGLE, model).text
 
     def _to_google_messages(
         self, conversation: list[Message]
     ) -> list[types.ContentUnion]:
         messages: list[types.ContentUnion] = []
+        images: list[EncodedImage] = []
         for msg in conversation:
             match msg.role:
                 case MessageRole.Assistant:
@@ -382,13 +247,17 @@ class GoogleLLMClient(LLMClient):
                     content: list[types.Part] = [types.Part(text=msg.content)]
                     if msg.screenshot:
                         for screenshot in msg.screenshot:
+                            stored = screenshot_store().get(screenshot)
+                            images.append(stored.image)
                             content.append(
                                 types.Part.from_bytes(
-                                    data=screenshot,
-                                    mime_type="image/png",
+                                    data=stored.image.data,
+                                    mime_type=stored.image.mime_type,
                                 )
                             )
                     messages.append(types.Content(role="user", parts=content))
                 case _:  # we dismiss system prompts with google, for now
                     continue
+        if images:
+            self.logger.debug(describe_savings(images))
         return messages
@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+from enum import Enum
+from functools import cache
+from io import BytesIO
+import math
+import os
+
+from PIL import Image
+
+
+class ImageFormat(str, Enum):
+    PNG = "png"
+    JPEG = "jpeg"
+    WEBP = "webp"
+
+
+@dataclass(frozen=True)
+class ImageConfig:
+    """How screenshots are prepared before being sent to a LLM"""
+
+    max_dimension: int = 1280
+    format: ImageFormat = ImageFormat.JPEG
+    quality: int = 80
+    grayscale: bool = False
+
+    @classmethod
+    def from_env(cls) -> "ImageConfig":
+        """Defaults, overridden by the VTAAS_IMAGE_* environment variables"""
+        default = cls()
+        return cls(
+            max_dimension=int(
+                os.getenv("VTAAS_IMAGE_MAX_DIMENSION", default.max_dimension)
+            ),
+            format=ImageFormat(
+                os.getenv("VTAAS_IMAGE_FORMAT", default.format.value).lower()
+            ),
+            quality=int(os.getenv("VTAAS_IMAGE_QUALITY", default.quality)),
+            grayscale=os.getenv("VTAAS_IMAGE_GRAYSCALE", "false").lower()
+            in ("1", "true", "yes"),
+        )
+
+
+@cache
+def image_config() -> ImageConfig:
+    return ImageConfig.from_env()
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """A screenshot ready to be uploaded, with what it saved"""
+
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_size: int
+    original_width: int
+    original_height: int
+
+    @property
+    def tokens(self) -> int:
+        return estimate_image_tokens(self.width, self.height)
+
+    @property
+    def original_tokens(self) -> int:
+        return estimate_image_tokens(self.original_width, self.original_height)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Rough token cost of an image: providers bill vision inputs by area"""
+    return math.ceil(width * height / 750)
+
+
+def prepare_image(screenshot: bytes, config: ImageConfig | None = None) -> EncodedImage:
+    """Downscale and re-encode a (PNG) screenshot according to the config"""
+    config = config or image_config()
+    image = Image.open(BytesIO(screenshot))
+    original_width, original_height = image.size
+    image.load()
+
+    scale = config.max_dimension / max(original_width, original_height)
+    if scale < 1:
+        size = (
+            max(1, round(original_width * scale)),
+            max(1, round(original_height * scale)),
+        )
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    if config.grayscale:
+        image = image.convert("L")
+    elif config.format == ImageFormat.JPEG or image.mode not in ("RGB", "RGBA"):
+        # JPEG has no alpha channel
+        image = image.convert("RGB")
+
+    if (
+        config.format == ImageFormat.PNG
+        and image.size == (original_width, original_height)
+        and not config.grayscale
+    ):
+        data = screenshot
+    else:
+        buffer = BytesIO()
+        match config.format:
+            case ImageFormat.PNG:
+                image.save(buffer, format="PNG", optimize=True)
+            case ImageFormat.JPEG:
+                image.save(buffer, format="JPEG", quality=config.quality, optimize=True)
+            case ImageFormat.WEBP:
+                image.save(buffer, format="WEBP", quality=config.quality, method=4)
+        data = buffer.getvalue()
+
+    return EncodedImage(
+        data=data,
+        mime_type=f"image/{config.format.value}",
+        width=image.width,
+        height=image.height,
+        original_size=len(screenshot),
+        original_width=original_width,
+        original_height=original_height,
+    )
+
+
+def describe_savings(images: list[EncodedImage]) -> str:
+    """One line summary of the bytes and tokens saved on a request"""
+    original_size = sum(image.original_size for image in images)
+    size = sum(len(image.data) for image in images)
+    original_tokens = sum(image.original_tokens for image in images)
+    tokens = sum(image.tokens for image in images)
+    return (
+        f"{len(images)} image(s): {original_size / 1024:.0f}kB -> {size / 1024:.0f}kB, "
+        + f"~{original_tokens} -> ~{tokens} tokens"
+    )
@@ -1,8 +1,10 @@
+from collections.abc import Callable
 from enum import Enum
 from logging import Logger
-from typing import Protocol
+from typing import Protocol, runtime_checkable
 
 from ..schemas.llm import (
+    Command,
     LLMActResponse,
     LLMAssertResponse,
     LLMDataExtractionResponse,
@@ -11,10 +13,12 @@ from ..schemas.llm import (
     LLMTestStepRecoverResponse,
     Message,
 )
+from ..utils.logger import release_worker_logger
 
 
 class LLMClient(Protocol):
     logger: Logger
+    model: str
 
     async def plan_step(
         self, conversation: list[Message]
@@ -37,7 +41,16 @@ class LLMClient(Protocol):
     ) -> LLMDataExtractionResponse: ...
 
     def close(self):
-        self.logger.handlers.clear()
+        release_worker_logger(self.logger)
+
+
+@runtime_checkable
+class StreamingLLMClient(Protocol):
+    """A LLM client that hands the Actor command over before its answer is complete"""
+
+    async def act_stream(
+        self, conversation: list[Message], on_command: Callable[[Command], None]
+    ) -> LLMActResponse: ...
 
 
 class LLMProvider(str, Enum):
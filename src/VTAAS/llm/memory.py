@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+import os
+import re
+
+from VTAAS.schemas.llm import Message, MessageRole
+
+MARKS_OPEN = "<marks>"
+MARKS_CLOSE = "</marks>"
+_MARKS_BLOCK = re.compile(
+    re.escape(MARKS_OPEN) + r".*?" + re.escape(MARKS_CLOSE), flags=re.DOTALL
+)
+STALE_MARKS = f"{MARKS_OPEN}(outdated labels, see the latest ones){MARKS_CLOSE}"
+OMITTED_SCREENSHOTS = "[{count} older screenshot(s) omitted]"
+
+
+@dataclass(frozen=True)
+class MemoryPolicy:
+    """
+    What of a growing conversation is actually sent to the LLM.
+    The system prompt and the first user prompt (the task) are sent as they
+    are, so that they stay a cached prefix. Among the following user messages:
+    - keep_screenshots: only the last K user messages keep their screenshots
+    - drop_stale_marks: only the latest labels listing is kept
+    - keep_turns: user messages older than the last K are cut down to their
+      first summary_chars characters
+    None disables a limit. Assistant messages are always kept: they are small
+    and carry the decisions taken so far.
+    """
+
+    keep_screenshots: int | None = None
+    drop_stale_marks: bool = False
+    keep_turns: int | None = None
+    summary_chars: int = 300
+
+    def view(self, conversation: list[Message]) -> list[Message]:
+        """The conversation to send. The conversation itself is left untouched."""
+        task_index = self._task_index(conversation)
+        user_indices = [
+            i
+            for i, msg in enumerate(conversation)
+            if msg.role == MessageRole.User and i > task_index
+        ]
+        later_turns = set(user_indices)
+        with_screenshots = set(self._last(user_indices, self.keep_screenshots))
+        with_full_content = set(self._last(user_indices, self.keep_turns))
+        latest_marks = next(
+            (
+                i
+                for i in reversed(range(len(conversation)))
+                if conversation[i].role == MessageRole.User
+                and MARKS_OPEN in conversation[i].content
+            ),
+            None,
+        )
+
+        view: list[Message] = []
+        for i, msg in enumerate(conversation):
+            if msg.role != MessageRole.User:
+                view.append(msg)
+                continue
+            content = msg.content
+            screenshot = msg.screenshot
+            if self.drop_stale_marks and i in later_turns and i != latest_marks:
+                content = _MARKS_BLOCK.sub(STALE_MARKS, content)
+            if i in later_turns and i not in with_full_content:
+                content = self._summarize(content)
+            if i in later_turns and i not in with_screenshots and screenshot:
+                content += "\n" + OMITTED_SCREENSHOTS.format(count=len(screenshot))
+                screenshot = None
+            if content == msg.content and screenshot is msg.screenshot:
+                view.append(msg)
+            else:
+                view.append(
+                    msg.model_copy(
+                        update={"content": content, "screenshot": screenshot}
+                    )
+                )
+        return view
+
+    def _summarize(self, content: str) -> str:
+        if len(content) <= self.summary_chars:
+            return content
+        return content[: self.summary_chars].rstrip() + " [...]"
+
+    @staticmethod
+    def _task_index(conversation: list[Message]) -> int:
+        return next(
+            (i for i, msg in enumerate(conversation) if msg.role == MessageRole.User),
+            len(conversation),
+        )
+
+    @staticmethod
+    def _last(indices: list[int], count: int | None) -> list[int]:
+        if count is None:
+            return indices
+        return indices[-count:] if count > 0 else []
+
+
+# Actor rounds all resend the full page: older screenshots and labels are
+# superseded by the latest ones.
+ACTOR_MEMORY = MemoryPolicy(keep_screenshots=2, drop_stale_marks=True)
+# Planning turns report on worker results: the older screenshots are the
+# ones the orchestrator already reasoned about.
+ORCHESTRATOR_MEMORY = MemoryPolicy(keep_screenshots=2)
+
+
+def full_history() -> bool:
+    """VTAAS_FULL_HISTORY: send whole conversations, e.g. to compare runs"""
+    return os.getenv("VTAAS_FULL_HISTORY", "false").lower() in ("1", "true")
+
+
+def memory_policy(policy: MemoryPolicy) -> MemoryPolicy:
+    """The given policy, or none at all when the full history is requested"""
+    return MemoryPolicy() if full_history() else policy
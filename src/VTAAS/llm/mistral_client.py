@@ -1,11 +1,8 @@
-import ast
-import base64
-import json
+from functools import cache
 from logging import Logger
 import os
 import time
-from typing import override
-from uuid import uuid4
+from typing import TypeVar, override
 
 from mistralai import Mistral
 from mistralai.models import (
@@ -16,11 +13,21 @@ from mistralai.models import (
     SystemMessage,
     TextChunk,
     UserMessage,
+    UsageInfo,
     UserMessageContent,
 )
 from pydantic import BaseModel
 
-from VTAAS.llm.llm_client import LLMClient
+from VTAAS.llm.accounting import conversation_images, log_usage
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.images import EncodedImage, describe_savings
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.registry import shared_sdk_client
+from VTAAS.llm.retry import Attempt, RequestExecutor
+from VTAAS.llm.scheduler import request_priority
+from VTAAS.llm.schema_prompts import example_prompt, schema_prompt
+from VTAAS.llm.screenshot_store import screenshot_store
+from VTAAS.llm.usage import TokenUsage
 
 
 from ..schemas.llm import (
@@ -37,10 +44,29 @@ from ..schemas.llm import (
     SequenceType,
 )
 
-from ..utils.logger import get_logger
+from ..utils.logger import get_worker_logger
 from ..utils.config import load_config
 import sys
 
+R = TypeVar("R", bound=BaseModel)
+
+
+@cache
+def plan_format_prompt() -> str:
+    """The plan step answer format, shown as an example. Built once."""
+    return MistralLLMClient.generate_prompt_from_pydantic_model(
+        LLMTestStepPlanResponse(
+            current_step_analysis="{{ current step analysis }}",
+            screenshot_analysis="{{ screenshot analysis }}",
+            previous_actions_analysis="{{ previous actions analysis }}",
+            workers=[
+                WorkerConfig(type=WorkerType.ACTOR, query="act query"),
+                WorkerConfig(type=WorkerType.ASSERTOR, query="assert query"),
+            ],
+            sequence_type=SequenceType.full,
+        )
+    )
+
 
 class MistralLLMClient(LLMClient):
     """Communication with Mistral"""
@@ -51,309 +77,187 @@ class MistralLLMClient(LLMClient):
         start_time: float,
         output_folder: str,
         model: str = "pixtral-large-latest",
+        worker: str = "main",
     ):
         load_config()
         self.start_time: float = start_time
         self.output_folder: str = output_folder
         self.model: str = model
         self.name: str = name
-        self.logger: Logger = get_logger(
-            "Mistral LLM Client - " + self.name + " - " + uuid4().hex,
+        self.logger: Logger = get_worker_logger(
+            "Mistral LLM Client - " + self.name,
+            worker,
             self.start_time,
             self.output_folder,
         )
-        self.max_tries: int = 3
+        self.executor: RequestExecutor = RequestExecutor(
+            LLMProvider.MISTRAL, self.model, self.logger, worker=worker
+        )
         try:
-            self.aclient: Mistral = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+            self.aclient: Mistral = shared_sdk_client(
+                LLMProvider.MISTRAL,
+                self.model,
+                lambda: Mistral(api_key=os.getenv("MISTRAL_API_KEY")),
+            )
         except Exception as e:
             self.logger.fatal(e, exc_info=True)
             sys.exit(1)
 
+    async def _request(
+        self,
+        label: str,
+        conversation: list[Message],
+        response_format: type[R],
+        format_prompt: str | None = None,
+    ) -> R:
+        """
+        Structured output request, retried by the executor. With a format
+        prompt, plain JSON mode: the format is described at the end of the
+        system prompt, ahead of the conversation so that it stays a stable
+        prefix, and the answer is prefilled with '{"'.
+        """
+        messages = self._to_mistral_messages(conversation)
+        if format_prompt is not None:
+            messages = self._with_format(messages, format_prompt)
+        truncated = False
+
+        async def send(_: Attempt) -> str:
+            nonlocal truncated
+            response = await self.aclient.chat.complete_async(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+                frequency_penalty=0.7,
+                response_format={"type": "json_object"}
+                if format_prompt is not None
+                else response_format,
+            )
+            log_usage(self.logger, label, self._usage(response.usage))
+            if not response.choices:
+                raise ValueError("LLM response has no choices")
+            truncated = response.choices[0].finish_reason == "length"
+            content = response.choices[0].message.content
+            return content if isinstance(content, str) else ""
+
+        def parse(content: str) -> R:
+            return decode_response(content, response_format, truncated)
+
+        return await self.executor.run(
+            label,
+            send,
+            parse,
+            request_priority(response_format),
+            conversation_images(conversation),
+        )
+
     @override
     async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
         """Get list of act/assert workers from LLM."""
-        attempts = 1
-        expected_format = MistralLLMClient.generate_prompt_from_pydantic_model(
-            LLMTestStepPlanResponse(
-                current_step_analysis="{{ current step analysis }}",
-                screenshot_analysis="{{ screenshot analysis }}",
-                previous_actions_analysis="{{ previous actions analysis }}",
-                workers=[
-                    WorkerConfig(type=WorkerType.ACTOR, query="act query"),
-                    WorkerConfig(type=WorkerType.ASSERTOR, query="assert query"),
-                ],
-                sequence_type=SequenceType.full,
-            )
+        self.logger.debug(f"Init Plan Step Message:\n{conversation[-1].content}")
+        expected_format = plan_format_prompt()
+        llm_response = await self._request(
+            "plan step",
+            conversation,
+            LLMTestStepPlanResponse,
+            format_prompt=expected_format,
         )
-        conversation[-1].content += expected_format
-        preshot_assistant = Message(
-            role=MessageRole.Assistant,
-            content='{"',
+        self.logger.info(
+            f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
         )
-        conversation.append(preshot_assistant)
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"Init Plan Step Message:\n{conversation[-1].content}"
-                )
-                # resp_format = ResponseFormat(
-                #     type="json_schema",
-                #     json_schema=JSONSchema(
-                #         name="Test step plan response",
-                #         schema_definition=LLMTestStepPlanResponse.model_json_schema(),
-                #     ),
-                # )
-                response = await self.aclient.chat.complete_async(
-                    model=self.model,
-                    messages=self._to_mistral_messages(conversation),
-                    temperature=0,
-                    frequency_penalty=0.7,
-                    response_format={"type": "json_object"},
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepPlanResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step parsing: {str(e)}")
-                self.logger.info(f"Raw response: {response.choices[0].message.content}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning request")
+        return llm_response
 
     @override
     async def followup_step(
         self, conversation: list[Message]
     ) -> LLMTestStepFollowUpResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"FollowUp Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = await self.aclient.chat.complete_async(
-                    model=self.model,
-                    messages=self._to_mistral_messages(conversation),
-                    temperature=0,
-                    frequency_penalty=0.7,
-                    response_format=LLMTestStepFollowUpResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan followup call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepFollowUpResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan followup parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send step planning followup request")
+        self.logger.debug(f"FollowUp Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan followup", conversation, LLMTestStepFollowUpResponse
+        )
+        self.logger.info(
+            f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def recover_step(
         self, conversation: list[Message]
     ) -> LLMTestStepRecoverResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
-                response = await self.aclient.chat.complete_async(
-                    model=self.model,
-                    messages=self._to_mistral_messages(conversation),
-                    temperature=0,
-                    frequency_penalty=0.7,
-                    response_format=LLMTestStepRecoverResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan recover call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMTestStepRecoverResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan recover parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning recover request")
+        self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan recover", conversation, LLMTestStepRecoverResponse
+        )
+        self.logger.info(
+            f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def act(self, conversation: list[Message]) -> LLMActResponse:
         """Actor call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
-                response = await self.aclient.chat.complete_async(
-                    model=self.model,
-                    messages=self._to_mistral_messages(conversation),
-                    temperature=0,
-                    frequency_penalty=0.7,
-                    response_format=LLMActResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMActResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Actor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Act request")
+        self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request("act", conversation, LLMActResponse)
+        self.logger.info(f"Actor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
         """Assertor call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
-                response = await self.aclient.chat.complete_async(
-                    model=self.model,
-                    messages=self._to_mistral_messages(conversation),
-                    temperature=0,
-                    frequency_penalty=0.7,
-                    response_format=LLMAssertResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMAssertResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Assertor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Assert request")
+        self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request("assert", conversation, LLMAssertResponse)
+        self.logger.info(f"Assertor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def step_postprocess(
         self, system: str, user: str, screenshots: list[bytes]
     ) -> LLMDataExtractionResponse:
         """Data Extraction call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            conversation: list[Message] = [
-                Message(role=MessageRole.System, content=system),
-                Message(
-                    role=MessageRole.User,
-                    content=user,
-                    screenshot=screenshots,
-                ),
-            ]
-            try:
-                response = await self.aclient.chat.complete_async(
-                    model=self.model,
-                    messages=self._to_mistral_messages(conversation),
-                    temperature=0,
-                    frequency_penalty=0.7,
-                    response_format=LLMDataExtractionResponse,
-                )
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction call: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                resp_msg = response.choices[0].message.content
-                if not resp_msg:
-                    raise Exception("Data Extraction response is empty")
-                llm_response = LLMDataExtractionResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
+        conversation: list[Message] = [
+            Message(role=MessageRole.System, content=system),
+            Message(
+                role=MessageRole.User,
+                content=user,
+                screenshot=screenshots,
+            ),
+        ]
+        llm_response = await self._request(
+            "data extraction", conversation, LLMDataExtractionResponse
+        )
+        self.logger.info(
+            f"Data extraction response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
-                self.logger.info(
-                    f"Data extraction response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
+    @staticmethod
+    def _with_format(messages: list[Messages], format_prompt: str) -> list[Messages]:
+        messages = list(messages)
+        first = messages[0] if messages else None
+        if isinstance(first, SystemMessage) and isinstance(first.content, str):
+            messages[0] = SystemMessage(
+                role="system", content=first.content + "\n" + format_prompt
+            )
+        else:
+            messages.insert(
+                0, SystemMessage(role="system", content=format_prompt.strip())
+            )
+        messages.append(AssistantMessage(role="assistant", content='{"', prefix=True))
+        return messages
 
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Data extraction request")
+    @staticmethod
+    def _usage(usage: UsageInfo | None) -> TokenUsage | None:
+        """No prompt cache reported by Mistral"""
+        if usage is None:
+            return None
+        return TokenUsage(
+            input_tokens=usage.prompt_tokens, output_tokens=usage.completion_tokens
+        )
 
     def _to_mistral_messages(self, conversation: list[Message]) -> list[Messages]:
         messages: list[Messages] = []
+        images: list[EncodedImage] = []
         for msg in conversation:
             match msg.role:
                 case MessageRole.System:
@@ -367,11 +271,10 @@ class MistralLLMClient(LLMClient):
                     content.append(TextChunk(type="text", text=msg.content))
                     if msg.screenshot:
                         for screenshot in msg.screenshot:
-                            base64_screenshot = str(
-                                base64.b64encode(screenshot), "utf-8"
-                            )
+                            stored = screenshot_store().get(screenshot)
+                            images.append(stored.image)
                             image = ImageURL(
-                                url=f"data:image/png;base64,{base64_screenshot}",
+                                url=stored.data_url,
                                 detail="high",
                             )
                             content.append(
@@ -380,6 +283,8 @@ class MistralLLMClient(LLMClient):
                     messages.append(UserMessage(content=content, role="user"))
         if isinstance(messages[-1], AssistantMessage):
             messages[-1].prefix = True
+        if images:
+            self.logger.debug(describe_savings(images))
         return messages
 
     @staticmethod
@@ -387,29 +292,11 @@ class MistralLLMClient(LLMClient):
         """
         Mistral is supposed to handle structured outputs but does not. Let's ask the model to adhere to the format in the prompt
         """
-        schema = model.model_dump_json(indent=2)
-        prompt = (
-            "\nYour response must be a json.loads parsable JSON object, similar to this:\n"
-            f"{json.dumps(schema, indent=2)}"
-            # "\n please omit properties that have a default null if you don't plan on valuing them"
-        )
-        return prompt
+        return example_prompt(model)
 
     @staticmethod
     def generate_prompt_from_pydantic(model: type[BaseModel]) -> str:
         """
         Mistral is supposed to handle structured outputs but does not. Let's ask the model to adhere to the format in the prompt
         """
-        schema = model.model_json_schema()
-        prompt = (
-            "\nYour response must be a json.loads parsable JSON object, similar to this:\n"
-            f"{json.dumps(schema, indent=2)}"
-            # "\n please omit properties that have a default null if you don't plan on valuing them"
-        )
-        return prompt
-
-    @staticmethod
-    def extract_json(response: str) -> str:
-        json_start = response.index("{")
-        json_end = response.rfind("}")
-        return response[json_start : json_end + 1]
+        return schema_prompt(LLMProvider.MISTRAL, model).text
@@ -1,10 +1,8 @@
-import ast
-import base64
-from collections.abc import Iterable
+from collections.abc import AsyncIterator, Callable, Iterable
+import json
 from logging import Logger
 import time
-from typing import override
-from uuid import uuid4
+from typing import Any, TypeVar, override
 
 from openai.types.chat import (
     ChatCompletionAssistantMessageParam,
@@ -16,13 +14,28 @@ from openai.types.chat import (
     ChatCompletionUserMessageParam,
 )
 from openai.types.chat.chat_completion_content_part_image_param import ImageURL
+from openai.types.completion_usage import CompletionUsage
 from openai import OpenAIError, AsyncOpenAI
+from openai.lib._parsing._completions import type_to_response_format_param
+from pydantic import BaseModel
 
-from VTAAS.llm.llm_client import LLMClient
+from VTAAS.llm.accounting import conversation_images, log_usage
+from VTAAS.llm.batch import BatchFailedError, BatchRequest, BatchResult
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.images import EncodedImage, describe_savings
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.registry import shared_sdk_client
+from VTAAS.llm.retry import Attempt, RequestExecutor
+from VTAAS.llm.scheduler import request_priority
+from VTAAS.llm.screenshot_store import screenshot_store
+from VTAAS.llm.streaming import StreamEnd, stream_act
+from VTAAS.llm.usage import TokenUsage
 
 
 from ..schemas.llm import (
+    Command,
     LLMActResponse,
+    LLMStreamedActResponse,
     LLMAssertResponse,
     LLMDataExtractionResponse,
     LLMTestStepFollowUpResponse,
@@ -32,10 +45,86 @@ from ..schemas.llm import (
     MessageRole,
 )
 
-from ..utils.logger import get_logger
+from ..utils.logger import get_worker_logger
 from ..utils.config import load_config
 import sys
 
+R = TypeVar("R", bound=BaseModel)
+
+
+def openai_usage(usage: CompletionUsage | None) -> TokenUsage | None:
+    """Prompts sharing a prefix of 1024+ tokens are cached automatically"""
+    if usage is None:
+        return None
+    details = usage.prompt_tokens_details
+    return TokenUsage(
+        input_tokens=usage.prompt_tokens,
+        output_tokens=usage.completion_tokens,
+        cached_tokens=(details.cached_tokens or 0) if details else 0,
+    )
+
+
+class OpenAIBatchBackend:
+    """The Batch API: requests are uploaded as a JSONL file, answered within 24h"""
+
+    def __init__(self, client: AsyncOpenAI):
+        self.client: AsyncOpenAI = client
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        lines = "\n".join(
+            json.dumps(
+                {
+                    "custom_id": request.custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": request.body,
+                }
+            )
+            for request in requests
+        )
+        file = await self.client.files.create(
+            file=("requests.jsonl", lines.encode()), purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> list[BatchResult] | None:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise BatchFailedError(f"OpenAI batch {batch_id} {batch.status}")
+        if batch.status != "completed":
+            return None
+        results: list[BatchResult] = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                results.extend(
+                    self._result(json.loads(line))
+                    for line in content.text.splitlines()
+                    if line.strip()
+                )
+        return results
+
+    @staticmethod
+    def _result(line: dict[str, Any]) -> BatchResult:
+        custom_id: str = line["custom_id"]
+        response: dict[str, Any] = line.get("response") or {}
+        body: dict[str, Any] = response.get("body") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            return BatchResult(custom_id, error=str(line.get("error") or body))
+        usage = body.get("usage")
+        return BatchResult(
+            custom_id,
+            text=body["choices"][0]["message"]["content"] or "",
+            usage=openai_usage(CompletionUsage.model_validate(usage))
+            if usage
+            else None,
+        )
+
 
 class OpenAILLMClient(LLMClient):
     """Communication with OpenAI"""
@@ -46,291 +135,191 @@ class OpenAILLMClient(LLMClient):
         start_time: float,
         output_folder: str,
         model: str = "gpt-4o-2024-11-20",
+        worker: str = "main",
     ):
         load_config()
         self.start_time: float = start_time
         self.output_folder: str = output_folder
         self.model: str = model
         self.name: str = name
-        self.logger: Logger = get_logger(
-            "OpenAI LLM Client - " + self.name + " - " + uuid4().hex,
+        self.logger: Logger = get_worker_logger(
+            "OpenAI LLM Client - " + self.name,
+            worker,
             self.start_time,
             self.output_folder,
         )
-        self.max_tries: int = 3
+        self.executor: RequestExecutor = RequestExecutor(
+            LLMProvider.OPENAI, self.model, self.logger, worker=worker
+        )
         try:
-            self.aclient: AsyncOpenAI = AsyncOpenAI()
+            # retries are left to the executor, which shares the rate limit
+            self.aclient: AsyncOpenAI = shared_sdk_client(
+                LLMProvider.OPENAI, self.model, lambda: AsyncOpenAI(max_retries=0)
+            )
         except OpenAIError as e:
             self.logger.fatal(e, exc_info=True)
             sys.exit(1)
 
+    def batch_backend(self) -> OpenAIBatchBackend:
+        return OpenAIBatchBackend(self.aclient)
+
+    def batch_body(
+        self, conversation: list[Message], response_format: type[BaseModel]
+    ) -> dict[str, object]:
+        """The parameters of _request, for the Batch API"""
+        return {
+            "model": self.model,
+            "messages": self._to_openai_messages(conversation),
+            "temperature": 0,
+            "seed": 192837465,
+            "frequency_penalty": 0.7,
+            "response_format": type_to_response_format_param(response_format),
+        }
+
+    async def _request(
+        self, label: str, conversation: list[Message], response_format: type[R]
+    ) -> R:
+        """Structured output request, converted once and retried by the executor"""
+        messages = self._to_openai_messages(conversation)
+        truncated = False
+
+        async def send(_: Attempt) -> str:
+            nonlocal truncated
+            response = await self.aclient.beta.chat.completions.parse(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+                seed=192837465,
+                frequency_penalty=0.7,
+                response_format=response_format,
+            )
+            log_usage(self.logger, label, openai_usage(response.usage))
+            truncated = response.choices[0].finish_reason == "length"
+            return response.choices[0].message.content or ""
+
+        def parse(content: str) -> R:
+            return decode_response(content, response_format, truncated)
+
+        return await self.executor.run(
+            label,
+            send,
+            parse,
+            request_priority(response_format),
+            conversation_images(conversation),
+        )
+
     @override
     async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
         """Get list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"Init Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMTestStepPlanResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepPlanResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning request")
+        self.logger.debug(f"Init Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan step", conversation, LLMTestStepPlanResponse
+        )
+        self.logger.info(
+            f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def followup_step(
         self, conversation: list[Message]
     ) -> LLMTestStepFollowUpResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"FollowUp Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMTestStepFollowUpResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan followup call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepFollowUpResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan followup parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send step planning followup request")
+        self.logger.debug(f"FollowUp Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan followup", conversation, LLMTestStepFollowUpResponse
+        )
+        self.logger.info(
+            f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def recover_step(
         self, conversation: list[Message]
     ) -> LLMTestStepRecoverResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMTestStepRecoverResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan recover call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMTestStepRecoverResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan recover parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning recover request")
+        self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan recover", conversation, LLMTestStepRecoverResponse
+        )
+        self.logger.info(
+            f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def act(self, conversation: list[Message]) -> LLMActResponse:
         """Actor call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMActResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMActResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Actor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
+        self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request("act", conversation, LLMActResponse)
+        self.logger.info(f"Actor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
+
+    async def act_stream(
+        self, conversation: list[Message], on_command: Callable[[Command], None]
+    ) -> LLMActResponse:
+        """Actor call, streamed: on_command gets the command as soon as it is complete"""
+        self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
+        messages = self._to_openai_messages(conversation)
 
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Act request")
+        async def chunks(end: StreamEnd) -> AsyncIterator[str]:
+            async with self.aclient.beta.chat.completions.stream(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+                seed=192837465,
+                frequency_penalty=0.7,
+                response_format=LLMStreamedActResponse,
+                stream_options={"include_usage": True},
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content.delta":
+                        yield event.delta
+                final = await stream.get_final_completion()
+                log_usage(self.logger, "act", openai_usage(final.usage))
+                end.truncated = final.choices[0].finish_reason == "length"
+
+        llm_response = await stream_act(
+            self.executor, chunks, on_command, conversation_images(conversation)
+        )
+        self.logger.info(f"Actor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
         """Assertor call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMAssertResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMAssertResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Assertor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Assert request")
+        self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request("assert", conversation, LLMAssertResponse)
+        self.logger.info(f"Assertor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def step_postprocess(
         self, system: str, user: str, screenshots: list[bytes]
     ) -> LLMDataExtractionResponse:
         """Data Extraction call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            conversation: list[Message] = [
-                Message(role=MessageRole.System, content=system),
-                Message(
-                    role=MessageRole.User,
-                    content=user,
-                    screenshot=screenshots,
-                ),
-            ]
-            try:
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMDataExtractionResponse,
-                )
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction call: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                resp_msg = response.choices[0].message.content
-                if not resp_msg:
-                    raise Exception("Data Extraction response is empty")
-                llm_response = LLMDataExtractionResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-
-                self.logger.info(
-                    f"Data extraction response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Data extraction request")
+        conversation: list[Message] = [
+            Message(role=MessageRole.System, content=system),
+            Message(
+                role=MessageRole.User,
+                content=user,
+                screenshot=screenshots,
+            ),
+        ]
+        llm_response = await self._request(
+            "data extraction", conversation, LLMDataExtractionResponse
+        )
+        self.logger.info(
+            f"Data extraction response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     def _to_openai_messages(
         self, conversation: list[Message]
     ) -> Iterable[ChatCompletionMessageParam]:
         messages: Iterable[ChatCompletionMessageParam] = []
+        images: list[EncodedImage] = []
         for msg in conversation:
             match msg.role:
                 case MessageRole.System:
@@ -354,11 +343,10 @@ class OpenAILLMClient(LLMClient):
                     )
                     if msg.screenshot:
                         for screenshot in msg.screenshot:
-                            base64_screenshot = str(
-                                base64.b64encode(screenshot), "utf-8"
-                            )
+                            stored = screenshot_store().get(screenshot)
+                            images.append(stored.image)
                             image = ImageURL(
-                                url=f"data:image/png;base64,{base64_screenshot}",
+                                url=stored.data_url,
                                 detail="high",
                             )
                             content.append(
@@ -369,4 +357,6 @@ class OpenAILLMClient(LLMClient):
                     messages.append(
                         ChatCompletionUserMessageParam(content=content, role="user")
                     )
+        if images:
+            self.logger.debug(describe_savings(images))
         return messages
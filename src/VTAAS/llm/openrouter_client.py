@@ -1,13 +1,9 @@
-import ast
-import base64
 from collections.abc import Iterable
 from copy import deepcopy
-import json
 import logging
 import os
 import time
-from typing import final, override
-from uuid import uuid4
+from typing import TypeVar, final, override
 
 from openai.types.chat import (
     ChatCompletionAssistantMessageParam,
@@ -22,7 +18,16 @@ from openai.types.chat.chat_completion_content_part_image_param import ImageURL
 from openai import OpenAIError, AsyncOpenAI
 from pydantic import BaseModel
 
-from VTAAS.llm.llm_client import LLMClient
+from VTAAS.llm.accounting import conversation_images, log_usage
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.images import EncodedImage, describe_savings
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.openai_client import openai_usage
+from VTAAS.llm.registry import shared_sdk_client
+from VTAAS.llm.retry import Attempt, RequestExecutor, error_suffix
+from VTAAS.llm.scheduler import request_priority
+from VTAAS.llm.schema_prompts import schema_prompt
+from VTAAS.llm.screenshot_store import screenshot_store
 
 
 from ..schemas.llm import (
@@ -36,10 +41,12 @@ from ..schemas.llm import (
     LLMTestStepRecoverResponse,
 )
 
-from ..utils.logger import get_logger
+from ..utils.logger import get_worker_logger
 from ..utils.config import load_config
 import sys
 
+R = TypeVar("R", bound=BaseModel)
+
 
 @final
 class OpenRouterLLMClient(LLMClient):
@@ -51,348 +58,178 @@ class OpenRouterLLMClient(LLMClient):
         start_time: float,
         output_folder: str,
         model: str = "meta-llama/llama-3.2-90b-vision-instruct",
+        worker: str = "main",
     ):
         load_config()
         self.start_time = start_time
         self.output_folder = output_folder
         self.model = model
         self.name: str = name
-        self.logger = get_logger(
-            "OpenRouter LLM Client - " + self.name + " - " + uuid4().hex,
+        self.logger = get_worker_logger(
+            "OpenRouter LLM Client - " + self.name,
+            worker,
             self.start_time,
             self.output_folder,
         )
         self.logger.setLevel(logging.DEBUG)
-        self.max_tries = 3
+        self.executor = RequestExecutor(
+            LLMProvider.OPENROUTER, self.model, self.logger, worker=worker
+        )
         try:
-            self.aclient = AsyncOpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=os.getenv("OPENROUTER_API_KEY"),
+            self.aclient = shared_sdk_client(
+                LLMProvider.OPENROUTER,
+                self.model,
+                lambda: AsyncOpenAI(
+                    base_url="https://openrouter.ai/api/v1",
+                    api_key=os.getenv("OPENROUTER_API_KEY"),
+                    max_retries=0,
+                ),
             )
         except OpenAIError as e:
             self.logger.fatal(e, exc_info=True)
             sys.exit(1)
 
+    async def _request(
+        self,
+        label: str,
+        conversation: list[Message],
+        response_format: type[R],
+        adaptive: bool = False,
+    ) -> R:
+        """
+        Structured output request, retried by the executor. An adaptive request
+        tells the model why its last answer was rejected and raises the
+        temperature, to get a different output.
+        """
+        messages = self._to_openai_messages(conversation)
+        truncated = False
+
+        async def send(attempt: Attempt) -> str:
+            nonlocal truncated
+            temperature = 0.0
+            request_messages = messages
+            if adaptive and attempt.last_parse_error is not None:
+                convo = deepcopy(conversation)
+                convo[-1].content += error_suffix(attempt.last_parse_error)
+                request_messages = self._to_openai_messages(convo)
+                temperature = 0.2 * (attempt.number - 1)
+            response = await self.aclient.beta.chat.completions.parse(
+                model=self.model,
+                messages=request_messages,
+                temperature=temperature,
+                seed=192837465,
+                frequency_penalty=0.7,
+                extra_body={
+                    "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
+                },
+                response_format=response_format,
+            )
+            log_usage(self.logger, label, openai_usage(response.usage))
+            truncated = response.choices[0].finish_reason == "length"
+            return response.choices[0].message.content or ""
+
+        def parse(content: str) -> R:
+            return decode_response(content, response_format, truncated)
+
+        return await self.executor.run(
+            label,
+            send,
+            parse,
+            request_priority(response_format),
+            conversation_images(conversation),
+        )
+
     @override
     async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
         """Get list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"Init Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    response_format=LLMTestStepPlanResponse,
-                    # extra_body={"provider": {"require_parameters": True}},
-                    extra_body={
-                        "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
-                    },
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepPlanResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan step parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning request")
+        self.logger.debug(f"Init Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan step", conversation, LLMTestStepPlanResponse
+        )
+        self.logger.info(
+            f"Orchestrator Plan response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def followup_step(
         self, conversation: list[Message]
     ) -> LLMTestStepFollowUpResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(
-                    f"FollowUp Plan Step Message:\n{conversation[-1].content}"
-                )
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    extra_body={
-                        "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
-                    },
-                    response_format=LLMTestStepFollowUpResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan followup call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                llm_response = LLMTestStepFollowUpResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan followup parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send step planning followup request")
+        self.logger.debug(f"FollowUp Plan Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan followup", conversation, LLMTestStepFollowUpResponse
+        )
+        self.logger.info(
+            f"Orchestrator Follow-Up response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def recover_step(
         self, conversation: list[Message]
     ) -> LLMTestStepRecoverResponse:
         """Update list of act/assert workers from LLM."""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    extra_body={
-                        "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
-                    },
-                    response_format=LLMTestStepRecoverResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in plan recover call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMTestStepRecoverResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in plan recover parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Step planning recover request")
+        self.logger.debug(f"Recover Step Message:\n{conversation[-1].content}")
+        llm_response = await self._request(
+            "plan recover", conversation, LLMTestStepRecoverResponse
+        )
+        self.logger.info(
+            f"Orchestrator Recover response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @override
     async def act(self, conversation: list[Message]) -> LLMActResponse:
         """Actor call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            try:
-                self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    extra_body={
-                        "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
-                    },
-                    response_format=LLMActResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMActResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Actor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in act parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Act request")
+        self.logger.debug(f"Actor User Message:\n{conversation[-1].content}")
+        llm_response = await self._request("act", conversation, LLMActResponse)
+        self.logger.info(f"Actor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
         """Assertor call"""
-        attempts = 1
-        error_suffix = ""
         self.logger.debug(f"Assertor User Message:\n{conversation[-1].content}")
-        while attempts <= self.max_tries:
-            convo = deepcopy(conversation)
-            convo[-1].content += error_suffix
-            expected_format = OpenRouterLLMClient.generate_prompt_from_pydantic(
-                LLMDataExtractionResponse
-            )
-            conversation[-1].content += expected_format
-            try:
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(convo),
-                    temperature=0
-                    + (
-                        0.2 * (attempts - 1)
-                    ),  # We increase the temp with the failures to expect a different output
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    extra_body={
-                        "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
-                    },
-                    response_format=LLMAssertResponse,
-                )
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert call: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                if not response.choices[0].message.content:
-                    raise Exception("LLM response is empty")
-                llm_response = LLMAssertResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-                self.logger.info(
-                    f"Assertor response {llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(f"Error #{attempts} in assert parsing: {str(e)}")
-                if attempts >= self.max_tries:
-                    raise
-                error_suffix = (
-                    "\nNote that your last answer could not be parsed by pydantic:"
-                    f"\n{str(e)}\nPlease ensure you respect the provided response schema. "
-                    "In case of a failed status, make sure to explicitely mention the finish command."
-                )
-                attempts += 1
-                continue
-        raise Exception("could not send Assert request")
+        llm_response = await self._request(
+            "assert", conversation, LLMAssertResponse, adaptive=True
+        )
+        self.logger.info(f"Assertor response {llm_response.model_dump_json(indent=4)}")
+        return llm_response
 
     @override
     async def step_postprocess(
         self, system: str, user: str, screenshots: list[bytes]
     ) -> LLMDataExtractionResponse:
         """Data Extraction call"""
-        attempts = 1
-        while attempts <= self.max_tries:
-            conversation: list[Message] = [
-                Message(role=MessageRole.System, content=system),
-                Message(
-                    role=MessageRole.User,
-                    content=user,
-                    screenshot=screenshots,
-                ),
-            ]
-            try:
-                response = await self.aclient.beta.chat.completions.parse(
-                    model=self.model,
-                    messages=self._to_openai_messages(conversation),
-                    temperature=0,
-                    seed=192837465,
-                    frequency_penalty=0.7,
-                    extra_body={
-                        "provider": {"ignore": ["SambaNova", "DeepInfra", "Together"]}
-                    },
-                    response_format=LLMDataExtractionResponse,
-                )
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction call: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-            try:
-                resp_msg = response.choices[0].message.content
-                if not resp_msg:
-                    raise Exception("Data Extraction response is empty")
-                llm_response = LLMDataExtractionResponse.model_validate(
-                    ast.literal_eval(response.choices[0].message.content or "")
-                )
-
-                self.logger.info(
-                    f"Data extraction response:\n{llm_response.model_dump_json(indent=4)}"
-                )
-                return llm_response
-
-            except Exception as e:
-                self.logger.error(
-                    f"Error #{attempts} in data extraction parsing: {str(e)}"
-                )
-                if attempts >= self.max_tries:
-                    raise
-                attempts += 1
-                continue
-        raise Exception("could not send Data extraction request")
+        conversation: list[Message] = [
+            Message(role=MessageRole.System, content=system),
+            Message(
+                role=MessageRole.User,
+                content=user,
+                screenshot=screenshots,
+            ),
+        ]
+        llm_response = await self._request(
+            "data extraction", conversation, LLMDataExtractionResponse
+        )
+        self.logger.info(
+            f"Data extraction response:\n{llm_response.model_dump_json(indent=4)}"
+        )
+        return llm_response
 
     @staticmethod
     def generate_prompt_from_pydantic(model: type[BaseModel]) -> str:
         """
         Anthropic does not support structured outputs. Let's ask the model to adhere to the format in the prompt
         """
-        schema = model.model_json_schema()
-        prompt = (
-            "\nYour response must be a json.loads parsable JSON object, following this Pydantic JSON schema:\n"
-            f"{json.dumps(schema, indent=2)}"
-            "\n please omit properties that have a default null if you don't plan on valuing them"
-        )
-        return prompt
-
-    @staticmethod
-    def extract_json(response: str) -> str:
-        json_start = response.index("{")
-        json_end = response.rfind("}")
-        return response[json_start : json_end + 1]
+        return schema_prompt(LLMProvider.OPENROUTER, model).text
 
     def _to_openai_messages(
         self, conversation: list[Message]
     ) -> Iterable[ChatCompletionMessageParam]:
         messages: Iterable[ChatCompletionMessageParam] = []
+        images: list[EncodedImage] = []
         for msg in conversation:
             match msg.role:
                 case MessageRole.System:
@@ -416,11 +253,10 @@ class OpenRouterLLMClient(LLMClient):
                     )
                     if msg.screenshot:
                         for screenshot in msg.screenshot:
-                            base64_screenshot = str(
-                                base64.b64encode(screenshot), "utf-8"
-                            )
+                            stored = screenshot_store().get(screenshot)
+                            images.append(stored.image)
                             image = ImageURL(
-                                url=f"data:image/png;base64,{base64_screenshot}",
+                                url=stored.data_url,
                                 detail="high",
                             )
                             content.append(
@@ -431,4 +267,6 @@ class OpenRouterLLMClient(LLMClient):
                     messages.append(
                         ChatCompletionUserMessageParam(content=content, role="user")
                     )
+        if images:
+            self.logger.debug(describe_savings(images))
         return messages
@@ -0,0 +1,38 @@
+from collections.abc import Callable
+import inspect
+from typing import Any, TypeVar, cast
+
+from VTAAS.llm.llm_client import LLMProvider
+
+C = TypeVar("C")
+
+_sdk_clients: dict[tuple[LLMProvider, str], Any] = {}
+
+
+def shared_sdk_client(provider: LLMProvider, model: str, factory: Callable[[], C]) -> C:
+    """
+    Process-wide SDK client for a (provider, model) pair.
+    The first caller builds it, every later LLM client reuses it, so its HTTP
+    connection pool (and keep-alive connections) is shared across workers,
+    steps and test cases. SDK clients are bound to the event loop that uses
+    them: call close_sdk_clients() before that loop ends.
+    """
+    key = (provider, model)
+    if key not in _sdk_clients:
+        _sdk_clients[key] = factory()
+    return cast(C, _sdk_clients[key])
+
+
+async def close_sdk_clients() -> None:
+    """Close the pooled SDK clients and empty the registry"""
+    clients = list(_sdk_clients.values())
+    _sdk_clients.clear()
+    for client in clients:
+        if hasattr(client, "close"):
+            closing = client.close()
+        elif hasattr(client, "__aexit__"):
+            closing = client.__aexit__(None, None, None)
+        else:
+            continue
+        if inspect.isawaitable(closing):
+            await closing
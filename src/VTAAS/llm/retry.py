@@ -0,0 +1,310 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logging import Logger
+import os
+import random
+import time
+from typing import TypeVar
+
+from VTAAS.llm.accounting import current_call, recording_call
+from VTAAS.llm.images import EncodedImage
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.scheduler import Priority, llm_scheduler
+
+R = TypeVar("R")
+
+PARSE_ERRORS = (ValueError, SyntaxError)
+"""What parsing a LLM answer raises: pydantic, json and ast errors"""
+
+
+def backoff_delay(attempt: int, base: float = 10.0, cap: float = 60.0) -> float:
+    """
+    Exponential backoff with jitter for the given (1-based) attempt.
+    Half of the delay is fixed, the other half is random so that concurrent
+    callers hitting the same quota do not retry in lockstep.
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def sleep_backoff(attempt: int, base: float = 10.0, cap: float = 60.0) -> float:
+    """Wait (without blocking the event loop) before retrying. Returns the delay."""
+    delay = backoff_delay(attempt, base, cap)
+    await asyncio.sleep(delay)
+    return delay
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How a LLM request is retried. Transport failures (network, 429, 5xx) and
+    parse failures (the answer does not fit the schema) have separate budgets:
+    a rate limited request must not use up the tries of a malformed answer.
+    """
+
+    transport_tries: int = 4
+    parse_tries: int = 3
+    backoff_base: float = 2.0
+    backoff_cap: float = 60.0
+    max_retry_after: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """Defaults, overridden by VTAAS_LLM_TRANSPORT_TRIES and VTAAS_LLM_PARSE_TRIES"""
+        default = cls()
+        return cls(
+            transport_tries=int(
+                os.getenv("VTAAS_LLM_TRANSPORT_TRIES", default.transport_tries)
+            ),
+            parse_tries=int(os.getenv("VTAAS_LLM_PARSE_TRIES", default.parse_tries)),
+        )
+
+
+class TokenBucket:
+    """
+    Requests-per-minute limiter. A None rate only honours the pauses, which
+    every holder of the bucket observes: when the provider answers 429, all
+    the concurrent test cases back off together instead of piling up.
+    """
+
+    def __init__(self, requests_per_minute: float | None = None):
+        self.rate: float | None = (
+            requests_per_minute / 60 if requests_per_minute else None
+        )
+        self.capacity: float = max(1.0, self.rate or 1.0)
+        self._tokens: float = self.capacity
+        self._updated: float = time.monotonic()
+        self._paused_until: float = 0.0
+
+    async def acquire(self) -> float:
+        """Wait for a request slot. Returns the time spent waiting."""
+        start = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self.rate is None:
+                return now - start
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return now - start
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, delay: float) -> None:
+        """Hold every request back for delay seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+
+_buckets: dict[tuple[LLMProvider, str], TokenBucket] = {}
+
+
+def rate_limiter(provider: LLMProvider, model: str) -> TokenBucket:
+    """
+    Process-wide bucket for a (provider, model) pair, limited to
+    VTAAS_RPM_<PROVIDER> requests per minute (unset: no limit)
+    """
+    key = (provider, model)
+    if key not in _buckets:
+        rpm = os.getenv(f"VTAAS_RPM_{provider.name}")
+        _buckets[key] = TokenBucket(float(rpm) if rpm else None)
+    return _buckets[key]
+
+
+def drop_rate_limiters() -> None:
+    """The next rate_limiter() calls read their limits again"""
+    _buckets.clear()
+
+
+def error_status(error: BaseException) -> int | None:
+    """HTTP status of a SDK error, whichever SDK raised it"""
+    for attribute in ("status_code", "code", "status"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def retry_after(error: BaseException) -> float | None:
+    """Delay (in seconds) requested by the provider in the error response"""
+    response = getattr(error, "response", None) or getattr(error, "raw_response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds is not None:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class NotRetryableError(Exception):
+    """A failure that sending the request again would not fix (or make worse)"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Network errors, timeouts, 408, 409, 429 and 5xx are worth another try"""
+    if isinstance(error, NotRetryableError):
+        return False
+    status = error_status(error)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+
+@dataclass
+class Attempt:
+    """Where a request stands, for senders that adapt their next try"""
+
+    number: int = 1
+    transport_failures: int = 0
+    parse_failures: int = 0
+    last_parse_error: Exception | None = None
+
+
+def error_suffix(error: Exception) -> str:
+    """Appended to the last user message when its answer could not be parsed"""
+    return (
+        "\nNote that your last answer could not be parsed by pydantic:"
+        f"\n{str(error)}\nPlease ensure you respect the provided response schema. "
+        "In case of a failed status, make sure to explicitely mention the finish command."
+    )
+
+
+class RequestExecutor:
+    """
+    Sends a LLM request and parses its answer, shared by every provider client.
+    Each try first waits for an in-flight slot of the provider (in priority
+    order), then for a token of the (provider, model) bucket. Transport
+    failures are retried after the Retry-After the provider asked for, or an
+    exponential jittered backoff; 429s pause the whole bucket. Answers that
+    cannot be parsed are requested again, with their own budget.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        model: str,
+        logger: Logger,
+        policy: RetryPolicy | None = None,
+        worker: str = "main",
+    ):
+        self.provider: LLMProvider = provider
+        self.model: str = model
+        self.logger: Logger = logger
+        self.worker: str = worker
+        self.policy: RetryPolicy = policy or RetryPolicy.from_env()
+        self.limiter: TokenBucket = rate_limiter(provider, model)
+
+    async def run(
+        self,
+        label: str,
+        send: Callable[[Attempt], Awaitable[str]],
+        parse: Callable[[str], R],
+        priority: Priority = Priority.PLAN,
+        images: Sequence[EncodedImage] = (),
+    ) -> R:
+        """
+        send returns the raw answer, parse turns it into the response. Parse
+        errors raised by send (SDKs validating structured outputs) count as
+        parse failures. Each try is scheduled with the given priority.
+        The request is recorded with the images it uploads.
+        """
+        attempt = Attempt()
+        start = time.monotonic()
+        with recording_call(
+            self.provider.value, self.model, label, self.worker, images
+        ) as record:
+            try:
+                return await self._run(label, send, parse, priority, attempt)
+            except BaseException:
+                record.failed = True
+                raise
+            finally:
+                record.latency = time.monotonic() - start
+                record.retries = attempt.number - 1
+
+    async def _run(
+        self,
+        label: str,
+        send: Callable[[Attempt], Awaitable[str]],
+        parse: Callable[[str], R],
+        priority: Priority,
+        attempt: Attempt,
+    ) -> R:
+        while True:
+            raw: str | None = None
+            try:
+                raw = await self._send(label, send, attempt, priority)
+                return parse(raw)
+            except PARSE_ERRORS as e:
+                if raw is not None:
+                    self.logger.info(f"Raw response:\n{raw}")
+                attempt.parse_failures += 1
+                attempt.last_parse_error = e
+                self.logger.error(
+                    f"Error #{attempt.parse_failures} in {label} parsing: {str(e)}"
+                )
+                if attempt.parse_failures >= self.policy.parse_tries:
+                    raise
+            except Exception as e:
+                attempt.transport_failures += 1
+                self.logger.error(
+                    f"Error #{attempt.transport_failures} in {label} call: {str(e)}"
+                )
+                if (
+                    attempt.transport_failures >= self.policy.transport_tries
+                    or not is_retryable(e)
+                ):
+                    raise
+                await self._back_off(attempt, e)
+            attempt.number += 1
+
+    async def _send(
+        self,
+        label: str,
+        send: Callable[[Attempt], Awaitable[str]],
+        attempt: Attempt,
+        priority: Priority,
+    ) -> str:
+        async with llm_scheduler().slot(self.provider, priority) as queued:
+            waited = queued + await self.limiter.acquire()
+            record = current_call()
+            if record is not None:
+                record.waited += waited
+            if waited > 1:
+                self.logger.debug(f"Waited {waited:.1f}s for a {label} request slot")
+            return await send(attempt)
+
+    async def _back_off(self, attempt: Attempt, error: Exception) -> None:
+        delay = retry_after(error)
+        if delay is None:
+            delay = backoff_delay(
+                attempt.transport_failures,
+                self.policy.backoff_base,
+                self.policy.backoff_cap,
+            )
+        delay = min(delay, self.policy.max_retry_after)
+        self.logger.info(f"Retrying in {delay:.1f}s")
+        if error_status(error) == 429:
+            self.limiter.pause(delay)
+        else:
+            await asyncio.sleep(delay)
@@ -0,0 +1,221 @@
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from enum import Enum
+import os
+from typing import TypeVar, final, override
+
+from pydantic import BaseModel
+
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.retry import PARSE_ERRORS
+from VTAAS.schemas.llm import (
+    FinishCommand,
+    LLMActResponse,
+    LLMAssertResponse,
+    LLMDataExtractionResponse,
+    LLMTestStepFollowUpResponse,
+    LLMTestStepPlanResponse,
+    LLMTestStepRecoverResponse,
+    Message,
+)
+from VTAAS.schemas.verdict import Status
+
+R = TypeVar("R", bound=BaseModel)
+
+METHODS = (
+    "plan_step",
+    "followup_step",
+    "recover_step",
+    "act",
+    "assert_",
+    "step_postprocess",
+)
+
+WORKER_METHODS: dict[str, tuple[str, ...]] = {
+    "orchestrator": ("plan_step", "followup_step", "recover_step", "step_postprocess"),
+    "actor": ("act",),
+    "assertor": ("assert_",),
+}
+"""The calls each kind of worker makes, other clients may make any"""
+
+
+class ModelTier(str, Enum):
+    SMALL = "small"
+    LARGE = "large"
+
+
+SMALL_MODELS: dict[LLMProvider, str] = {
+    LLMProvider.OPENAI: "gpt-4o-mini-2024-07-18",
+    LLMProvider.ANTHROPIC: "claude-3-5-haiku-latest",
+    LLMProvider.GOOGLE: "gemini-2.0-flash",
+    LLMProvider.MISTRAL: "pixtral-12b-latest",
+    LLMProvider.OPENROUTER: "meta-llama/llama-3.2-11b-vision-instruct",
+}
+
+ECONOMY_ROUTES = "step_postprocess=small,act=small"
+"""Data extraction and actor rounds on the small model, escalated if need be"""
+
+
+def small_model(provider: LLMProvider) -> str:
+    """VTAAS_SMALL_MODEL_<PROVIDER>, else the provider's default small model"""
+    return os.getenv(f"VTAAS_SMALL_MODEL_{provider.name}") or SMALL_MODELS[provider]
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    """
+    Which model tier serves each call. Routes are keyed by method
+    (act, step_postprocess...), by worker kind (orchestrator, actor,
+    assertor) or by both (actor.act); the most specific route wins and
+    unrouted calls go to the large model.
+    """
+
+    routes: dict[str, ModelTier] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, spec: str) -> "RoutingPolicy":
+        """
+        Comma separated key=tier pairs, e.g. "step_postprocess=small,actor=large",
+        or "economy" for ECONOMY_ROUTES
+        """
+        if spec.strip().lower() == "economy":
+            spec = ECONOMY_ROUTES
+        routes: dict[str, ModelTier] = {}
+        for route in spec.split(","):
+            if not route.strip():
+                continue
+            key, _, tier = route.partition("=")
+            routes[key.strip()] = ModelTier(tier.strip().lower())
+        return cls(routes)
+
+    @classmethod
+    def from_env(cls) -> "RoutingPolicy":
+        """VTAAS_MODEL_ROUTES (unset: every call goes to the large model)"""
+        return cls.parse(os.getenv("VTAAS_MODEL_ROUTES", ""))
+
+    def tier(self, worker: str, method: str) -> ModelTier:
+        kind = worker.split("-")[0]
+        for key in (f"{kind}.{method}", method, kind):
+            if key in self.routes:
+                return self.routes[key]
+        return ModelTier.LARGE
+
+    def small_methods(self, worker: str) -> set[str]:
+        """The calls of this worker that go to the small model"""
+        methods = WORKER_METHODS.get(worker.split("-")[0], METHODS)
+        return {
+            method for method in methods if self.tier(worker, method) == ModelTier.SMALL
+        }
+
+
+def act_is_unsure(response: LLMActResponse) -> bool:
+    """The small model gives up on the query"""
+    command = response.command
+    return isinstance(command, FinishCommand) and command.status != Status.PASS
+
+
+def assert_is_unsure(response: LLMAssertResponse) -> bool:
+    """Failed assertions fail the test case: the large model confirms them"""
+    return response.verdict.status != Status.PASS
+
+
+@final
+class RoutingLLMClient(LLMClient):
+    """
+    Sends the calls routed to the small tier to the small model. They are
+    escalated to the large model when the small model's answer cannot be
+    parsed (once its own tries are exhausted) or when it is unsure of itself.
+    Act calls are not streamed.
+    """
+
+    def __init__(self, small: LLMClient, large: LLMClient, small_methods: set[str]):
+        self.small: LLMClient = small
+        self.large: LLMClient = large
+        self.small_methods: set[str] = small_methods
+        self.model: str = large.model
+        self.logger = large.logger
+        self.escalations: int = 0
+
+    async def _routed(
+        self,
+        method: str,
+        small: Callable[[], Awaitable[R]],
+        large: Callable[[], Awaitable[R]],
+        unsure: Callable[[R], bool] | None = None,
+    ) -> R:
+        if method not in self.small_methods:
+            return await large()
+        try:
+            response = await small()
+        except PARSE_ERRORS as e:
+            reason = f"its answer could not be parsed: {str(e)}"
+        else:
+            if unsure is None or not unsure(response):
+                return response
+            reason = "it is unsure of its answer"
+        self.escalations += 1
+        self.logger.info(
+            f"Escalating {method} from {self.small.model} to {self.large.model}: {reason}"
+        )
+        return await large()
+
+    @override
+    async def plan_step(self, conversation: list[Message]) -> LLMTestStepPlanResponse:
+        return await self._routed(
+            "plan_step",
+            lambda: self.small.plan_step(conversation),
+            lambda: self.large.plan_step(conversation),
+        )
+
+    @override
+    async def followup_step(
+        self, conversation: list[Message]
+    ) -> LLMTestStepFollowUpResponse:
+        return await self._routed(
+            "followup_step",
+            lambda: self.small.followup_step(conversation),
+            lambda: self.large.followup_step(conversation),
+        )
+
+    @override
+    async def recover_step(
+        self, conversation: list[Message]
+    ) -> LLMTestStepRecoverResponse:
+        return await self._routed(
+            "recover_step",
+            lambda: self.small.recover_step(conversation),
+            lambda: self.large.recover_step(conversation),
+        )
+
+    @override
+    async def act(self, conversation: list[Message]) -> LLMActResponse:
+        return await self._routed(
+            "act",
+            lambda: self.small.act(conversation),
+            lambda: self.large.act(conversation),
+            act_is_unsure,
+        )
+
+    @override
+    async def assert_(self, conversation: list[Message]) -> LLMAssertResponse:
+        return await self._routed(
+            "assert_",
+            lambda: self.small.assert_(conversation),
+            lambda: self.large.assert_(conversation),
+            assert_is_unsure,
+        )
+
+    @override
+    async def step_postprocess(
+        self, system: str, user: str, screenshots: list[bytes]
+    ) -> LLMDataExtractionResponse:
+        return await self._routed(
+            "step_postprocess",
+            lambda: self.small.step_postprocess(system, user, screenshots),
+            lambda: self.large.step_postprocess(system, user, screenshots),
+        )
+
+    @override
+    def close(self):
+        self.small.close()
+        self.large.close()
@@ -0,0 +1,184 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+import heapq
+import itertools
+import os
+import time
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.schemas.llm import (
+    LLMActResponse,
+    LLMAssertResponse,
+    LLMDataExtractionResponse,
+)
+
+
+class Priority(IntEnum):
+    """Lower goes first: calls closer to a verdict are served before new work"""
+
+    VERDICT = 0
+    """assertions and data extraction"""
+    FINISH = 1
+    """actor rounds checking whether the query is complete"""
+    ACT = 2
+    PLAN = 3
+
+
+_priority: ContextVar[Priority | None] = ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def prioritized(priority: Priority) -> Iterator[None]:
+    """LLM requests sent within this block are scheduled with this priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def request_priority(response_format: type) -> Priority:
+    """Priority of a request: the one set by prioritized(), else its kind's"""
+    priority = _priority.get()
+    if priority is not None:
+        return priority
+    if response_format in (LLMAssertResponse, LLMDataExtractionResponse):
+        return Priority.VERDICT
+    if response_format is LLMActResponse:
+        return Priority.ACT
+    return Priority.PLAN
+
+
+@dataclass
+class WaitStats:
+    """Time spent by requests waiting for an in-flight slot"""
+
+    waits: list[float] = field(default_factory=list)
+    max_samples: int = 10000
+
+    def add(self, wait: float) -> None:
+        self.waits.append(wait)
+        if len(self.waits) > self.max_samples:
+            del self.waits[: len(self.waits) - self.max_samples]
+
+    def summary(self) -> dict[str, float]:
+        if not self.waits:
+            return {"count": 0}
+        waits = sorted(self.waits)
+        return {
+            "count": len(waits),
+            "mean": sum(waits) / len(waits),
+            "p50": waits[len(waits) // 2],
+            "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+            "max": waits[-1],
+        }
+
+
+class ProviderQueue:
+    """
+    At most max_in_flight requests to a provider at once. The others wait in
+    priority order, first come first served within a priority.
+    """
+
+    def __init__(self, max_in_flight: int):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight: int = max_in_flight
+        self.in_flight: int = 0
+        self._waiters: list[tuple[Priority, int, asyncio.Future[None]]] = []
+        self._order: Iterator[int] = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: Priority) -> None:
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just before the cancellation
+                self.release()
+            else:
+                _ = future.cancel()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.max_in_flight:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+
+DEFAULT_MAX_IN_FLIGHT = 16
+
+
+class LLMScheduler:
+    """
+    Process-wide gate of the LLM requests of every test case. Each provider
+    gets a bounded number of requests in flight (VTAAS_MAX_IN_FLIGHT_<PROVIDER>,
+    default 16); under load, the requests that bring a verdict closer go first.
+    """
+
+    def __init__(self, default_max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.default_max_in_flight: int = default_max_in_flight
+        self._queues: dict[LLMProvider, ProviderQueue] = {}
+        self._stats: dict[tuple[LLMProvider, Priority], WaitStats] = {}
+
+    def queue(self, provider: LLMProvider) -> ProviderQueue:
+        if provider not in self._queues:
+            limit = os.getenv(f"VTAAS_MAX_IN_FLIGHT_{provider.name}")
+            self._queues[provider] = ProviderQueue(
+                int(limit) if limit else self.default_max_in_flight
+            )
+        return self._queues[provider]
+
+    @asynccontextmanager
+    async def slot(
+        self, provider: LLMProvider, priority: Priority
+    ) -> AsyncIterator[float]:
+        """Hold an in-flight slot for the block. Yields the time spent waiting."""
+        queue = self.queue(provider)
+        start = time.monotonic()
+        await queue.acquire(priority)
+        wait = time.monotonic() - start
+        self._stats.setdefault((provider, priority), WaitStats()).add(wait)
+        try:
+            yield wait
+        finally:
+            queue.release()
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        """Queue wait summaries, by provider and priority"""
+        return {
+            f"{provider.value}.{priority.name.lower()}": stats.summary()
+            for (provider, priority), stats in sorted(self._stats.items())
+        }
+
+
+_scheduler: LLMScheduler | None = None
+
+
+def llm_scheduler() -> LLMScheduler:
+    """Process-wide scheduler, shared by every LLM client"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
+
+
+def drop_llm_scheduler() -> None:
+    """The next llm_scheduler() reads its limits again"""
+    global _scheduler
+    _scheduler = None
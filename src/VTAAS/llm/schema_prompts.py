@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+from enum import Enum
+from functools import cache
+import json
+import os
+from typing import Any
+
+from pydantic import BaseModel
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.usage import estimate_text_tokens
+
+SCHEMA_PROMPT = (
+    "\nYour response must be a json.loads parsable JSON object, following this Pydantic JSON schema:\n"
+    "{schema}"
+    "\n please omit properties that have a default null if you don't plan on valuing them"
+)
+EXAMPLE_PROMPT = (
+    "\nYour response must be a json.loads parsable JSON object, similar to this:\n"
+    "{schema}"
+)
+
+
+class SchemaStyle(str, Enum):
+    INDENTED = "indented"
+    COMPACT = "compact"
+
+
+@dataclass(frozen=True)
+class SchemaPrompt:
+    """Response format instructions for a response model, ready to be sent"""
+
+    response_model: type[BaseModel]
+    style: SchemaStyle
+    text: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_text_tokens(self.text)
+
+
+def schema_style() -> SchemaStyle:
+    """VTAAS_SCHEMA_PROMPT: compact (default) or indented JSON schemas"""
+    return SchemaStyle(os.getenv("VTAAS_SCHEMA_PROMPT", "compact").lower())
+
+
+@cache
+def json_schema(response_model: type[BaseModel]) -> dict[str, Any]:
+    """The JSON schema of a response model, generated once per process"""
+    return response_model.model_json_schema()
+
+
+def dump_schema(schema: object, style: SchemaStyle) -> str:
+    if style == SchemaStyle.COMPACT:
+        return json.dumps(schema, separators=(",", ":"))
+    return json.dumps(schema, indent=2)
+
+
+@cache
+def _schema_prompt(
+    provider: LLMProvider, response_model: type[BaseModel], style: SchemaStyle
+) -> SchemaPrompt:
+    template = EXAMPLE_PROMPT if provider == LLMProvider.MISTRAL else SCHEMA_PROMPT
+    text = template.format(schema=dump_schema(json_schema(response_model), style))
+    return SchemaPrompt(response_model, style, text)
+
+
+def schema_prompt(
+    provider: LLMProvider,
+    response_model: type[BaseModel],
+    style: SchemaStyle | None = None,
+) -> SchemaPrompt:
+    """
+    Instructions describing the response model, for the providers that get
+    the schema in the prompt. Computed once per (provider, model, style).
+    """
+    return _schema_prompt(provider, response_model, style or schema_style())
+
+
+def example_prompt(example: BaseModel, style: SchemaStyle | None = None) -> str:
+    """Instructions showing an example answer rather than the schema"""
+    dumped = example.model_dump_json(
+        indent=2 if (style or schema_style()) == SchemaStyle.INDENTED else None
+    )
+    # the example is sent as a JSON string, as it always was
+    return EXAMPLE_PROMPT.format(schema=json.dumps(dumped))
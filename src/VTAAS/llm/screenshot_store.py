@@ -0,0 +1,93 @@
+import base64
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+
+from VTAAS.llm.images import EncodedImage, ImageConfig, image_config, prepare_image
+
+
+@dataclass
+class StoredScreenshot:
+    """A screenshot prepared and base64 encoded once, addressed by its digest"""
+
+    digest: str
+    image: EncodedImage
+    base64: str
+    # screenshot objects known to have this content, for the identity fast path
+    sources: list[bytes] = field(default_factory=list)
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.image.mime_type};base64,{self.base64}"
+
+
+class ScreenshotStore:
+    """
+    Content-addressed LRU cache of the screenshots sent to LLMs.
+    Conversations resend the same screenshots on every turn and every retry:
+    each one is hashed, downscaled and base64 encoded the first time only.
+    The very same bytes object is found again without even being hashed.
+    """
+
+    def __init__(self, max_entries: int = 256, config: ImageConfig | None = None):
+        self.max_entries: int = max_entries
+        self.max_sources: int = 8
+        self.config: ImageConfig = config or image_config()
+        self._entries: OrderedDict[str, StoredScreenshot] = OrderedDict()
+        self._by_id: dict[int, StoredScreenshot] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, screenshot: bytes) -> StoredScreenshot:
+        stored = self._by_id.get(id(screenshot))
+        if stored is not None and any(s is screenshot for s in stored.sources):
+            self.hits += 1
+            self._entries.move_to_end(stored.digest)
+            return stored
+
+        digest = hashlib.sha256(screenshot).hexdigest()
+        stored = self._entries.get(digest)
+        if stored is None:
+            self.misses += 1
+            image = prepare_image(screenshot, self.config)
+            stored = StoredScreenshot(
+                digest=digest,
+                image=image,
+                base64=base64.b64encode(image.data).decode("ascii"),
+            )
+            self._entries[digest] = stored
+            self._evict()
+        else:
+            self.hits += 1
+            self._entries.move_to_end(digest)
+        if len(stored.sources) >= self.max_sources:
+            forgotten = stored.sources.pop(0)
+            if self._by_id.get(id(forgotten)) is stored:
+                del self._by_id[id(forgotten)]
+        stored.sources.append(screenshot)
+        self._by_id[id(screenshot)] = stored
+        return stored
+
+    def digest(self, screenshot: bytes) -> str:
+        return self.get(screenshot).digest
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            for source in evicted.sources:
+                if self._by_id.get(id(source)) is evicted:
+                    del self._by_id[id(source)]
+
+
+_store: ScreenshotStore | None = None
+
+
+def screenshot_store() -> ScreenshotStore:
+    """Process-wide store, shared by every LLM client"""
+    global _store
+    if _store is None:
+        _store = ScreenshotStore()
+    return _store
@@ -0,0 +1,183 @@
+from collections.abc import AsyncIterator, Callable, Sequence
+from dataclasses import dataclass
+import json
+
+from pydantic import TypeAdapter
+
+from VTAAS.llm.decoding import decode_response
+from VTAAS.llm.images import EncodedImage
+from VTAAS.llm.retry import (
+    PARSE_ERRORS,
+    Attempt,
+    NotRetryableError,
+    RequestExecutor,
+)
+from VTAAS.llm.scheduler import request_priority
+from VTAAS.schemas.llm import Command, LLMActResponse
+
+_COMMAND: TypeAdapter[Command] = TypeAdapter(Command)
+
+
+class IncrementalObjectParser:
+    """
+    Parses a JSON object as it is streamed, and returns each of its top-level
+    fields as soon as its value is complete. Text before the opening brace
+    (or after the closing one) is ignored.
+    """
+
+    def __init__(self):
+        self.text: str = ""
+        self.fields: dict[str, object] = {}
+        self.complete: bool = False
+        self._position: int = 0
+        self._depth: int = 0
+        self._in_string: bool = False
+        self._escaped: bool = False
+        self._expecting_key: bool = False
+        self._key_start: int | None = None
+        self._key: str | None = None
+        self._value_start: int | None = None
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        """Add the next chunk, returns the fields it completed"""
+        self.text += chunk
+        completed: list[tuple[str, object]] = []
+        text = self.text
+        while self._position < len(text) and not self.complete:
+            i = self._position
+            char = text[i]
+            self._position += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start : i + 1])
+                        self._key_start = None
+                    elif self._depth == 1:
+                        completed.extend(self._end_value(i + 1))
+                continue
+            match char:
+                case '"':
+                    self._in_string = True
+                    if self._depth == 1 and self._expecting_key:
+                        self._key_start = i
+                        self._expecting_key = False
+                case "{" | "[":
+                    self._depth += 1
+                    if self._depth == 1:
+                        self._expecting_key = True
+                case "}" | "]":
+                    if self._depth == 0:
+                        continue
+                    if self._depth == 1:
+                        completed.extend(self._end_value(i))
+                        self.complete = True
+                    elif self._depth == 2:
+                        # strings, objects and arrays are complete once closed,
+                        # numbers and literals at the next delimiter
+                        completed.extend(self._end_value(i + 1))
+                    self._depth -= 1
+                case ":" if self._depth == 1:
+                    self._value_start = i + 1
+                case "," if self._depth == 1:
+                    completed.extend(self._end_value(i))
+                    self._expecting_key = True
+                case _:
+                    pass
+        return completed
+
+    def _end_value(self, end: int) -> list[tuple[str, object]]:
+        if self._key is None or self._value_start is None:
+            return []
+        key = self._key
+        value = json.loads(self.text[self._value_start : end])
+        self.fields[key] = value
+        self._key = None
+        self._value_start = None
+        return [(key, value)]
+
+
+def parse_act_response(text: str, truncated: bool = False) -> LLMActResponse:
+    """truncated: the answer hit the token limit (see decode_response)"""
+    parser = IncrementalObjectParser()
+    _ = parser.feed(text)
+    if not parser.complete:
+        return decode_response(text, LLMActResponse, truncated)
+    return LLMActResponse.model_validate(parser.fields)
+
+
+def _partial_act_response(
+    command: Command, fields: dict[str, object]
+) -> LLMActResponse:
+    """The response of a command already running, the missing analyses empty"""
+    analyses = {
+        name: value if isinstance(value := fields.get(name), str) else ""
+        for name in LLMActResponse.model_fields
+        if name != "command"
+    }
+    return LLMActResponse(command=command, **analyses)
+
+
+@dataclass
+class StreamEnd:
+    """How a streamed answer ended, as reported by the provider"""
+
+    truncated: bool = False
+    """the answer hit the token limit"""
+
+
+class CommandStartedError(NotRetryableError):
+    """The stream broke after its command was handed over: it cannot be retried"""
+
+
+async def stream_act(
+    executor: RequestExecutor,
+    chunks: Callable[[StreamEnd], AsyncIterator[str]],
+    on_command: Callable[[Command], None],
+    images: Sequence[EncodedImage] = (),
+) -> LLMActResponse:
+    """
+    Streamed act request, asked for as a LLMStreamedActResponse. on_command
+    gets the command as soon as it is complete and valid, while the analyses
+    are still arriving; chunks reports how the answer ended. Once the command
+    is handed over, the request is not sent again: a broken connection fails
+    it, while an answer whose end cannot be decoded (cut off at the token
+    limit, malformed) is kept with the fields already parsed.
+    """
+    command: Command | None = None
+    parser = IncrementalObjectParser()
+    end = StreamEnd()
+
+    async def send(_: Attempt) -> str:
+        nonlocal command, parser, end
+        parser, end = IncrementalObjectParser(), StreamEnd()
+        try:
+            async for chunk in chunks(end):
+                for key, value in parser.feed(chunk):
+                    if key == "command" and command is None:
+                        command = _COMMAND.validate_python(value)
+                        on_command(command)
+        except Exception as e:
+            if command is not None:
+                raise CommandStartedError(f"act stream failed: {str(e)}") from e
+            raise
+        return parser.text
+
+    def parse(text: str) -> LLMActResponse:
+        try:
+            return parse_act_response(text, end.truncated)
+        except PARSE_ERRORS as e:
+            if command is None:
+                raise
+            executor.logger.warning(
+                f"End of the act response ignored, its command already runs: {str(e)}"
+            )
+            return _partial_act_response(command, parser.fields)
+
+    return await executor.run(
+        "act", send, parse, request_priority(LLMActResponse), images
+    )
@@ -0,0 +1,33 @@
+import math
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class TokenUsage:
+    """Tokens billed for one LLM call, whatever the provider's naming"""
+
+    input_tokens: int = 0
+    """all the prompt tokens, cached or not"""
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    """prompt tokens read from the provider's prompt cache"""
+    cache_write_tokens: int = 0
+    """prompt tokens written to the provider's prompt cache"""
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+    def describe(self) -> str:
+        description = (
+            f"{self.input_tokens} input tokens ({self.cached_tokens} cached, "
+            + f"{self.cache_hit_ratio:.0%}), {self.output_tokens} output tokens"
+        )
+        if self.cache_write_tokens:
+            description += f", {self.cache_write_tokens} written to cache"
+        return description
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Rough token count of a text: about 4 characters per token"""
+    return math.ceil(len(text) / 4)
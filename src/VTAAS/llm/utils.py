@@ -1,23 +1,84 @@
 from VTAAS.llm.anthropic_client import AnthropicLLMClient
+from VTAAS.llm.batch import (
+    BatchableLLMClient,
+    BatchConfig,
+    BatchingLLMClient,
+    batch_collector,
+)
+from VTAAS.llm.cache import CachingLLMClient, cache_mode, response_store
 from VTAAS.llm.google_client import GoogleLLMClient
 from VTAAS.llm.llm_client import LLMClient, LLMProvider
 from VTAAS.llm.mistral_client import MistralLLMClient
 from VTAAS.llm.openai_client import OpenAILLMClient
 from VTAAS.llm.openrouter_client import OpenRouterLLMClient
+from VTAAS.llm.routing import RoutingLLMClient, RoutingPolicy, small_model
 
 
 def create_llm_client(
-    name: str, provider: LLMProvider, start_time: float, output_folder: str
+    name: str,
+    provider: LLMProvider,
+    start_time: float,
+    output_folder: str,
+    worker: str = "main",
+    routing: RoutingPolicy | None = None,
 ) -> LLMClient:
-    """Instantiates the correct LLM client based on the provider."""
+    """
+    Instantiates the correct LLM client based on the provider.
+    Clients are cheap: they reuse the provider's pooled SDK client
+    and log through a child of a shared logger tagged with the worker.
+    With VTAAS_LLM_CACHE set, responses are recorded and/or replayed.
+    With VTAAS_LLM_BATCH set, the calls it lists go through the provider's
+    batch endpoint (OpenAI and Anthropic).
+    Calls routed to the small model tier (VTAAS_MODEL_ROUTES) go to the
+    provider's small model, and are escalated to the large one if need be.
+    """
+    large = _create_client(name, provider, start_time, output_folder, worker)
+    small_methods = (routing or RoutingPolicy.from_env()).small_methods(worker)
+    if not small_methods:
+        return large
+    small = _create_client(
+        name, provider, start_time, output_folder, worker, small_model(provider)
+    )
+    return RoutingLLMClient(small, large, small_methods)
+
+
+def _create_client(
+    name: str,
+    provider: LLMProvider,
+    start_time: float,
+    output_folder: str,
+    worker: str,
+    model: str | None = None,
+) -> LLMClient:
+    client: LLMClient
+    # the clients' default model, unless another one is asked for
+    options = {"model": model} if model else {}
     match provider:
         case LLMProvider.GOOGLE:
-            return GoogleLLMClient(name, start_time, output_folder)
+            client = GoogleLLMClient(
+                name, start_time, output_folder, worker=worker, **options
+            )
         case LLMProvider.OPENAI:
-            return OpenAILLMClient(name, start_time, output_folder)
+            client = OpenAILLMClient(
+                name, start_time, output_folder, worker=worker, **options
+            )
         case LLMProvider.ANTHROPIC:
-            return AnthropicLLMClient(name, start_time, output_folder)
+            client = AnthropicLLMClient(
+                name, start_time, output_folder, worker=worker, **options
+            )
         case LLMProvider.OPENROUTER:
-            return OpenRouterLLMClient(name, start_time, output_folder)
+            client = OpenRouterLLMClient(
+                name, start_time, output_folder, worker=worker, **options
+            )
         case LLMProvider.MISTRAL:
-            return MistralLLMClient(name, start_time, output_folder)
+            client = MistralLLMClient(
+                name, start_time, output_folder, worker=worker, **options
+            )
+    batching = BatchConfig.from_env()
+    if batching.methods and isinstance(client, BatchableLLMClient):
+        collector = batch_collector(client, batching)
+        client = BatchingLLMClient(client, collector, batching.methods)
+    mode = cache_mode()
+    if mode is None:
+        return client
+    return CachingLLMClient(client, provider, response_store(), mode)
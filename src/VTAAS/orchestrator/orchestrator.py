@@ -3,7 +3,9 @@ import time
 from dataclasses import dataclass, field
 from typing import TypedDict, Unpack
 from uuid import uuid4
+from VTAAS.llm.accounting import call_tags
 from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.memory import ORCHESTRATOR_MEMORY, MemoryPolicy, memory_policy
 from VTAAS.llm.utils import create_llm_client
 from VTAAS.schemas.llm import (
     DataExtractionEntry,
@@ -24,6 +26,7 @@ from ..schemas.verdict import (
 )
 from ..workers.browser import Browser
 from ..utils.logger import get_logger
+from ..utils.prompts import render_prompt
 from ..workers.actor import Actor
 from ..workers.assertor import Assertor
 from ..schemas.worker import (
@@ -88,14 +91,17 @@ class Orchestrator:
             self.logger.warning("This orchestrator should have a proper name!")
         self.logger.info(f"Orchestrator output folder: {self.output_folder}")
         self.llm_client: LLMClient = create_llm_client(
-            self.name, self.llm_provider, self.start_time, self.output_folder
+            self.name,
+            self.llm_provider,
+            self.start_time,
+            self.output_folder,
+            worker="orchestrator",
         )
         self._exec_context: TestExecutionContext | None = None
-        self._followup_prompt: str | None = None
-        self._recover_prompt: str | None = None
         self.worker_reports: dict[str, list[str]] = {}
         self.worker_counter: dict[str, int] = {"actor": 0, "assertor": 0}
         self.conversation: list[Message] = []
+        self.memory: MemoryPolicy = memory_policy(ORCHESTRATOR_MEMORY)
 
     async def process_testcase(self, test_case: TestCase) -> TestCaseVerdict:
         """Manages the main execution loop for the given Test Case."""
@@ -115,13 +121,15 @@ class Orchestrator:
                 tracer=self.tracer,
                 trace_folder=self.output_folder,
             )
-        _ = await self.browser.goto(exec_context.test_case.url)
+        if self.browser.preloaded != exec_context.test_case.url:
+            _ = await self.browser.goto(exec_context.test_case.url)
         verdict = TestCaseVerdict(step_index=1, status=Status.UNK)
         try:
             for idx, test_step in enumerate(test_case):
                 exec_context.current_step = test_step
                 exec_context.step_index = idx + 1
-                verdict = await self.process_step(exec_context)
+                with call_tags(step=exec_context.step_index):
+                    verdict = await self.process_step(exec_context)
                 if verdict.status != Status.PASS:
                     self.logger.info(
                         (
@@ -137,9 +145,10 @@ class Orchestrator:
                 step_str = (
                     f"{exec_context.step_index}. {test_step[0]} -> {test_step[1]}"
                 )
-                step_synthesis = await self.step_postprocess(
-                    exec_context, verdict.history, exec_context.history
-                )
+                with call_tags(step=exec_context.step_index):
+                    step_synthesis = await self.step_postprocess(
+                        exec_context, verdict.history, exec_context.history
+                    )
                 exec_context.history.append(step_str)
                 if len(step_synthesis) > 0:
                     exec_context.history.append(
@@ -227,7 +236,7 @@ class Orchestrator:
     ) -> SequenceType:
         """Planning for the test step: spawn workers based on LLM call."""
         self._setup_conversation(exec_context, screenshot, page_info, viewport_info)
-        response = await self.llm_client.plan_step(self.conversation)
+        response = await self.llm_client.plan_step(self.memory.view(self.conversation))
         self.conversation.append(
             Message(
                 role=MessageRole.Assistant,
@@ -247,10 +256,7 @@ class Orchestrator:
     ) -> SequenceType:
         """Continuing planning for the test step: spawn workers based on LLM call."""
         results_str, screenshots = workers_result
-        with open(
-            "./src/VTAAS/orchestrator/followup_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            results_str += prompt_file.read()
+        results_str += self.followup_prompt
 
         results_str += f"\n{page_info}"
         results_str += f"\n{viewport_info}"
@@ -261,7 +267,9 @@ class Orchestrator:
             screenshot=screenshots,
         )
         self.conversation.append(user_msg)
-        response = await self.llm_client.followup_step(self.conversation)
+        response = await self.llm_client.followup_step(
+            self.memory.view(self.conversation)
+        )
         self.conversation.append(
             Message(
                 role=MessageRole.Assistant,
@@ -281,10 +289,7 @@ class Orchestrator:
     ) -> SequenceType | bool:
         """Recover planning of the test step: spawn workers based on LLM call."""
         results_str, screenshots = workers_result
-        with open(
-            "./src/VTAAS/orchestrator/recover_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            results_str += prompt_file.read()
+        results_str += self.recover_prompt
 
         results_str += f"\n{page_info}"
         results_str += f"\n{viewport_info}"
@@ -293,7 +298,9 @@ class Orchestrator:
             role=MessageRole.User, content=results_str, screenshot=screenshots
         )
         self.conversation.append(user_msg)
-        response = await self.llm_client.recover_step(self.conversation)
+        response = await self.llm_client.recover_step(
+            self.memory.view(self.conversation)
+        )
         self.conversation.append(
             Message(
                 role=MessageRole.Assistant,
@@ -454,19 +461,11 @@ class Orchestrator:
         self.logger.debug(f"User prompt:\n{self.conversation[1].content}")
 
     def _build_system_prompt(self) -> str:
-        with open(
-            "./src/VTAAS/orchestrator/system_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            prompt_template = prompt_file.read()
-        return prompt_template
+        return render_prompt("orchestrator.system")
 
     def _build_user_init_prompt(
         self, exec_context: TestExecutionContext, page_info: str, viewport_info: str
     ) -> str:
-        with open(
-            "./src/VTAAS/orchestrator/init_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            prompt_template = prompt_file.read()
         test_case = exec_context.test_case
         action, assertion = exec_context.current_step
         test_step = (
@@ -477,7 +476,8 @@ class Orchestrator:
             if len(exec_context.history) > 0
             else ""
         )
-        return prompt_template.format(
+        return render_prompt(
+            "orchestrator.init",
             test_case=test_case,
             current_step=test_step,
             history=history,
@@ -491,10 +491,6 @@ class Orchestrator:
         previous_synthesis: str,
         step_history: str,
     ) -> str:
-        with open(
-            "./src/VTAAS/orchestrator/synthesis_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            prompt_template = prompt_file.read()
         saved_data = (
             ""
             if not previous_synthesis
@@ -506,7 +502,8 @@ class Orchestrator:
             )
         )
         test_step = f"{exec_context.step_index}. {exec_context.current_step[0]} -> {exec_context.current_step[1]}"
-        return prompt_template.format(
+        return render_prompt(
+            "orchestrator.synthesis",
             test_case=exec_context.test_case,
             current_step=test_step,
             saved_data=saved_data,
@@ -534,22 +531,12 @@ class Orchestrator:
     @property
     def followup_prompt(self) -> str:
         """Get the followup prompt"""
-        if self._followup_prompt is None:
-            with open(
-                "./src/VTAAS/orchestrator/followup_prompt.txt", "r", encoding="utf-8"
-            ) as prompt_file:
-                self._followup_prompt = prompt_file.read()
-        return self._followup_prompt
+        return render_prompt("orchestrator.followup")
 
     @property
     def recover_prompt(self) -> str:
         """Get the recover prompt"""
-        if self._recover_prompt is None:
-            with open(
-                "./src/VTAAS/orchestrator/recover_prompt.txt", "r", encoding="utf-8"
-            ) as prompt_file:
-                self._recover_prompt = prompt_file.read()
-        return self._recover_prompt
+        return render_prompt("orchestrator.recover")
 
     async def close(self):
         self.logger.handlers.clear()
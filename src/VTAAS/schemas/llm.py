@@ -161,6 +161,21 @@ class LLMActResponse(BaseModel):
         return str(data)
 
 
+class LLMStreamedActResponse(BaseModel):
+    """
+    The fields of LLMActResponse in the order a streamed Actor answer asks
+    for: the command right after a short rationale, so that it is handed over
+    before the analyses arrive.
+    """
+
+    next_action: str
+    command: Command
+    current_webpage_identification: str
+    screenshot_analysis: str
+    query_progress: str
+    element_recognition: str
+
+
 class ClickGoogleCommand(BaseModel):
     name: str = "click"
     label: int
@@ -2,6 +2,7 @@ import logging
 import os
 import time
 from typing import final, override
+from uuid import uuid4
 
 
 @final
@@ -47,3 +48,41 @@ def get_logger(name: str, start_time: float, output_folder: str) -> logging.Logg
     logger.setLevel(logging.INFO)
 
     return logger
+
+
+_shared_loggers: dict[tuple[str, str], logging.Logger] = {}
+
+
+def get_worker_logger(
+    name: str, worker: str, start_time: float, output_folder: str
+) -> logging.Logger:
+    """
+    Lightweight per-worker logger: a child of a logger shared by every worker
+    logging under the same name in the same output folder. Only the shared
+    logger owns handlers, so spawning a worker does not open a new log file.
+    """
+    key = (name, output_folder)
+    if key not in _shared_loggers:
+        _shared_loggers[key] = get_logger(
+            name + " - " + uuid4().hex, start_time, output_folder
+        )
+    return _shared_loggers[key].getChild(worker)
+
+
+def release_worker_logger(logger: logging.Logger) -> None:
+    """
+    Forgets a worker logger once its worker is done: logging keeps every
+    named logger for the life of the process otherwise
+    """
+    if logger.handlers:
+        raise ValueError(f"{logger.name} is not a worker logger")
+    _ = logging.Logger.manager.loggerDict.pop(logger.name, None)
+
+
+def release_worker_loggers(output_folder: str) -> None:
+    """Closes the shared loggers of an output folder, once its workers are done"""
+    for key in [key for key in _shared_loggers if key[1] == output_folder]:
+        logger = _shared_loggers.pop(key)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
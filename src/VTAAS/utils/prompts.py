@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+from importlib.resources import files
+from importlib.resources.abc import Traversable
+import os
+from pathlib import Path
+import string
+
+
+@dataclass
+class PromptTemplate:
+    """A prompt file of the package, loaded in memory with its placeholders"""
+
+    package: str
+    filename: str
+    placeholders: frozenset[str]
+    text: str = ""
+    mtime: float | None = None
+
+    @property
+    def resource(self) -> Traversable:
+        return files(self.package).joinpath(self.filename)
+
+    def load(self) -> None:
+        resource = self.resource
+        text = resource.read_text(encoding="utf-8")
+        found = frozenset(
+            field
+            for _, field, _, _ in string.Formatter().parse(text)
+            if field is not None
+        )
+        if found != self.placeholders:
+            raise ValueError(
+                f"{self.package}/{self.filename}: expected placeholders "
+                + f"{sorted(self.placeholders)}, found {sorted(found)}"
+            )
+        self.text = text
+        self.mtime = resource.stat().st_mtime if isinstance(resource, Path) else None
+
+    def reload_if_modified(self) -> None:
+        resource = self.resource
+        if isinstance(resource, Path) and resource.stat().st_mtime != self.mtime:
+            self.load()
+
+    def render(self, **fields: object) -> str:
+        if fields.keys() != self.placeholders:
+            raise ValueError(
+                f"{self.filename} expects {sorted(self.placeholders)}, "
+                + f"got {sorted(fields.keys())}"
+            )
+        return self.text.format(**fields) if fields else self.text
+
+
+def _template(package: str, filename: str, *placeholders: str) -> PromptTemplate:
+    return PromptTemplate(package, filename, frozenset(placeholders))
+
+
+_ORCHESTRATOR = "VTAAS.orchestrator"
+_WORKERS = "VTAAS.workers"
+
+PROMPTS: dict[str, PromptTemplate] = {
+    "orchestrator.system": _template(_ORCHESTRATOR, "system_prompt.txt"),
+    "orchestrator.init": _template(
+        _ORCHESTRATOR,
+        "init_prompt.txt",
+        "test_case",
+        "current_step",
+        "history",
+        "page_info",
+        "viewport_info",
+    ),
+    "orchestrator.followup": _template(_ORCHESTRATOR, "followup_prompt.txt"),
+    "orchestrator.recover": _template(_ORCHESTRATOR, "recover_prompt.txt"),
+    "orchestrator.synthesis": _template(
+        _ORCHESTRATOR,
+        "synthesis_prompt.txt",
+        "test_case",
+        "current_step",
+        "saved_data",
+        "execution_logs",
+    ),
+    "actor": _template(
+        _WORKERS, "actor_prompt.txt", "history", "page_info", "viewport_info", "query"
+    ),
+    "actor.streamed": _template(
+        _WORKERS,
+        "actor_streamed_prompt.txt",
+        "history",
+        "page_info",
+        "viewport_info",
+        "query",
+    ),
+    "assertor": _template(
+        _WORKERS,
+        "assertor_prompt.txt",
+        "test_case",
+        "current_step",
+        "assertion",
+        "page_info",
+        "viewport_info",
+    ),
+}
+
+
+def hot_reload() -> bool:
+    """Dev mode: prompt files edited on disk are picked up without a restart"""
+    return os.getenv("VTAAS_PROMPTS_HOT_RELOAD", "false").lower() in ("1", "true")
+
+
+_loaded = False
+
+
+def load_prompts() -> None:
+    """
+    Load (and check) every registered prompt, once per process, whatever the
+    working directory. Not done at import: the prompts live in packages that
+    import this module.
+    """
+    global _loaded
+    for template in PROMPTS.values():
+        template.load()
+    _loaded = True
+
+
+def render_prompt(name: str, /, **fields: object) -> str:
+    """Render a registered prompt from memory"""
+    if not _loaded:
+        load_prompts()
+    template = PROMPTS[name]
+    if hot_reload():
+        template.reload_if_modified()
+    return template.render(**fields)
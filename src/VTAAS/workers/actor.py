@@ -1,11 +1,21 @@
+import asyncio
 from datetime import datetime
 import os
 from typing import TypeGuard, final, override
 
-from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.llm_client import LLMClient, LLMProvider, StreamingLLMClient
+from VTAAS.llm.memory import (
+    ACTOR_MEMORY,
+    MARKS_CLOSE,
+    MARKS_OPEN,
+    MemoryPolicy,
+    memory_policy,
+)
+from VTAAS.llm.scheduler import Priority, prioritized
 from VTAAS.llm.utils import create_llm_client
 from VTAAS.utils.banner import add_banner
 from VTAAS.utils.logger import get_logger
+from VTAAS.utils.prompts import render_prompt
 
 from ..schemas.llm import (
     ClickCommand,
@@ -13,6 +23,7 @@ from ..schemas.llm import (
     FillCommand,
     FinishCommand,
     GotoCommand,
+    LLMActResponse,
     Message,
     MessageRole,
     ScrollCommand,
@@ -60,8 +71,13 @@ class Actor(Worker):
             self.output_folder,
         )
         self.llm_client: LLMClient = create_llm_client(
-            self.name, llm_provider, start_time, self.output_folder
+            self.name,
+            llm_provider,
+            start_time,
+            self.output_folder,
+            worker=f"actor-{self.id[:8]}",
         )
+        self.memory: MemoryPolicy = memory_policy(ACTOR_MEMORY)
         # self.logger.setLevel(logging.DEBUG)
         self.logger.info(f"Initialized with query: {self.query}")
 
@@ -70,7 +86,7 @@ class Actor(Worker):
         """Actor execution loop"""
         if not self._is_actor_input(input):
             raise TypeError("Expected input of type ActorInput")
-        await self.browser.mark_page()
+        _ = await self.browser.mark_page()
         screenshot = await self.browser.screenshot()
         marks: list[Mark] = await self.browser.get_marks()
         page_info: str = await self.browser.get_page_info()
@@ -81,7 +97,9 @@ class Actor(Worker):
         self.logger.info(f"Actor {self.id[:8]} processing query '{self.query}'")
         while verdict is None and round < self.max_rounds:
             round += 1
-            response = await self.llm_client.act(self.conversation)
+            # later rounds may well finish the query: they go first
+            with prioritized(Priority.FINISH if round > 1 else Priority.ACT):
+                response, running = await self._act()
             command = response.command
             if command.name == "finish":
                 self.logger.info(
@@ -101,13 +119,15 @@ class Actor(Worker):
                     content=response.model_dump_json(),
                 )
             )
-            outcome = f"Browser response:\n{await self.run_command(command)}"
+            browser_response = (
+                await running if running else await self.run_command(command)
+            )
+            outcome = f"Browser response:\n{browser_response}"
             self.actions.append(
                 ActorAction(action=outcome, chain_of_thought=response.get_cot())
             )
             self.logger.info(outcome)
-            await self.browser.unmark_page()
-            await self.browser.mark_page()
+            _ = await self.browser.mark_page(incremental=True)
             screenshot = await self.browser.screenshot()
             marks_str = "\n" + self._format_marks(await self.browser.get_marks())
             self.logger.debug(marks_str)
@@ -126,6 +146,31 @@ class Actor(Worker):
             explaination="stopped after 3 rounds",
         )
 
+    async def _act(self) -> tuple[LLMActResponse, asyncio.Task[str] | None]:
+        """
+        Ask the LLM for the next command. A streaming client hands the command
+        over before the end of its answer: it is run right away, while the
+        rest arrives, and its task is returned along with the response.
+        """
+        conversation = self.memory.view(self.conversation)
+        if not isinstance(self.llm_client, StreamingLLMClient):
+            return await self.llm_client.act(conversation), None
+
+        running: asyncio.Task[str] | None = None
+
+        def on_command(command: Command) -> None:
+            nonlocal running
+            if command.name != "finish":
+                running = asyncio.create_task(self.run_command(command))
+
+        try:
+            response = await self.llm_client.act_stream(conversation, on_command)
+        except BaseException:
+            if running is not None:
+                _ = await asyncio.gather(running, return_exceptions=True)
+            raise
+        return response, running
+
     async def run_command(self, command: Command) -> str:
         match command:
             case ClickCommand(name="click"):
@@ -183,16 +228,15 @@ class Actor(Worker):
     def _build_user_prompt(
         self, input: ActorInput, page_info: str, viewport_info: str
     ) -> str:
-        with open(
-            "./src/VTAAS/workers/actor_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            prompt_template = prompt_file.read()
         history = (
             "<previous_actions>\n" + input.history + "\n</previous_actions>"
             if input.history is not None
             else ""
         )
-        return prompt_template.format(
+        # a streaming client asks for the command first
+        streamed = isinstance(self.llm_client, StreamingLLMClient)
+        return render_prompt(
+            "actor.streamed" if streamed else "actor",
             history=history,
             page_info=page_info,
             viewport_info=viewport_info,
@@ -200,10 +244,13 @@ class Actor(Worker):
         )
 
     def _format_marks(self, marks: list[Mark]) -> str:
-        output = "The labels on the screenshot correspons to these html elements\n:"
+        output = (
+            MARKS_OPEN
+            + "\nThe labels on the screenshot correspons to these html elements\n:"
+        )
         for m in marks:
             output += f"{m['mark']}. {m['element']}\n"
-        return output
+        return output + MARKS_CLOSE
 
     @override
     def __str__(self) -> str:
@@ -5,6 +5,7 @@ from VTAAS.llm.utils import create_llm_client
 from VTAAS.schemas.llm import Message, MessageRole, WorkerType
 from VTAAS.utils.banner import add_banner
 from VTAAS.utils.logger import get_logger
+from VTAAS.utils.prompts import render_prompt
 
 from ..schemas.verdict import AssertorResult, Status
 from ..workers.browser import Browser
@@ -33,7 +34,11 @@ class Assertor(Worker):
         self.start_time = start_time
         self.output_folder = output_folder
         self.llm_client = create_llm_client(
-            self.name, llm_provider, start_time, self.output_folder
+            self.name,
+            llm_provider,
+            start_time,
+            self.output_folder,
+            worker=f"assertor-{self.id[:8]}",
         )
         self.logger = get_logger(
             "Assertor - " + self.name + " - " + self.id,
@@ -94,14 +99,10 @@ class Assertor(Worker):
         page_info: str,
         viewport_info: str,
     ) -> str:
-        with open(
-            "./src/VTAAS/workers/assertor_prompt.txt", "r", encoding="utf-8"
-        ) as prompt_file:
-            prompt_template = prompt_file.read()
-
         current_step = input.test_step[0] + "; " + input.test_step[1]
 
-        return prompt_template.format(
+        return render_prompt(
+            "assertor",
             test_case=input.test_case,
             current_step=current_step,
             assertion=self.query,
@@ -1,7 +1,11 @@
 from datetime import datetime
+from functools import cache
+import json
 import os
 import time
 from typing import (
+    TYPE_CHECKING,
+    Any,
     Literal,
     NotRequired,
     TypeAlias,
@@ -16,10 +20,43 @@ import playwright.async_api as pw
 from urllib.parse import urlparse
 from VTAAS.utils.logger import get_logger
 
+if TYPE_CHECKING:
+    from VTAAS.workers.browser_pool import BrowserLease, BrowserPool
+
 T = TypeVar("T", bound="Browser")
 
 ScrollDirection: TypeAlias = Literal["up", "down"]
 
+PAGE_SCRIPTS = ["./js/mark_page.js", "./js/element_to_html_string.js"]
+_SCRIPTS_READY = "__pageScriptsReady"
+_SCRIPTS_MISSING = "__page_scripts_missing__"
+
+
+@cache
+def page_scripts() -> str:
+    """
+    The js/ scripts, read once per process and bundled into a single script.
+    The bundle is scoped and guarded, so it is harmless to run it several times
+    in a document, and it flags the window once its functions are defined.
+    """
+    sources: list[str] = []
+    for path in PAGE_SCRIPTS:
+        with open(path) as f:
+            sources.append(f.read())
+    body = "\n".join(sources)
+    return (
+        f"(() => {{\nif (window.{_SCRIPTS_READY}) return;\n{body}\n"
+        + f"window.{_SCRIPTS_READY} = true;\n}})();"
+    )
+
+
+def _guarded(function: str) -> str:
+    """Call function only if the page scripts are there, report it otherwise"""
+    return (
+        f"(...args) => window.{_SCRIPTS_READY} ? ({function})(...args) "
+        + f": {json.dumps(_SCRIPTS_MISSING)}"
+    )
+
 
 class ViewportData(TypedDict):
     scrollX: int
@@ -40,6 +77,7 @@ class BrowserParams(TypedDict, total=False):
     start_time: float
     tracer: bool
     trace_folder: str
+    pool: "BrowserPool | None"
 
 
 class Mark(TypedDict):
@@ -47,6 +85,16 @@ class Mark(TypedDict):
     element: str
 
 
+class MarkStats(TypedDict):
+    visited: int
+    pruned: int
+    candidates: int
+    marked: int
+    reused: int
+    incremental: bool
+    duration: float
+
+
 class MarkLocatorResult(TypedDict):
     locator: NotRequired[pw.Locator]
     error: NotRequired[str]
@@ -67,6 +115,7 @@ class Browser:
             "start_time": time.time(),
             "tracer": False,
             "trace_folder": ".",
+            "pool": None,
         }
         custom_params = kwargs
         if custom_params and set(custom_params.keys()).issubset(
@@ -81,6 +130,8 @@ class Browser:
         self._browser: pw.Browser | None = None
         self._context: pw.BrowserContext | None = None
         self._page: pw.Page | None = None
+        self._lease: "BrowserLease | None" = None
+        self._preloaded: tuple[str, str] | None = None
         self.name: str = self._params["name"]
         self.logger = get_logger(
             "Browser - " + self.name + " - " + self._params["id"],
@@ -92,7 +143,20 @@ class Browser:
             self.logger.warning("This browser should have a proper name!")
 
     async def initialize(self) -> None:
-        """Initialize the browser instance"""
+        """
+        Initialize the browser instance: a context of a pooled Chromium process
+        when a pool is given, else a Chromium process of its own
+        """
+        pool = self._params["pool"]
+        if pool is not None:
+            self._lease = await pool.lease()
+            self._context = self._lease.context
+            self._context.set_default_timeout(self._params["timeout"])
+            if self._params["tracer"] and not pool.tracing:
+                await self._context.tracing.start(screenshots=True, snapshots=True)
+            self._page = await self._context.new_page()
+            self.logger.info(f"Browser {self.id} started (pooled)")
+            return
         if not self._params["playwright"]:
             self._params["playwright"] = await pw.async_playwright().start()
         self._browser = await self._params["playwright"].chromium.launch(
@@ -105,21 +169,27 @@ class Browser:
                 f"Setting Playwright tracing ON: {self._params['trace_folder']}"
             )
             await self._context.tracing.start(screenshots=True, snapshots=True)
+        # Runs in every document (and frame) of the context, before its own scripts
+        await self._context.add_init_script(script=page_scripts())
         self._page = await self._context.new_page()
-
-        self._page.on("load", lambda load: self.load_js())
-        self._page.on("framenavigated", lambda load: self.load_js())
         self.logger.info(f"Browser {self.id} started")
 
-    async def load_js(self):
-        _ = await self.page.add_script_tag(path="./js/mark_page.js")
-        _ = await self.page.wait_for_function(
-            "() => typeof window.markPage === 'function'"
-        )
-        _ = await self.page.add_script_tag(path="./js/element_to_html_string.js")
-        _ = await self.page.wait_for_function(
-            "() => typeof window.elementToHtmlString  === 'function'"
-        )
+    async def _evaluate(
+        self, function: str, arg: Any = None, locator: pw.Locator | None = None
+    ) -> Any:
+        """
+        Evaluate a function relying on the page scripts, in the page or on a
+        locator element. The readiness check is part of the same evaluation:
+        the scripts are only injected again in the rare documents that missed
+        the init script.
+        """
+        target = locator or self.page
+        result = await target.evaluate(_guarded(function), arg)
+        if result == _SCRIPTS_MISSING:
+            self.logger.warning(f"Page scripts missing on {self.page.url}, injecting")
+            _ = await self.page.add_script_tag(content=page_scripts())
+            result = await target.evaluate(function, arg)
+        return result
 
     @classmethod
     async def create(cls: type[T], **kwargs: Unpack[BrowserParams]) -> T:
@@ -180,6 +250,21 @@ class Browser:
             self.logger.error(f"Navigation error: {str(e)}")
             return f"An error happened while navigating to {url}"
 
+    async def preload(self, url: str) -> str:
+        """Navigate ahead of time to the url the test case starts from"""
+        result = await self.goto(url)
+        if result.startswith("Successfully"):
+            self._preloaded = (url, self.page.url)
+        return result
+
+    @property
+    def preloaded(self) -> str | None:
+        """The preloaded url, as long as the page has not navigated since"""
+        if self._preloaded is None or self._page is None:
+            return None
+        url, landed = self._preloaded
+        return url if self._page.url == landed else None
+
     async def reload(self) -> str:
         url = self.page.url
         try:
@@ -360,22 +445,33 @@ class Browser:
         with open(os.path.join(screenshots_path, filename), "wb") as f:
             _ = f.write(screenshot)
 
-    async def mark_page(self):
-        _ = await self.page.wait_for_function(
-            "() => typeof window.markPage === 'function'"
+    async def mark_page(self, incremental: bool = False) -> MarkStats:
+        """
+        Label the clickable elements of the page.
+        When incremental, the page is watched between calls: only the regions
+        that changed are labelled again and untouched elements keep their mark.
+        """
+        stats = cast(
+            MarkStats,
+            await self._evaluate(
+                "(incremental) => window.markPage({ incremental }).stats", incremental
+            ),
+        )
+        self.logger.debug(
+            f"Marked {stats['marked']} elements ({stats['reused']} kept, "
+            + f"{stats['candidates']} candidates, "
+            + f"{stats['visited']} nodes visited, {stats['pruned']} subtrees pruned) "
+            + f"in {stats['duration']:.1f}ms"
         )
-        await self.page.evaluate("window.markPage()")
+        return stats
 
     async def unmark_page(self):
-        _ = await self.page.wait_for_function(
-            "() => typeof window.unmarkPage === 'function'"
-        )
-        await self.page.evaluate("window.unmarkPage()")
+        await self._evaluate("() => window.unmarkPage()")
 
     async def get_marks(self) -> list[Mark]:
         return cast(
             list[Mark],
-            await self.page.evaluate("""async () => {
+            await self._evaluate("""() => {
           const marks = []
           document.querySelectorAll('[data-mark]').forEach((e) => {
             marks.push({ mark: e.getAttribute('data-mark'), element: window.elementToHtmlString(e) })
@@ -385,11 +481,8 @@ class Browser:
         )
 
     async def get_html_element_from_locator(self, locator: pw.Locator) -> str:
-        _ = await self.page.wait_for_function(
-            "() => typeof window.elementToHtmlString === 'function'"
-        )
-        element: str = await locator.evaluate(
-            """(element) => window.elementToHtmlString(element)"""
+        element: str = await self._evaluate(
+            """(element) => window.elementToHtmlString(element)""", locator=locator
         )
         return element
 
@@ -424,7 +517,12 @@ class Browser:
             await self.context.tracing.stop(path=output_path)
         if self.page:
             await self.page.close()
-        if self.context:
+        pool = self._params["pool"]
+        if pool is not None and self._lease is not None:
+            # closes the context and gives it back to the pool
+            await pool.release(self._lease)
+            self._lease = None
+        elif self.context:
             await self.context.close()
         if self._browser:
             await self._browser.close()
@@ -0,0 +1,227 @@
+import asyncio
+from dataclasses import dataclass, field
+import os
+from pathlib import Path
+import time
+from typing import final
+from uuid import uuid4
+
+import playwright.async_api as pw
+
+from VTAAS.utils.logger import get_logger
+from VTAAS.workers.browser import page_scripts
+
+
+def process_tree_rss(marker: str) -> int | None:
+    """
+    Resident memory (bytes) of the Chromium process launched with this
+    marker switch and of its descendants (zygotes, renderers, GPU...).
+    None where /proc is not available.
+    """
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    parents: dict[int, int] = {}
+    rss: dict[int, int] = {}
+    roots: list[int] = []
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        pid = int(entry.name)
+        try:
+            stat = (entry / "stat").read_text()
+            statm = (entry / "statm").read_text()
+            cmdline = (entry / "cmdline").read_bytes()
+        except OSError:
+            continue
+        # the command name may contain spaces: fields start after its ")"
+        parents[pid] = int(stat[stat.rfind(")") + 2 :].split()[1])
+        rss[pid] = int(statm.split()[1]) * page_size
+        if marker.encode() in cmdline:
+            roots.append(pid)
+    if not roots:
+        return None
+    children: dict[int, list[int]] = {}
+    for pid, parent in parents.items():
+        children.setdefault(parent, []).append(pid)
+    total, stack, seen = 0, list(roots), set[int]()
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+@dataclass(frozen=True)
+class BrowserPoolConfig:
+    processes: int = 1
+    """Chromium processes the contexts are spread over"""
+    max_uses: int = 50
+    """contexts a process hands out before it is restarted"""
+    max_memory_growth: int = 1024
+    """MB a process may grow by before it is restarted"""
+
+    @classmethod
+    def from_env(cls) -> "BrowserPoolConfig":
+        """
+        VTAAS_BROWSER_PROCESSES, VTAAS_BROWSER_MAX_USES and
+        VTAAS_BROWSER_MAX_MEMORY_GROWTH (MB)
+        """
+        default = cls()
+        return cls(
+            processes=int(os.getenv("VTAAS_BROWSER_PROCESSES", default.processes)),
+            max_uses=int(os.getenv("VTAAS_BROWSER_MAX_USES", default.max_uses)),
+            max_memory_growth=int(
+                os.getenv("VTAAS_BROWSER_MAX_MEMORY_GROWTH", default.max_memory_growth)
+            ),
+        )
+
+
+@dataclass
+class _Process:
+    browser: pw.Browser
+    marker: str
+    baseline_rss: int | None = None
+    uses: int = 0
+    active: int = 0
+    retiring: bool = False
+    spare: "asyncio.Task[pw.BrowserContext] | None" = field(default=None, repr=False)
+
+
+@dataclass(frozen=True)
+class BrowserLease:
+    """A fresh context of a pooled Chromium process, to give back once closed"""
+
+    context: pw.BrowserContext
+    process: _Process = field(repr=False)
+
+
+@final
+class BrowserPool:
+    """
+    Long-lived Chromium processes handing out fresh, isolated contexts, with
+    the page scripts, viewport and tracing already set up: a spare context
+    is prepared while the previous one is in use. A process is restarted
+    once it has handed out max_uses contexts, or when its memory has grown
+    too much; contexts in use keep it alive until they are given back.
+    """
+
+    def __init__(
+        self,
+        playwright: pw.Playwright,
+        headless: bool = True,
+        tracing: bool = True,
+        viewport: pw.ViewportSize | None = None,
+        config: BrowserPoolConfig | None = None,
+        log_folder: str = ".",
+    ):
+        self.playwright: pw.Playwright = playwright
+        self.headless: bool = headless
+        self.tracing: bool = tracing
+        self.viewport: pw.ViewportSize | None = viewport
+        self.config: BrowserPoolConfig = config or BrowserPoolConfig.from_env()
+        self.processes: list[_Process] = []
+        self.launches: int = 0
+        self.logger = get_logger(
+            "Browser pool - " + uuid4().hex, time.time(), log_folder
+        )
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "BrowserPool":
+        return self
+
+    async def __aexit__(self, *_: object) -> None:
+        await self.close()
+
+    async def lease(self) -> BrowserLease:
+        """A fresh context, of the least busy process"""
+        async with self._lock:
+            process = await self._process()
+            process.uses += 1
+            process.active += 1
+            spare, process.spare = process.spare, None
+            if process.uses < self.config.max_uses:
+                process.spare = asyncio.create_task(self._new_context(process))
+        try:
+            context = await (spare or self._new_context(process))
+        except BaseException:
+            await self._give_back(process)
+            raise
+        return BrowserLease(context, process)
+
+    async def release(self, lease: BrowserLease) -> None:
+        """Closes the context, restarting its process if it is due"""
+        await lease.context.close()
+        await self._give_back(lease.process)
+
+    async def _give_back(self, process: _Process) -> None:
+        process.active -= 1
+        if not process.retiring:
+            if process.uses >= self.config.max_uses:
+                self.logger.info(f"Restarting Chromium after {process.uses} uses")
+                process.retiring = True
+            elif await self._grown(process):
+                process.retiring = True
+        if process.retiring and process.active == 0:
+            await self._stop(process)
+
+    async def _grown(self, process: _Process) -> bool:
+        if process.baseline_rss is None:
+            return False
+        rss = await asyncio.to_thread(process_tree_rss, process.marker)
+        if rss is None:
+            return False
+        growth = (rss - process.baseline_rss) // (1024 * 1024)
+        if growth <= self.config.max_memory_growth:
+            return False
+        self.logger.info(f"Restarting Chromium, grown by {growth} MB")
+        return True
+
+    async def _process(self) -> _Process:
+        available = [p for p in self.processes if not p.retiring]
+        if len(available) < self.config.processes:
+            process = await self._launch()
+            self.processes.append(process)
+            return process
+        return min(available, key=lambda process: process.active)
+
+    async def _launch(self) -> _Process:
+        marker = f"--vtaas-browser-pool={uuid4().hex}"
+        browser = await self.playwright.chromium.launch(
+            headless=self.headless, args=[marker]
+        )
+        self.launches += 1
+        process = _Process(browser, marker)
+        process.baseline_rss = await asyncio.to_thread(process_tree_rss, marker)
+        self.logger.info(f"Chromium launched ({self.launches} so far)")
+        return process
+
+    async def _new_context(self, process: _Process) -> pw.BrowserContext:
+        context = await process.browser.new_context(
+            bypass_csp=True, viewport=self.viewport
+        )
+        if self.tracing:
+            await context.tracing.start(screenshots=True, snapshots=True)
+        # Runs in every document (and frame) of the context, before its own scripts
+        await context.add_init_script(script=page_scripts())
+        return context
+
+    async def _stop(self, process: _Process) -> None:
+        if process in self.processes:
+            self.processes.remove(process)
+        if process.spare is not None:
+            spare, process.spare = process.spare, None
+            if not spare.cancel():
+                try:
+                    await (await spare).close()
+                except Exception:
+                    pass
+        await process.browser.close()
+
+    async def close(self) -> None:
+        for process in list(self.processes):
+            await self._stop(process)
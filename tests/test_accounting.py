@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+from VTAAS.llm.accounting import (
+    ModelPrice,
+    UsageRecorder,
+    call_tags,
+    log_usage,
+    model_price,
+    recording_usage,
+)
+from VTAAS.llm.images import EncodedImage
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.retry import Attempt, RequestExecutor, RetryPolicy
+from VTAAS.llm.usage import TokenUsage
+
+logger = logging.getLogger("test_accounting")
+
+
+def _executor(worker: str) -> RequestExecutor:
+    return RequestExecutor(
+        LLMProvider.OPENAI,
+        "gpt-4o-2024-11-20",
+        logger,
+        RetryPolicy(parse_tries=3),
+        worker=worker,
+    )
+
+
+def _image(size: int) -> EncodedImage:
+    return EncodedImage(b"x" * size, "image/png", 10, 10, size, 10, 10)
+
+
+@pytest.mark.asyncio
+async def test_calls_are_recorded_with_their_tags_and_retries():
+    recorder = UsageRecorder()
+
+    async def send(attempt: Attempt) -> str:
+        log_usage(logger, "act", TokenUsage(1000, 50, cached_tokens=800))
+        return "not json" if attempt.number == 1 else "{}"
+
+    async def act_in_step(step: int):
+        with call_tags(step=step):
+            _ = await _executor("actor-1234").run(
+                "act", send, json.loads, images=[_image(100), _image(50)]
+            )
+
+    with recording_usage(recorder), call_tags(test_case="42"):
+        await asyncio.gather(act_in_step(1), act_in_step(2))
+
+    assert [record.step for record in recorder.records] == [1, 2]
+    record = recorder.records[0]
+    assert (record.test_case, record.worker, record.method) == (
+        "42",
+        "actor-1234",
+        "act",
+    )
+    assert record.retries == 1
+    assert (record.input_tokens, record.cached_tokens, record.output_tokens) == (
+        2000,
+        1600,
+        100,
+    )
+    assert (record.images, record.image_bytes) == (2, 150)
+    assert record.latency >= record.waited >= 0
+    assert record.cost == pytest.approx((400 * 2.5 + 1600 * 1.25 + 100 * 10) / 1e6)
+    assert not record.failed
+
+
+@pytest.mark.asyncio
+async def test_failed_calls_are_recorded():
+    recorder = UsageRecorder()
+
+    async def send(_: Attempt) -> str:
+        return "not json"
+
+    with recording_usage(recorder):
+        with pytest.raises(ValueError):
+            _ = await _executor("assertor-1").run("assert", send, json.loads)
+    assert recorder.records[0].failed
+    assert recorder.records[0].retries == 2
+
+
+def test_recorder_summary_and_totals(tmp_path: Path):
+    recorder = UsageRecorder()
+
+    async def send(_: Attempt) -> str:
+        log_usage(logger, "plan", TokenUsage(100, 10))
+        return "{}"
+
+    async def calls():
+        for worker, test_case in [
+            ("orchestrator", "1"),
+            ("actor-a", "1"),
+            ("actor-b", "2"),
+        ]:
+            with call_tags(test_case=test_case):
+                _ = await _executor(worker).run("plan", send, json.loads)
+
+    with recording_usage(recorder):
+        asyncio.run(calls())
+
+    totals = recorder.totals()
+    assert totals["llm_calls"] == 3
+    assert totals["llm_input_tokens"] == 300
+    assert totals["llm_cost"] == pytest.approx(3 * (100 * 2.5 + 10 * 10) / 1e6)
+    summary = recorder.summary()
+    assert summary["by_worker"]["actor"]["calls"] == 2
+    assert summary["by_test_case"]["1"]["calls"] == 2
+    recorder.dump(str(tmp_path / "llm_usage.json"))
+    dumped = json.loads((tmp_path / "llm_usage.json").read_text())
+    assert len(dumped["calls"]) == 3
+
+
+def test_model_prices(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    assert model_price("some-unknown-model") is None
+    prices = tmp_path / "prices.json"
+    _ = prices.write_text(json.dumps({"some-unknown-model": {"input": 1, "output": 2}}))
+    monkeypatch.setenv("VTAAS_LLM_PRICES", str(prices))
+    price = model_price("some-unknown-model")
+    assert price == ModelPrice(input=1, output=2)
+    assert price.cost(TokenUsage(1_000_000, 500_000)) == pytest.approx(2.0)
+
+    # the file is read once
+    _ = prices.write_text(json.dumps({}))
+    assert model_price("some-unknown-model") == ModelPrice(input=1, output=2)
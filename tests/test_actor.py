@@ -1,4 +1,5 @@
-from collections.abc import Generator
+import asyncio
+from collections.abc import Callable, Generator
 import logging
 from tempfile import mktemp
 from typing import cast
@@ -7,18 +8,21 @@ import pytest
 from unittest.mock import AsyncMock, patch
 
 from VTAAS.data.testcase import TestCaseCollection
-from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.llm_client import LLMClient, LLMProvider, StreamingLLMClient
 from VTAAS.schemas.llm import (
     ClickCommand,
+    Command,
     FillCommand,
     FinishCommand,
     LLMActResponse,
+    Message,
     MessageRole,
 )
 from VTAAS.schemas.verdict import ActorResult, Status, WorkerResult
 from VTAAS.schemas.worker import ActorInput
 from VTAAS.workers.actor import Actor
 from VTAAS.workers.browser import Browser, Mark
+from VTAAS.utils.prompts import render_prompt
 
 MOCKED_QUERY = "This is a mock query"
 
@@ -194,6 +198,8 @@ async def test_actor_process_3_rounds(
 
         mock_browser = cast(AsyncMock, mock_browser)
         mock_browser.mark_page.assert_awaited()
+        mock_browser.mark_page.assert_called_with(incremental=True)
+        mock_browser.unmark_page.assert_awaited_once()
         mock_browser.screenshot.assert_awaited()
         mock_browser.click.assert_called_with("2")
         mock_browser.fill.assert_called_with("3", "hello_AI")
@@ -237,3 +243,58 @@ async def test_integ():
         verdict = await actor.process(actor_input)
         print(verdict)
         assert verdict.status == Status.PASS
+
+
+class StreamingClient:
+    """Hands each command over, then takes a while to finish its answer"""
+
+    def __init__(self, events: list[str]):
+        self.responses = llm_act_response_generator()
+        self.events = events
+        self.logger = logging.getLogger("streaming-client")
+        self.model = "streaming"
+
+    async def act_stream(
+        self, _: list[Message], on_command: Callable[[Command], None]
+    ) -> LLMActResponse:
+        response = next(self.responses)
+        on_command(response.command)
+        await asyncio.sleep(0.01)
+        self.events.append(f"answer complete: {response.command.name}")
+        return response
+
+
+@pytest.mark.asyncio
+async def test_actor_runs_streamed_command_before_answer_is_complete(
+    mock_browser: Browser, mock_actor_input: ActorInput
+):
+    events: list[str] = []
+    client = StreamingClient(events)
+    assert isinstance(client, StreamingLLMClient)
+    browser = cast(AsyncMock, mock_browser)
+    browser.click.side_effect = lambda label: events.append("click") or "clicked"
+    browser.fill.side_effect = lambda *_: events.append("fill") or "filled"
+    with (
+        patch("VTAAS.workers.actor.create_llm_client", return_value=client),
+        patch("VTAAS.workers.actor.add_banner", return_value=b"banner"),
+    ):
+        actor = Actor(
+            "actor_tu", "Test Query", mock_browser, LLMProvider.OPENAI, 0, mktemp()
+        )
+        result = await actor.process(mock_actor_input)
+
+    assert result.status == Status.PASS
+    # only the streamed answer puts the command ahead of the analyses
+    task = actor.conversation[1].content
+    assert "2. Command:" in task
+    assert "2. Command:" not in render_prompt(
+        "actor", history="", page_info="", viewport_info="", query="Test Query"
+    )
+    assert events == [
+        "click",
+        "answer complete: click",
+        "fill",
+        "answer complete: fill",
+        "answer complete: finish",
+    ]
+    assert len(result.actions) == 2
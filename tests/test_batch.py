@@ -0,0 +1,131 @@
+import asyncio
+import json
+from tempfile import mktemp
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from VTAAS.llm.accounting import UsageRecorder, recording_usage
+from VTAAS.llm.anthropic_client import (
+    MAX_TOKENS,
+    AnthropicBatchBackend,
+    AnthropicLLMClient,
+    max_tokens,
+)
+from VTAAS.llm.batch import (
+    BatchCollector,
+    BatchConfig,
+    BatchingLLMClient,
+    BatchRequest,
+    BatchResult,
+    FakeBatchBackend,
+)
+from VTAAS.llm.openai_client import OpenAIBatchBackend, OpenAILLMClient
+from VTAAS.llm.registry import close_sdk_clients
+from VTAAS.llm.usage import TokenUsage
+from VTAAS.schemas.llm import (
+    LLMAssertResponse,
+    LLMDataExtractionResponse,
+    Message,
+    MessageRole,
+)
+
+EXTRACTION = '{"entries": [{"entry_type": "price", "value": "12"}]}'
+
+
+def _collector(backend: FakeBatchBackend, **config: float) -> BatchCollector:
+    return BatchCollector(
+        backend,
+        BatchConfig(**{"max_wait": 0.01, "poll_interval": 0.001, **config}),
+        OpenAILLMClient("TC_batch", 0, mktemp()).logger,
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_a_batch():
+    backend = FakeBatchBackend(lambda request: str(request.body["n"]), polls=3)
+    collector = _collector(backend, max_size=3)
+    results = await asyncio.gather(*(collector.run({"n": n}) for n in range(5)))
+    assert [result.text for result in results] == ["0", "1", "2", "3", "4"]
+    assert [len(batch) for batch in backend.batches.values()] == [3, 2]
+    await close_sdk_clients()
+
+
+@pytest.mark.asyncio
+async def test_data_extraction_goes_through_the_batch():
+    inner = OpenAILLMClient("TC_batch", 0, mktemp(), worker="orchestrator")
+    backend = FakeBatchBackend(lambda _: EXTRACTION)
+    client = BatchingLLMClient(
+        inner, _collector(backend), frozenset({"step_postprocess"})
+    )
+    recorder = UsageRecorder()
+    with recording_usage(recorder):
+        response = await client.step_postprocess("extract", "the price", [])
+    assert response.entries[0].value == "12"
+    body = backend.batches["batch_1"][0].body
+    assert body["model"] == "gpt-4o-2024-11-20"
+    assert body["response_format"]["type"] == "json_schema"
+    _ = json.dumps(body)
+    record = recorder.records[0]
+    assert (record.method, record.worker) == ("data extraction (batch)", "orchestrator")
+    assert record.price_factor == 0.5
+    await close_sdk_clients()
+
+
+@pytest.mark.asyncio
+async def test_failed_batched_requests_are_sent_online():
+    inner = OpenAILLMClient("TC_batch", 0, mktemp())
+
+    def respond(_: BatchRequest) -> str:
+        raise RuntimeError("request errored")
+
+    client = BatchingLLMClient(
+        inner, _collector(FakeBatchBackend(respond)), frozenset({"step_postprocess"})
+    )
+    online = LLMDataExtractionResponse(entries=[])
+    with patch.object(inner, "step_postprocess", AsyncMock(return_value=online)):
+        assert await client.step_postprocess("extract", "the price", []) == online
+    await close_sdk_clients()
+
+
+def test_openai_batch_result_lines():
+    succeeded = {
+        "custom_id": "req-1",
+        "response": {
+            "status_code": 200,
+            "body": {
+                "choices": [{"message": {"content": EXTRACTION}}],
+                "usage": {
+                    "prompt_tokens": 100,
+                    "completion_tokens": 10,
+                    "total_tokens": 110,
+                },
+            },
+        },
+        "error": None,
+    }
+    result = OpenAIBatchBackend._result(succeeded)
+    assert result == BatchResult(
+        "req-1", text=EXTRACTION, usage=TokenUsage(input_tokens=100, output_tokens=10)
+    )
+    failed = {"custom_id": "req-2", "response": None, "error": {"code": "timeout"}}
+    assert OpenAIBatchBackend._result(failed).error == "{'code': 'timeout'}"
+
+
+@pytest.mark.asyncio
+async def test_anthropic_batch_body_keeps_its_prefill():
+    client = AnthropicLLMClient("TC_batch", 0, mktemp())
+    conversation = [
+        Message(role=MessageRole.System, content="extract"),
+        Message(role=MessageRole.User, content="the price"),
+    ]
+    body = client.batch_body(conversation, LLMDataExtractionResponse)
+    assert body["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert AnthropicBatchBackend._prefill(body) == '{"'
+    # same answer budget as online
+    assert body["max_tokens"] == max_tokens(LLMDataExtractionResponse)
+    assert client.batch_body(conversation, LLMAssertResponse)["max_tokens"] == (
+        MAX_TOKENS
+    )
+    _ = json.dumps(body)
+    await close_sdk_clients()
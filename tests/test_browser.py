@@ -5,7 +5,7 @@ from unittest.mock import patch
 import pytest_asyncio
 from collections.abc import AsyncGenerator
 from playwright.async_api import Browser as PWBrowser, Locator, Page
-from VTAAS.workers.browser import Browser
+from VTAAS.workers.browser import Browser, page_scripts
 
 TEST_HTML = """
 
@@ -335,6 +335,100 @@ async def test_get_marks(browser: Browser, dummy_page_path: Path):
         )
 
 
+@pytest.mark.asyncio
+async def test_page_scripts_injected_once(browser: Browser, dummy_page_path: Path):
+    """Test the page scripts come with every document and can be re-run safely"""
+    with patch.object(browser, "_is_valid_url", return_value=True):
+        _ = await browser.goto(f"file://{dummy_page_path}")
+        assert await browser.page.evaluate("typeof window.markPage") == "function"
+
+        _ = await browser.page.add_script_tag(content=page_scripts())
+        _ = await browser.mark_page()
+        styles = await browser.page.evaluate(
+            "document.querySelectorAll('head style').length"
+        )
+        assert styles == 1
+
+
+@pytest.mark.asyncio
+async def test_mark_page_stats(browser: Browser, dummy_page_path: Path):
+    """Test marking labels the visible clickable elements and reports stats"""
+    with patch.object(browser, "_is_valid_url", return_value=True):
+        _ = await browser.goto(f"file://{dummy_page_path}")
+
+        stats = await browser.mark_page()
+        assert stats["marked"] == 5
+        assert stats["marked"] <= stats["candidates"] <= stats["visited"]
+        marks = await browser.get_marks()
+        assert [mark["mark"] for mark in marks] == ["0", "1", "2", "3", "4"]
+        assert marks[0]["element"] == "<button >Click Me</button>"
+
+
+@pytest.mark.asyncio
+async def test_mark_page_incremental_keeps_labels(
+    browser: Browser, dummy_page_path: Path
+):
+    """Test incremental marking only labels the new elements"""
+    with patch.object(browser, "_is_valid_url", return_value=True):
+        _ = await browser.goto(f"file://{dummy_page_path}")
+
+        _ = await browser.mark_page()
+        before = await browser.get_marks()
+        _ = await browser.page.evaluate("""() => {
+            const button = document.createElement('button')
+            button.textContent = 'New button'
+            document.querySelector('h1').after(button)
+        }""")
+        stats = await browser.mark_page(incremental=True)
+        assert stats["incremental"]
+        assert stats["reused"] == len(before)
+        after = {mark["mark"]: mark["element"] for mark in await browser.get_marks()}
+        for mark in before:
+            assert after[mark["mark"]] == mark["element"]
+        assert after[str(len(before))] == "<button >New button</button>"
+
+
+HOVER_MENU_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        .menu .items { display: none; }
+        .menu:hover .items { display: block; }
+    </style>
+</head>
+<body>
+    <button>Home</button>
+    <div class="menu">
+        <button>Products</button>
+        <div class="items"><a href="#shoes">Shoes</a></div>
+    </div>
+</body>
+</html>
+"""
+
+
+@pytest.mark.asyncio
+async def test_mark_page_incremental_labels_hover_menu(
+    browser: Browser, tmp_path: Path
+):
+    """Test incremental marking labels a menu revealed by :hover, no DOM mutation"""
+    page_path = tmp_path / "hover_menu.html"
+    _ = page_path.write_text(HOVER_MENU_HTML)
+    with patch.object(browser, "_is_valid_url", return_value=True):
+        _ = await browser.goto(f"file://{page_path}")
+
+        _ = await browser.mark_page()
+        before = {mark["element"]: mark["mark"] for mark in await browser.get_marks()}
+        assert len(before) == 2
+        await browser.page.hover("text=Products")
+        _ = await browser.mark_page(incremental=True)
+        after = {mark["element"]: mark["mark"] for mark in await browser.get_marks()}
+        assert after['<a href="#shoes" >Shoes</a>'] == "2"
+        for element, mark in before.items():
+            assert after[element] == mark
+
+
 @pytest.mark.asyncio
 async def test_select_valid_option(browser: Browser, dummy_page_path: Path):
     """Test selecting a valid option from dropdown"""
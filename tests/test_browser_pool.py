@@ -0,0 +1,86 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from VTAAS.workers.browser import Browser
+from VTAAS.workers.browser_pool import BrowserPool, BrowserPoolConfig
+
+
+def fake_playwright() -> MagicMock:
+    def new_browser(**kwargs: object) -> MagicMock:
+        browser = MagicMock()
+        browser.close = AsyncMock()
+        browser.new_context = AsyncMock(side_effect=lambda **_: new_context())
+        return browser
+
+    def new_context() -> MagicMock:
+        context = MagicMock()
+        context.tracing.start = AsyncMock()
+        context.tracing.stop = AsyncMock()
+        context.add_init_script = AsyncMock()
+        context.new_page = AsyncMock()
+        context.close = AsyncMock()
+        return context
+
+    playwright = MagicMock()
+    playwright.chromium.launch = AsyncMock(side_effect=new_browser)
+    return playwright
+
+
+@pytest.mark.asyncio
+async def test_contexts_share_a_process_until_max_uses(tmp_path):
+    playwright = fake_playwright()
+    pool = BrowserPool(
+        playwright, config=BrowserPoolConfig(max_uses=3), log_folder=str(tmp_path)
+    )
+    leases = [await pool.lease() for _ in range(3)]
+    assert pool.launches == 1
+    assert len({id(lease.context) for lease in leases}) == 3
+    for lease in leases:
+        lease.context.tracing.start.assert_awaited_once()
+        lease.context.add_init_script.assert_awaited_once()
+
+    first = leases[0].process.browser
+    await pool.release(leases[0])
+    await pool.release(leases[1])
+    first.close.assert_not_awaited()
+    await pool.release(leases[2])
+    first.close.assert_awaited_once()
+
+    _ = await pool.lease()
+    assert pool.launches == 2
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_process_is_restarted_on_memory_growth(tmp_path):
+    pool = BrowserPool(
+        fake_playwright(),
+        config=BrowserPoolConfig(max_memory_growth=100),
+        log_folder=str(tmp_path),
+    )
+    rss = iter([200 * 2**20, 250 * 2**20, 400 * 2**20])
+    with patch(
+        "VTAAS.workers.browser_pool.process_tree_rss", side_effect=lambda _: next(rss)
+    ):
+        await pool.release(await pool.lease())
+        assert pool.launches == 1 and len(pool.processes) == 1
+        await pool.release(await pool.lease())
+        assert pool.processes == []
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pooled_browser_gives_its_context_back(tmp_path):
+    pool = BrowserPool(fake_playwright(), log_folder=str(tmp_path))
+    browser = await Browser.create(
+        name="pooled", pool=pool, tracer=True, trace_folder=str(tmp_path)
+    )
+    context = browser.context
+    assert pool.processes[0].active == 1
+
+    await browser.close()
+    context.tracing.stop.assert_awaited_once_with(path=str(tmp_path / "trace.zip"))
+    context.close.assert_awaited_once()
+    assert pool.processes[0].active == 0
+    await pool.close()
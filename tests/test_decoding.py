@@ -0,0 +1,82 @@
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from VTAAS.llm.decoding import DecodeStats, decode_response, decode_stats, repair_json
+from VTAAS.schemas.llm import ClickCommand, LLMActResponse
+
+
+class Verdict(BaseModel):
+    passed: bool
+    reason: str | None = None
+    labels: list[int] = []
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch: pytest.MonkeyPatch):
+    stats = DecodeStats()
+    monkeypatch.setattr("VTAAS.llm.decoding._stats", stats)
+    return stats
+
+
+def test_json_literals_take_the_fast_path(fresh_stats: DecodeStats):
+    verdict = decode_response('{"passed": true, "reason": null}', Verdict)
+    assert verdict == Verdict(passed=True)
+    assert fresh_stats.summary() == {"Verdict": {"json": 1, "repaired": 0, "failed": 0}}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '```json\n{"passed": false, "labels": [1, 2]}\n```',
+        'Here is my answer: {"passed": false, "labels": [1, 2]} Hope it helps',
+        '{"passed": false, "labels": [1, 2,],}',
+        "{'passed': False, 'labels': [1, 2]}",
+    ],
+)
+def test_malformed_answers_are_repaired(text: str, fresh_stats: DecodeStats):
+    assert decode_response(text, Verdict) == Verdict(passed=False, labels=[1, 2])
+    assert decode_stats().summary()["Verdict"]["repaired"] == 1
+
+
+def test_truncated_answers_are_only_closed_at_the_token_limit():
+    text = '{"passed": false, "labels": [1, 2,'
+    with pytest.raises(ValidationError):
+        _ = decode_response(text, Verdict)
+    verdict = decode_response(text, Verdict, truncated=True)
+    assert verdict == Verdict(passed=False, labels=[1, 2])
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"passed": false, "reason": "the form is not sub',
+        '{"passed": false, "reason": "ok"',
+    ],
+)
+def test_answers_truncated_in_a_string_are_rejected(text: str):
+    with pytest.raises(ValidationError):
+        _ = decode_response(text, Verdict, truncated=True)
+
+
+def test_undecodable_answers_raise_the_validation_error(fresh_stats: DecodeStats):
+    with pytest.raises(ValidationError):
+        _ = decode_response('{"reason": "no verdict"}', Verdict)
+    with pytest.raises(ValueError, match="empty"):
+        _ = decode_response("", Verdict)
+    assert fresh_stats.summary()["Verdict"]["failed"] == 1
+
+
+def test_repair_json_needs_an_object():
+    with pytest.raises(ValueError):
+        _ = repair_json("I cannot help with that")
+
+
+def test_nested_union_from_json():
+    text = (
+        '{"current_webpage_identification": "home", "screenshot_analysis": "a",'
+        ' "query_progress": "b", "next_action": "c", "element_recognition": "d",'
+        ' "command": {"name": "click", "label": 3}}'
+    )
+    assert decode_response(text, LLMActResponse).command == ClickCommand(
+        name="click", label=3
+    )
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import multiprocessing
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from VTAAS.data.testcase import TestCase, TestCaseCollection
+from VTAAS.evaluation import EvaluationRunner
+from VTAAS.evaluation.ledger import (
+    LEDGER_FILE,
+    LedgerEntry,
+    ResultsLedger,
+    Shard,
+    merge_ledgers,
+    read_entries,
+)
+from VTAAS.evaluation.metrics import empty_metrics, finalize_metrics, outcome
+from VTAAS.evaluation.processes import (
+    MultiProcessRunner,
+    _use_limits,
+    process_limits,
+)
+from VTAAS.evaluation.reset import FakeReset
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.retry import rate_limiter
+from VTAAS.llm.scheduler import drop_llm_scheduler, llm_scheduler
+from VTAAS.schemas.verdict import Status, TestCaseVerdict
+
+# test case id -> (type, failing step, verdict status, verdict step, duration)
+SCENARIO = {
+    "1": ("P", -1, Status.PASS, 1, 0.03),
+    "2": ("P", -1, Status.FAIL, 2, 0.01),
+    "3": ("F", 2, Status.FAIL, 2, 0.02),
+    "4": ("F", 3, Status.FAIL, 1, 0.01),
+    "5": ("F", 1, Status.PASS, 1, 0.02),
+    "6": ("F", 1, Status.FAIL, 3, 0.00),
+}
+
+
+def make_test_case(id: str) -> TestCase:
+    type, failing_step, *_ = SCENARIO[id]
+    test_case = MagicMock(spec=TestCase, id=id, type=type, url="http://app:9980")
+    test_case.failing_step = failing_step
+    return test_case
+
+
+@pytest.fixture
+def mock_collection() -> TestCaseCollection:
+    collection = MagicMock(spec=TestCaseCollection, url="http://app:9980")
+    test_cases = [make_test_case(id) for id in SCENARIO]
+    collection.__iter__.side_effect = lambda: iter(test_cases)
+    return collection
+
+
+class FakeOrchestrator:
+    running: int = 0
+    max_running: int = 0
+
+    def __init__(self, **kwargs: object):
+        pass
+
+    async def process_testcase(self, test_case: TestCase) -> TestCaseVerdict:
+        _, _, status, step_index, duration = SCENARIO[test_case.id]
+        FakeOrchestrator.running += 1
+        FakeOrchestrator.max_running = max(
+            FakeOrchestrator.max_running, FakeOrchestrator.running
+        )
+        await asyncio.sleep(duration)
+        FakeOrchestrator.running -= 1
+        return TestCaseVerdict(status=status, step_index=step_index)
+
+
+async def run(
+    collection: TestCaseCollection, output_folder: Path, workers: int, **kwargs
+) -> tuple[dict, dict]:
+    FakeOrchestrator.max_running = 0
+    with (
+        patch("VTAAS.evaluation.runner.async_playwright"),
+        patch("VTAAS.evaluation.runner.Browser.create", new=AsyncMock()),
+        patch("VTAAS.evaluation.runner.Orchestrator", new=FakeOrchestrator),
+    ):
+        runner = EvaluationRunner(
+            collection,
+            str(output_folder),
+            LLMProvider.OPENAI,
+            workers=workers,
+            **kwargs,
+        )
+        return await runner.run()
+
+
+def sequential_metrics() -> dict[str, float]:
+    metrics = empty_metrics()
+    for type, failing_step, status, step_index, _ in SCENARIO.values():
+        key = outcome(type, failing_step, status, step_index)
+        if key is not None:
+            metrics[key] += 1
+    return finalize_metrics(metrics)
+
+
+@pytest.mark.asyncio
+async def test_parallel_run_matches_sequential(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    seq_results, seq_metrics = await run(mock_collection, tmp_path / "seq", 1)
+    assert FakeOrchestrator.max_running == 1
+    par_results, par_metrics = await run(mock_collection, tmp_path / "par", 4)
+    assert FakeOrchestrator.max_running == 4
+
+    assert list(par_results.keys()) == list(SCENARIO.keys())
+    assert par_results == seq_results
+    assert par_metrics == seq_metrics == sequential_metrics()
+    assert par_metrics["AFC"] == 1
+    assert par_metrics["AFB"] == 1
+    assert par_metrics["AFA"] == 1
+
+    with open(tmp_path / "par" / "result.json") as fp:
+        assert list(json.load(fp).keys()) == list(SCENARIO.keys())
+
+
+@pytest.mark.asyncio
+async def test_run_resumes_from_ledger(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    ResultsLedger(tmp_path / LEDGER_FILE).append(
+        LedgerEntry("3", "F", 2, Status.FAIL, 2, finished_at=1.0)
+    )
+    (tmp_path / "TC_5").mkdir()
+    (tmp_path / "TC_5" / "unfinished.log").touch()
+
+    results, metrics = await run(mock_collection, tmp_path, 2)
+    assert not (tmp_path / "TC_3").exists()
+    assert not (tmp_path / "TC_5" / "unfinished.log").exists()
+    assert len(list(tmp_path.glob("TC_5.unfinished-*/unfinished.log"))) == 1
+    assert list(results.keys()) == list(SCENARIO.keys())
+    assert metrics == sequential_metrics()
+    assert len(list(read_entries(tmp_path / LEDGER_FILE))) == len(SCENARIO)
+
+
+@pytest.mark.asyncio
+async def test_results_of_a_folder_without_ledger_are_kept(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    (tmp_path / "TC_3").mkdir()
+    (tmp_path / "TC_3" / "execution.log").touch()
+    with open(tmp_path / "result.json", "w") as fp:
+        json.dump({"3": [Status.FAIL, 2, 2]}, fp)
+
+    results, metrics = await run(mock_collection, tmp_path, 2)
+    assert (tmp_path / "TC_3" / "execution.log").exists()
+    assert list(results.keys()) == list(SCENARIO.keys())
+    assert metrics == sequential_metrics()
+    assert len(list(read_entries(tmp_path / LEDGER_FILE))) == len(SCENARIO)
+
+
+@pytest.mark.asyncio
+async def test_shards_merge_into_the_full_run(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    for index in (1, 2, 3):
+        results, _ = await run(
+            mock_collection, tmp_path / f"shard{index}", 2, shard=Shard(index, 3)
+        )
+        assert len(results) == 2
+
+    merged = merge_ledgers(
+        [tmp_path / f"shard{index}" / LEDGER_FILE for index in (1, 2, 3)],
+        tmp_path / LEDGER_FILE,
+    )
+    assert merged.results(SCENARIO) == {
+        id: (status, step_index, failing_step)
+        for id, (_, failing_step, status, step_index, _) in SCENARIO.items()
+    }
+    # result.json lists them in collection order, as a single run does
+    assert list(merged.results()) == list(SCENARIO)
+    assert finalize_metrics(merged.metrics()) == sequential_metrics()
+
+
+@pytest.mark.asyncio
+async def test_reset_holds_replica_exclusively(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    resets: list[str] = []
+
+    async def reset(url: str) -> None:
+        resets.append(url)
+
+    replicas = ["http://app:9980", "http://replica:9980"]
+    _ = await run(mock_collection, tmp_path, 4, app_urls=replicas, reset=reset)
+    assert FakeOrchestrator.max_running == 2
+    assert len(resets) == len(SCENARIO)
+    assert set(resets) == set(replicas)
+
+
+@pytest.mark.asyncio
+async def test_reset_time_is_reported_apart(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    reset = FakeReset(delay=0.02)
+    _, metrics = await run(mock_collection, tmp_path, 1, reset=reset)
+    assert len(reset.resets) == len(SCENARIO)
+    assert metrics["reset_time"] >= 0.02 * len(SCENARIO)
+    assert metrics["test_time"] >= sum(duration for *_, duration in SCENARIO.values())
+
+    with open(tmp_path / "timings.json") as fp:
+        timings = json.load(fp)
+    assert list(timings.keys()) == list(SCENARIO.keys())
+    assert all(timing["reset"] >= 0.02 for timing in timings.values())
+
+
+@pytest.mark.asyncio
+async def test_next_environment_is_prepared_during_test_case(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    running_during_reset: list[int] = []
+
+    async def reset(url: str) -> None:
+        running_during_reset.append(FakeOrchestrator.running)
+        await asyncio.sleep(0.001)
+
+    replicas = ["http://app:9980", "http://replica:9980"]
+    _ = await run(mock_collection, tmp_path, 1, app_urls=replicas, reset=reset)
+    assert FakeOrchestrator.max_running == 1
+    assert running_during_reset[0] == 0
+    assert sum(running_during_reset[1:]) >= len(SCENARIO) - 2
+
+
+class FailingOrchestrator(FakeOrchestrator):
+    async def process_testcase(self, test_case: TestCase) -> TestCaseVerdict:
+        if test_case.id == "4":
+            raise RuntimeError("orchestrator crashed")
+        return await super().process_testcase(test_case)
+
+
+@pytest.mark.asyncio
+async def test_failing_test_cases_do_not_stop_the_others(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    async def create_browser(name: str, **_: object) -> MagicMock:
+        if name == "TC_2":
+            raise RuntimeError("browser did not start")
+        return AsyncMock()
+
+    replicas = ["http://app:9980", "http://replica:9980"]
+    with (
+        patch("VTAAS.evaluation.runner.async_playwright"),
+        patch("VTAAS.evaluation.runner.Browser.create", new=create_browser),
+        patch("VTAAS.evaluation.runner.Orchestrator", new=FailingOrchestrator),
+    ):
+        runner = EvaluationRunner(
+            mock_collection,
+            str(tmp_path),
+            LLMProvider.OPENAI,
+            workers=2,
+            app_urls=replicas,
+            reset=FakeReset(),
+        )
+        results, _ = await asyncio.wait_for(runner.run(), timeout=5)
+
+    assert list(results.keys()) == ["1", "3", "5", "6"]
+    assert "browser did not start" in (tmp_path / "TC_2" / "error.log").read_text()
+    assert "orchestrator crashed" in (tmp_path / "TC_4" / "error.log").read_text()
+    assert runner._free_apps.qsize() == len(replicas)
+
+    # resumed without resets: the totals of the first run stay in the metrics
+    results, metrics = await run(mock_collection, tmp_path, 2)
+    assert list(results.keys()) == list(SCENARIO.keys())
+    assert metrics.items() >= sequential_metrics().items()
+
+
+@pytest.mark.asyncio
+async def test_processes_stream_results_to_the_coordinator(
+    mock_collection: TestCaseCollection, tmp_path: Path
+):
+    with (
+        patch("VTAAS.evaluation.runner.async_playwright"),
+        patch("VTAAS.evaluation.runner.Browser.create", new=AsyncMock()),
+        patch("VTAAS.evaluation.runner.Orchestrator", new=FakeOrchestrator),
+    ):
+        runner = MultiProcessRunner(
+            lambda: mock_collection,
+            str(tmp_path),
+            LLMProvider.OPENAI,
+            processes=2,
+            workers=2,
+            start_method="fork",
+        )
+        results, metrics = await runner.run()
+
+    assert list(results.keys()) == list(SCENARIO.keys())
+    assert metrics == sequential_metrics()
+    assert len(ResultsLedger(tmp_path / LEDGER_FILE)) == len(SCENARIO)
+    with open(tmp_path / "llm_queue.json") as fp:
+        assert set(json.load(fp).keys()) == {"process 1", "process 2"}
+
+
+def _child_limits(limits: dict[str, str], results: "multiprocessing.Queue[object]"):
+    _use_limits(limits)
+    results.put(
+        (
+            llm_scheduler().queue(LLMProvider.OPENAI).max_in_flight,
+            llm_scheduler().queue(LLMProvider.MISTRAL).max_in_flight,
+            rate_limiter(LLMProvider.ANTHROPIC, "model").rate,
+        )
+    )
+
+
+def test_processes_share_the_llm_limits(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("VTAAS_MAX_IN_FLIGHT_OPENAI", "10")
+    monkeypatch.setenv("VTAAS_RPM_ANTHROPIC", "120")
+    monkeypatch.delenv("VTAAS_MAX_IN_FLIGHT_MISTRAL", raising=False)
+    monkeypatch.delenv("VTAAS_RPM_OPENAI", raising=False)
+    limits = process_limits(4)
+    assert limits["VTAAS_MAX_IN_FLIGHT_OPENAI"] == "2"
+    assert limits["VTAAS_MAX_IN_FLIGHT_MISTRAL"] == "4"
+    assert limits["VTAAS_RPM_ANTHROPIC"] == "30.0"
+    assert "VTAAS_RPM_OPENAI" not in limits
+    assert process_limits(32)["VTAAS_MAX_IN_FLIGHT_OPENAI"] == "1"
+
+    # a forked process does not keep the coordinator's scheduler and limiters
+    drop_llm_scheduler()
+    try:
+        assert llm_scheduler().queue(LLMProvider.OPENAI).max_in_flight == 10
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        process = context.Process(target=_child_limits, args=(limits, results))
+        process.start()
+        assert results.get(timeout=10) == (2, 4, 0.5)
+        process.join()
+    finally:
+        drop_llm_scheduler()
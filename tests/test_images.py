@@ -0,0 +1,61 @@
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from VTAAS.llm.images import (
+    ImageConfig,
+    ImageFormat,
+    describe_savings,
+    prepare_image,
+)
+
+
+def make_screenshot(width: int = 1600, height: int = 900) -> bytes:
+    image = Image.new("RGBA", (width, height), (30, 120, 200, 255))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_prepare_image_downscales_and_reencodes():
+    screenshot = make_screenshot()
+    encoded = prepare_image(screenshot, ImageConfig(max_dimension=800))
+    assert encoded.mime_type == "image/jpeg"
+    assert (encoded.width, encoded.height) == (800, 450)
+    assert encoded.tokens < encoded.original_tokens
+    image = Image.open(BytesIO(encoded.data))
+    assert image.format == "JPEG"
+    assert image.size == (800, 450)
+
+
+def test_prepare_image_keeps_small_png_untouched():
+    screenshot = make_screenshot(640, 360)
+    config = ImageConfig(max_dimension=1280, format=ImageFormat.PNG)
+    encoded = prepare_image(screenshot, config)
+    assert encoded.data == screenshot
+    assert encoded.mime_type == "image/png"
+
+
+@pytest.mark.parametrize("image_format", list(ImageFormat))
+def test_prepare_image_grayscale(image_format: ImageFormat):
+    config = ImageConfig(format=image_format, grayscale=True)
+    encoded = prepare_image(make_screenshot(), config)
+    red, green, blue = Image.open(BytesIO(encoded.data)).convert("RGB").getpixel((0, 0))
+    assert red == green == blue
+    assert encoded.mime_type == f"image/{image_format.value}"
+
+
+def test_image_config_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("VTAAS_IMAGE_MAX_DIMENSION", "1024")
+    monkeypatch.setenv("VTAAS_IMAGE_FORMAT", "WEBP")
+    monkeypatch.setenv("VTAAS_IMAGE_QUALITY", "60")
+    monkeypatch.setenv("VTAAS_IMAGE_GRAYSCALE", "true")
+    assert ImageConfig.from_env() == ImageConfig(1024, ImageFormat.WEBP, 60, True)
+
+
+def test_describe_savings():
+    encoded = prepare_image(make_screenshot(), ImageConfig(max_dimension=800))
+    summary = describe_savings([encoded, encoded])
+    assert summary.startswith("2 image(s): ")
+    assert f"~{2 * encoded.original_tokens} -> ~{2 * encoded.tokens} tokens" in summary
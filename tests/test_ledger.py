@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import pytest
+
+from VTAAS.evaluation.ledger import LedgerEntry, ResultsLedger, Shard
+from VTAAS.schemas.verdict import Status
+
+
+def test_ledger_survives_reopening_and_a_cut_short_line(tmp_path: Path):
+    path = tmp_path / "results.jsonl"
+    ledger = ResultsLedger(path)
+    ledger.append(LedgerEntry("1", "P", -1, Status.PASS, 1))
+    ledger.append(LedgerEntry("2", "F", 2, Status.FAIL, 1))
+    with open(path, "a") as fp:
+        _ = fp.write('{"test_case": "3", "type": "P", "fail')
+
+    reopened = ResultsLedger(path)
+    assert reopened.results() == {
+        "1": (Status.PASS, 1, -1),
+        "2": (Status.FAIL, 1, 2),
+    }
+    assert reopened.metrics() == ledger.metrics()
+    assert "3" not in reopened
+
+
+def test_latest_entry_replaces_the_previous_one(tmp_path: Path):
+    ledger = ResultsLedger(tmp_path / "results.jsonl")
+    ledger.append(
+        LedgerEntry(
+            "1",
+            "P",
+            -1,
+            Status.FAIL,
+            2,
+            timing={"reset": 3.0, "test": 10.0},
+            llm={"llm_calls": 4, "llm_cost": 0.5},
+        )
+    )
+    assert ledger.metrics()["FP"] == 1
+    assert ledger.metrics()["llm_calls"] == 4
+
+    ledger.append(
+        LedgerEntry(
+            "1",
+            "P",
+            -1,
+            Status.PASS,
+            1,
+            timing={"reset": 2.0, "test": 5.0},
+            llm={"llm_calls": 1, "llm_cost": 0.1},
+        )
+    )
+    metrics = ledger.metrics()
+    assert (metrics["FP"], metrics["TN"]) == (0, 1)
+    assert (metrics["reset_time"], metrics["test_time"]) == (2.0, 5.0)
+    assert metrics["llm_calls"] == 1
+    assert len(ledger) == 1
+
+
+def test_shards_partition_the_collection():
+    shards = [Shard.parse(f"{index}/3") for index in (1, 2, 3)]
+    for position in range(10):
+        assert sum(shard.includes(position) for shard in shards) == 1
+    assert str(shards[1]) == "2/3"
+    with pytest.raises(ValueError):
+        _ = Shard.parse("4/3")
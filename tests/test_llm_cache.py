@@ -0,0 +1,109 @@
+import logging
+from pathlib import Path
+from tempfile import mktemp
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from VTAAS.llm.cache import (
+    CacheMissError,
+    CacheMode,
+    CachingLLMClient,
+    ResponseStore,
+)
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.utils import create_llm_client
+from VTAAS.schemas.llm import (
+    ClickCommand,
+    LLMActResponse,
+    LLMDataExtractionResponse,
+    Message,
+    MessageRole,
+)
+
+ACT_RESPONSE = LLMActResponse(
+    current_webpage_identification="login page",
+    screenshot_analysis="a form",
+    query_progress="started",
+    next_action="click login",
+    element_recognition="button 3",
+    command=ClickCommand(name="click", label=3),
+)
+
+
+def conversation(text: str = "login", screenshot: bytes = b"page") -> list[Message]:
+    return [
+        Message(role=MessageRole.System, content="system"),
+        Message(role=MessageRole.User, content=text, screenshot=[screenshot]),
+    ]
+
+
+@pytest.fixture
+def inner() -> MagicMock:
+    client = MagicMock()
+    client.model = "model-1"
+    client.logger = logging.getLogger("test_llm_cache")
+    client.act = AsyncMock(return_value=ACT_RESPONSE)
+    client.step_postprocess = AsyncMock(
+        return_value=LLMDataExtractionResponse(entries=[])
+    )
+    return client
+
+
+def caching(inner: MagicMock, store: ResponseStore, mode: CacheMode):
+    return CachingLLMClient(inner, LLMProvider.OPENAI, store, mode)
+
+
+@pytest.mark.asyncio
+async def test_record_missing_then_replay(inner: MagicMock, tmp_path: Path):
+    store = ResponseStore(tmp_path)
+    client = caching(inner, store, CacheMode.RECORD_MISSING)
+    assert await client.act(conversation()) == ACT_RESPONSE
+    assert await client.act(conversation()) == ACT_RESPONSE
+    inner.act.assert_awaited_once()
+
+    # another process, replaying from disk
+    replay = caching(inner, ResponseStore(tmp_path), CacheMode.REPLAY)
+    assert await replay.act(conversation()) == ACT_RESPONSE
+    inner.act.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_replay_miss(inner: MagicMock, tmp_path: Path):
+    client = caching(inner, ResponseStore(tmp_path), CacheMode.REPLAY)
+    _ = await caching(inner, client.store, CacheMode.RECORD).act(conversation())
+    with pytest.raises(CacheMissError):
+        _ = await client.act(conversation(screenshot=b"another page"))
+    with pytest.raises(CacheMissError):
+        _ = await client.step_postprocess("system", "user", [b"page"])
+    inner.act.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_record_always_calls(inner: MagicMock, tmp_path: Path):
+    client = caching(inner, ResponseStore(tmp_path), CacheMode.RECORD)
+    _ = await client.act(conversation())
+    _ = await client.act(conversation())
+    assert inner.act.await_count == 2
+    assert len(client.store) == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_evicted(inner: MagicMock, tmp_path: Path):
+    store = ResponseStore(tmp_path, max_entries=2)
+    client = caching(inner, store, CacheMode.RECORD_MISSING)
+    for text in ["one", "two", "one", "three"]:
+        _ = await client.act(conversation(text))
+    assert len(store) == 2
+    assert len(list(tmp_path.glob("*/*.json"))) == 2
+    _ = await client.act(conversation("one"))
+    assert inner.act.await_count == 3
+
+
+def test_create_llm_client_wraps_with_cache(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("VTAAS_LLM_CACHE", "replay")
+    monkeypatch.setenv("VTAAS_LLM_CACHE_DIR", mktemp())
+    client = create_llm_client("TC_cache", LLMProvider.OPENAI, 0, mktemp())
+    assert isinstance(client, CachingLLMClient)
+    assert client.mode == CacheMode.REPLAY
+    client.close()
@@ -0,0 +1,182 @@
+from io import BytesIO
+import logging
+from tempfile import mktemp
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from anthropic.types import Usage
+import httpx
+from mistralai.models import AssistantMessage, SystemMessage, UserMessage
+from openai import RateLimitError
+from PIL import Image
+import pytest
+
+from VTAAS.llm.anthropic_client import AnthropicLLMClient
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.mistral_client import MistralLLMClient
+from VTAAS.llm.openai_client import OpenAILLMClient
+from VTAAS.llm.registry import close_sdk_clients
+from VTAAS.llm.utils import create_llm_client
+from VTAAS.schemas.llm import LLMActResponse, Message, MessageRole
+from VTAAS.utils.logger import release_worker_loggers
+
+
+def _png() -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+PNG = _png()
+
+
+@pytest.mark.asyncio
+async def test_clients_share_sdk_client_and_log_file():
+    output_folder = mktemp()
+    actor = create_llm_client(
+        "TC_1", LLMProvider.OPENAI, 0, output_folder, worker="actor-1"
+    )
+    assertor = create_llm_client(
+        "TC_1", LLMProvider.OPENAI, 0, output_folder, worker="assertor-1"
+    )
+    assert isinstance(actor, OpenAILLMClient)
+    assert isinstance(assertor, OpenAILLMClient)
+    assert actor.aclient is assertor.aclient
+    assert actor.logger is not assertor.logger
+    assert actor.logger.parent is assertor.logger.parent
+    assert not actor.logger.handlers
+    assert actor.logger.name.endswith(".actor-1")
+
+    actor.close()
+    assert actor.logger.name not in logging.Logger.manager.loggerDict
+    assert assertor.logger.name in logging.Logger.manager.loggerDict
+    assert assertor.logger.parent is not None
+    assert len(assertor.logger.parent.handlers) == 2
+
+    await close_sdk_clients()
+    other = create_llm_client("TC_1", LLMProvider.OPENAI, 0, output_folder)
+    assert other.aclient is not actor.aclient
+    await close_sdk_clients()
+
+
+def test_released_worker_loggers_close_their_log_file():
+    output_folder = mktemp()
+    actor = create_llm_client(
+        "TC_1", LLMProvider.OPENAI, 0, output_folder, worker="actor-1"
+    )
+    shared = actor.logger.parent
+    assert shared is not None
+    file_handler = next(
+        h for h in shared.handlers if isinstance(h, logging.FileHandler)
+    )
+
+    release_worker_loggers(output_folder)
+    assert not shared.handlers
+    assert file_handler.stream is None
+
+    other = create_llm_client(
+        "TC_1", LLMProvider.OPENAI, 0, output_folder, worker="actor-1"
+    )
+    assert other.logger.parent is not shared
+    release_worker_loggers(output_folder)
+
+
+def test_other_model_gets_its_own_sdk_client():
+    output_folder = mktemp()
+    default = OpenAILLMClient("TC_2", 0, output_folder)
+    mini = OpenAILLMClient("TC_2", 0, output_folder, model="gpt-4o-mini")
+    assert default.aclient is not mini.aclient
+
+
+@pytest.mark.asyncio
+async def test_client_retries_rate_limit_then_parse_failure():
+    client = OpenAILLMClient("TC_3", 0, mktemp(), model="retry-test")
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    rate_limited = RateLimitError(
+        "rate limited",
+        response=httpx.Response(429, headers={"retry-after-ms": "10"}, request=request),
+        body=None,
+    )
+    valid = str(
+        {
+            "workers_analysis": "done",
+            "last_screenshot_analysis": "page",
+            "workers": [],
+            "sequence_type": "full",
+        }
+    )
+
+    def completion(content: str) -> SimpleNamespace:
+        message = SimpleNamespace(content=content)
+        choice = SimpleNamespace(message=message, finish_reason="stop")
+        return SimpleNamespace(choices=[choice], usage=None)
+
+    parse = AsyncMock(
+        side_effect=[rate_limited, completion("{'workers':"), completion(valid)]
+    )
+    with patch.object(client.aclient.beta.chat.completions, "parse", parse):
+        response = await client.followup_step(
+            [Message(role=MessageRole.User, content="next?")]
+        )
+    assert response.workers_analysis == "done"
+    assert parse.await_count == 3
+    await close_sdk_clients()
+
+
+def test_anthropic_prompt_puts_stable_prefix_first():
+    client = AnthropicLLMClient("TC_4", 0, mktemp())
+    conversation = [
+        Message(role=MessageRole.System, content="You are a tester"),
+        Message(role=MessageRole.User, content="test case", screenshot=[PNG]),
+        Message(role=MessageRole.Assistant, content="{}"),
+        Message(role=MessageRole.User, content="what next?"),
+    ]
+    before = [msg.model_copy(deep=True) for msg in conversation]
+    system, messages = client._prompt(conversation, LLMActResponse)
+
+    assert conversation == before
+    assert len(system) == 1
+    assert system[0]["text"].startswith("You are a tester\n")
+    assert '"command"' in system[0]["text"]
+    assert system[0].get("cache_control") == {"type": "ephemeral"}
+    task = list(messages[0]["content"])
+    assert [block.get("cache_control") for block in task] == [
+        None,
+        {"type": "ephemeral"},
+    ]
+    assert "cache_control" not in list(messages[2]["content"])[-1]
+    assert messages[-1] == {"role": "assistant", "content": '{"'}
+    # same prefix whatever the request: it can be served from the cache
+    _, later = client._prompt(
+        conversation + [Message(role=MessageRole.User, content="and now?")],
+        LLMActResponse,
+    )
+    assert later[0] == messages[0]
+
+
+def test_anthropic_usage_counts_cached_prompt_tokens():
+    usage = AnthropicLLMClient._usage(
+        Usage(
+            input_tokens=100,
+            output_tokens=20,
+            cache_read_input_tokens=800,
+            cache_creation_input_tokens=0,
+        )
+    )
+    assert usage.input_tokens == 900
+    assert usage.cached_tokens == 800
+    assert usage.describe() == ("900 input tokens (800 cached, 89%), 20 output tokens")
+
+
+def test_mistral_format_prompt_goes_to_system_prompt():
+    messages = MistralLLMClient._with_format(
+        [
+            SystemMessage(role="system", content="You are a tester"),
+            UserMessage(role="user", content="plan"),
+        ],
+        "\nanswer in JSON",
+    )
+    assert messages[0].content == "You are a tester\n\nanswer in JSON"
+    assert messages[1].content == "plan"
+    assert isinstance(messages[-1], AssistantMessage) and messages[-1].prefix
@@ -0,0 +1,87 @@
+from VTAAS.llm.memory import ACTOR_MEMORY, STALE_MARKS, MemoryPolicy, memory_policy
+from VTAAS.schemas.llm import Message, MessageRole
+
+
+def actor_conversation(rounds: int) -> list[Message]:
+    conversation = [
+        Message(role=MessageRole.System, content="system"),
+        Message(
+            role=MessageRole.User,
+            content="task\n<marks>\n0. <button >Go</button>\n</marks>",
+            screenshot=[b"s0"],
+        ),
+    ]
+    for i in range(1, rounds + 1):
+        conversation.append(Message(role=MessageRole.Assistant, content=f"act {i}"))
+        conversation.append(
+            Message(
+                role=MessageRole.User,
+                content=f"Browser response {i}"
+                + "." * 400
+                + f"\n<marks>\n{i}.</marks>",
+                screenshot=[f"s{i}".encode()],
+            )
+        )
+    return conversation
+
+
+def test_default_policy_sends_everything():
+    conversation = actor_conversation(3)
+    view = MemoryPolicy().view(conversation)
+    assert all(a is b for a, b in zip(view, conversation, strict=True))
+
+
+def test_keep_last_screenshots():
+    conversation = actor_conversation(4)
+    view = MemoryPolicy(keep_screenshots=2).view(conversation)
+    assert [msg.screenshot for msg in view if msg.role == MessageRole.User] == [
+        [b"s0"],
+        None,
+        None,
+        [b"s3"],
+        [b"s4"],
+    ]
+    assert "[1 older screenshot(s) omitted]" in view[3].content
+    # the conversation itself is left untouched
+    assert conversation[3].screenshot == [b"s1"]
+
+
+def test_drop_stale_marks():
+    conversation = actor_conversation(2)
+    view = MemoryPolicy(drop_stale_marks=True).view(conversation)
+    # the task prompt stays a cached prefix
+    assert view[1] is conversation[1]
+    assert STALE_MARKS in view[3].content
+    assert view[5].content.endswith("<marks>\n2.</marks>")
+
+
+def test_older_turns_summarized():
+    conversation = actor_conversation(3)
+    view = MemoryPolicy(keep_turns=1, summary_chars=50).view(conversation)
+    assert view[1] is conversation[1]
+    assert view[3].content == conversation[3].content[:50] + " [...]"
+    assert view[5].content == conversation[5].content[:50] + " [...]"
+    assert view[7] is conversation[7]
+    assert [msg.role for msg in view] == [msg.role for msg in conversation]
+
+
+def test_view_size_is_bounded():
+    policy = MemoryPolicy(keep_screenshots=2, drop_stale_marks=True, keep_turns=2)
+
+    def size(rounds: int) -> tuple[int, int]:
+        view = policy.view(actor_conversation(rounds))
+        return (
+            sum(len(msg.screenshot or []) for msg in view),
+            max(len(msg.content) for msg in view[2:]),
+        )
+
+    assert size(3) == size(8)
+
+
+def test_full_history_opt_out(monkeypatch):
+    monkeypatch.setenv("VTAAS_FULL_HISTORY", "true")
+    conversation = actor_conversation(4)
+    view = memory_policy(ACTOR_MEMORY).view(conversation)
+    assert all(a is b for a, b in zip(view, conversation, strict=True))
+    monkeypatch.delenv("VTAAS_FULL_HISTORY")
+    assert memory_policy(ACTOR_MEMORY) is ACTOR_MEMORY
@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+import sys
+
+import pytest
+
+from VTAAS.utils import prompts
+from VTAAS.utils.prompts import PROMPTS, PromptTemplate, load_prompts, render_prompt
+
+
+def test_all_prompts_load_from_any_directory(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.chdir(tmp_path)
+    load_prompts()
+    for template in PROMPTS.values():
+        assert template.text
+    prompt = render_prompt(
+        "actor", history="", page_info="PAGE", viewport_info="VIEW", query="QUERY"
+    )
+    assert "QUERY" in prompt and "PAGE" in prompt
+
+
+def test_render_checks_fields():
+    with pytest.raises(ValueError):
+        _ = render_prompt("actor", query="only this one")
+
+
+@pytest.fixture
+def prompt_package(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    package = tmp_path / "fake_prompts"
+    package.mkdir()
+    _ = (package / "__init__.py").write_text("")
+    _ = (package / "hello.txt").write_text("Hello {name}")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield package
+    sys.modules.pop("fake_prompts", None)
+
+
+def test_placeholders_validated_on_load(prompt_package: Path):
+    template = PromptTemplate("fake_prompts", "hello.txt", frozenset({"other"}))
+    with pytest.raises(ValueError, match="expected placeholders"):
+        template.load()
+
+
+def test_hot_reload(prompt_package: Path, monkeypatch: pytest.MonkeyPatch):
+    template = PromptTemplate("fake_prompts", "hello.txt", frozenset({"name"}))
+    template.load()
+    monkeypatch.setitem(PROMPTS, "hello", template)
+    monkeypatch.setattr(prompts, "_loaded", True)
+    _ = (prompt_package / "hello.txt").write_text("Bye {name}")
+    os.utime(prompt_package / "hello.txt", (0, 0))
+
+    assert render_prompt("hello", name="you") == "Hello you"
+    monkeypatch.setenv("VTAAS_PROMPTS_HOT_RELOAD", "1")
+    assert render_prompt("hello", name="you") == "Bye you"
@@ -0,0 +1,86 @@
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+import threading
+
+import pytest
+
+from VTAAS.evaluation.reset import (
+    CallbackReset,
+    CommandReset,
+    FakeReset,
+    ResetError,
+    as_reset_backend,
+    wait_until_ready,
+)
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def app_url() -> Iterator[str]:
+    server = HTTPServer(("127.0.0.1", 0), OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+def closed_port_url() -> str:
+    server = HTTPServer(("127.0.0.1", 0), OkHandler)
+    port = server.server_port
+    server.server_close()
+    return f"http://127.0.0.1:{port}/"
+
+
+def test_command_placeholders():
+    backend = CommandReset("restore --port {port} --host {host} {url}")
+    assert (
+        backend.render("http://app:9980/x")
+        == "restore --port 9980 --host app http://app:9980/x"
+    )
+
+
+@pytest.mark.asyncio
+async def test_command_reset_waits_for_the_application(app_url: str, tmp_path: Path):
+    marker = tmp_path / "reset"
+    backend = CommandReset(f"echo {{port}} > {marker}", probe_interval=0.01)
+    await backend.reset(app_url)
+    assert marker.read_text().strip() == app_url.split(":")[-1].strip("/")
+
+
+@pytest.mark.asyncio
+async def test_failing_command_raises(app_url: str):
+    backend = CommandReset("echo restore failed; exit 3")
+    with pytest.raises(ResetError, match="exited with 3:\nrestore failed"):
+        await backend.reset(app_url)
+
+
+@pytest.mark.asyncio
+async def test_unready_application_times_out():
+    with pytest.raises(ResetError, match="is not ready"):
+        await wait_until_ready(closed_port_url(), timeout=0.05, interval=0.01)
+
+
+@pytest.mark.asyncio
+async def test_callbacks_are_backends():
+    resets: list[str] = []
+
+    async def reset(url: str) -> None:
+        resets.append(url)
+
+    backend = as_reset_backend(reset)
+    assert isinstance(backend, CallbackReset)
+    await backend.reset("http://app:9980")
+    assert resets == ["http://app:9980"]
+
+    fake = FakeReset()
+    assert as_reset_backend(fake) is fake
@@ -0,0 +1,193 @@
+import ast
+import asyncio
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import json
+import logging
+import random
+import time
+
+import httpx
+from openai import APIStatusError
+import pytest
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.retry import (
+    Attempt,
+    RequestExecutor,
+    RetryPolicy,
+    TokenBucket,
+    backoff_delay,
+    is_retryable,
+    rate_limiter,
+    retry_after,
+    sleep_backoff,
+)
+
+
+def test_backoff_delay_grows_and_is_capped():
+    for attempt, (low, high) in enumerate([(5, 10), (10, 20), (20, 40)], start=1):
+        for _ in range(50):
+            assert low <= backoff_delay(attempt) <= high
+    for _ in range(50):
+        assert 30 <= backoff_delay(10) <= 60
+
+
+def test_backoff_delay_is_jittered():
+    delays = {backoff_delay(3) for _ in range(20)}
+    assert len(delays) > 1
+
+
+@pytest.mark.asyncio
+async def test_sleep_backoff_does_not_block_event_loop():
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    task = asyncio.create_task(ticker())
+    start = time.monotonic()
+    delay = await sleep_backoff(1, base=0.1)
+    task.cancel()
+    assert 0.05 <= delay <= 0.1
+    assert time.monotonic() - start >= delay
+    assert ticks > 3
+
+
+def _status_error(status: int, headers: dict[str, str] | None = None) -> APIStatusError:
+    request = httpx.Request("POST", "https://api.example.com/v1/chat")
+    response = httpx.Response(status, headers=headers, request=request)
+    return APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+def _executor(policy: RetryPolicy | None = None) -> RequestExecutor:
+    return RequestExecutor(
+        LLMProvider.OPENAI,
+        f"test-model-{random.random()}",
+        logging.getLogger("test_retry"),
+        policy or RetryPolicy(backoff_base=0.01, backoff_cap=0.02),
+    )
+
+
+def test_retry_after_headers():
+    assert retry_after(_status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(_status_error(429, {"retry-after": "3"})) == 3
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30))
+    delay = retry_after(_status_error(503, {"retry-after": date}))
+    assert delay is not None and 25 <= delay <= 30
+    assert retry_after(_status_error(500)) is None
+    assert retry_after(ValueError("no response")) is None
+
+
+def test_retryable_statuses():
+    assert is_retryable(_status_error(429))
+    assert is_retryable(_status_error(503))
+    assert is_retryable(ConnectionError("reset"))
+    assert not is_retryable(_status_error(400))
+    assert not is_retryable(_status_error(401))
+
+
+@pytest.mark.asyncio
+async def test_parse_and_transport_failures_have_separate_budgets():
+    executor = _executor(
+        RetryPolicy(transport_tries=3, parse_tries=2, backoff_base=0.01)
+    )
+    answers: list[str | Exception] = [
+        _status_error(500),
+        "not json",
+        _status_error(502),
+        '{"value": 1}',
+    ]
+    attempts: list[Attempt] = []
+
+    async def send(attempt: Attempt) -> str:
+        attempts.append(replace(attempt))
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    result = await executor.run("test", send, json.loads)
+    assert result == {"value": 1}
+    assert [a.number for a in attempts] == [1, 2, 3, 4]
+    assert attempts[-1].transport_failures == 2
+    assert attempts[-1].parse_failures == 1
+    assert isinstance(attempts[-1].last_parse_error, ValueError)
+
+
+@pytest.mark.asyncio
+async def test_parse_budget_exhausted_raises_parse_error():
+    executor = _executor(RetryPolicy(parse_tries=2))
+    calls = 0
+
+    async def send(_: Attempt) -> str:
+        nonlocal calls
+        calls += 1
+        return "{'unterminated"
+
+    with pytest.raises(SyntaxError):
+        _ = await executor.run("test", send, ast.literal_eval)
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    executor = _executor()
+    calls = 0
+
+    async def send(_: Attempt) -> str:
+        nonlocal calls
+        calls += 1
+        raise _status_error(401)
+
+    with pytest.raises(APIStatusError):
+        _ = await executor.run("test", send, str)
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_pauses_every_caller():
+    executor = _executor()
+    sent: list[float] = []
+    limited = False
+
+    async def send(_: Attempt) -> str:
+        nonlocal limited
+        sent.append(time.monotonic())
+        if not limited:
+            limited = True
+            raise _status_error(429, {"retry-after-ms": "200"})
+        return "ok"
+
+    start = time.monotonic()
+    first = asyncio.create_task(executor.run("first", send, str))
+    await asyncio.sleep(0.02)
+    # another test case using the same model waits for the pause as well
+    second = await executor.run("second", send, str)
+    assert second == "ok"
+    assert await first == "ok"
+    assert sent[1] - start >= 0.2
+    assert len(sent) == 3
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_spaces_out_requests():
+    bucket = TokenBucket(requests_per_minute=600)  # 10/s, burst of 10
+    start = time.monotonic()
+    for _ in range(12):
+        _ = await bucket.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.15 <= elapsed <= 0.5
+
+
+def test_rate_limiter_is_shared_and_configured(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("VTAAS_RPM_MISTRAL", "120")
+    bucket = rate_limiter(LLMProvider.MISTRAL, "rpm-test")
+    assert bucket is rate_limiter(LLMProvider.MISTRAL, "rpm-test")
+    assert bucket.rate == 2
+    assert rate_limiter(LLMProvider.MISTRAL, "other").rate == 2
+    assert rate_limiter(LLMProvider.GOOGLE, "rpm-test").rate is None
@@ -0,0 +1,117 @@
+from tempfile import mktemp
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from VTAAS.llm.llm_client import LLMClient, LLMProvider
+from VTAAS.llm.openai_client import OpenAILLMClient
+from VTAAS.llm.registry import close_sdk_clients
+from VTAAS.llm.routing import ModelTier, RoutingLLMClient, RoutingPolicy
+from VTAAS.llm.utils import create_llm_client
+from VTAAS.schemas.llm import (
+    AssertionChecking,
+    ClickCommand,
+    FinishCommand,
+    LLMActResponse,
+    LLMAssertResponse,
+    LLMDataExtractionResponse,
+)
+from VTAAS.schemas.verdict import AssertionReport, Status
+
+
+def _act(command: ClickCommand | FinishCommand) -> LLMActResponse:
+    return LLMActResponse(
+        current_webpage_identification="home",
+        screenshot_analysis="a login button",
+        query_progress="started",
+        next_action="click",
+        element_recognition="2",
+        command=command,
+    )
+
+
+def _assert(status: Status) -> LLMAssertResponse:
+    return LLMAssertResponse(
+        page_description="home",
+        assertion_checking=AssertionChecking(observation="o", verification="v"),
+        verdict=AssertionReport(status=status),
+    )
+
+
+def _client(model: str) -> LLMClient:
+    client = MagicMock(spec=LLMClient)
+    client.model = model
+    client.logger = MagicMock()
+    return client
+
+
+def test_most_specific_route_wins():
+    policy = RoutingPolicy.parse("act=small, actor=large, assertor.assert_=small")
+    assert policy.tier("actor-12", "act") == ModelTier.SMALL
+    assert policy.tier("actor-12", "step_postprocess") == ModelTier.LARGE
+    assert policy.tier("assertor-3", "assert_") == ModelTier.SMALL
+    assert policy.tier("orchestrator", "plan_step") == ModelTier.LARGE
+    assert RoutingPolicy.parse("economy").small_methods("orchestrator") == {
+        "step_postprocess"
+    }
+    assert not RoutingPolicy.parse("").small_methods("actor-1")
+
+
+@pytest.mark.asyncio
+async def test_create_llm_client_routes_to_the_small_model(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv("VTAAS_SMALL_MODEL_OPENAI", "gpt-4o-mini")
+    policy = RoutingPolicy.parse("economy")
+    output_folder = mktemp()
+    actor = create_llm_client(
+        "TC_r", LLMProvider.OPENAI, 0, output_folder, "actor-1", policy
+    )
+    assertor = create_llm_client(
+        "TC_r", LLMProvider.OPENAI, 0, output_folder, "assertor-1", policy
+    )
+    assert isinstance(actor, RoutingLLMClient)
+    assert actor.small.model == "gpt-4o-mini"
+    assert actor.large.model == "gpt-4o-2024-11-20"
+    assert isinstance(assertor, OpenAILLMClient)
+    await close_sdk_clients()
+
+
+@pytest.mark.asyncio
+async def test_confident_small_answers_are_kept():
+    small, large = _client("small"), _client("large")
+    small.act = AsyncMock(return_value=_act(ClickCommand(name="click", label=2)))
+    client = RoutingLLMClient(small, large, {"act"})
+    response = await client.act([])
+    assert response.command == ClickCommand(name="click", label=2)
+    large.act.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_unsure_or_unparsable_answers_are_escalated():
+    small, large = _client("small"), _client("large")
+    small.act = AsyncMock(
+        return_value=_act(FinishCommand(name="finish", status=Status.FAIL))
+    )
+    large.act = AsyncMock(return_value=_act(ClickCommand(name="click", label=4)))
+    small.assert_ = AsyncMock(return_value=_assert(Status.FAIL))
+    large.assert_ = AsyncMock(return_value=_assert(Status.PASS))
+    small.step_postprocess = AsyncMock(side_effect=ValueError("not json"))
+    large.step_postprocess = AsyncMock(
+        return_value=LLMDataExtractionResponse(entries=[])
+    )
+    client = RoutingLLMClient(small, large, {"act", "assert_", "step_postprocess"})
+
+    assert (await client.act([])).command == ClickCommand(name="click", label=4)
+    assert (await client.assert_([])).verdict.status == Status.PASS
+    assert (await client.step_postprocess("s", "u", [])).entries == []
+    assert client.escalations == 3
+
+
+@pytest.mark.asyncio
+async def test_large_routes_skip_the_small_model():
+    small, large = _client("small"), _client("large")
+    large.assert_ = AsyncMock(return_value=_assert(Status.FAIL))
+    client = RoutingLLMClient(small, large, {"act"})
+    assert (await client.assert_([])).verdict.status == Status.FAIL
+    small.assert_.assert_not_called()
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.scheduler import (
+    LLMScheduler,
+    Priority,
+    ProviderQueue,
+    prioritized,
+    request_priority,
+)
+from VTAAS.schemas.llm import (
+    LLMActResponse,
+    LLMAssertResponse,
+    LLMTestStepPlanResponse,
+)
+
+
+@pytest.mark.asyncio
+async def test_in_flight_limit_per_provider():
+    scheduler = LLMScheduler(default_max_in_flight=2)
+    in_flight = 0
+    peak = 0
+
+    async def request(provider: LLMProvider):
+        nonlocal in_flight, peak
+        async with scheduler.slot(provider, Priority.ACT):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    _ = await asyncio.gather(*(request(LLMProvider.OPENAI) for _ in range(6)))
+    assert peak == 2
+
+    peak = 0
+    _ = await asyncio.gather(
+        request(LLMProvider.OPENAI),
+        request(LLMProvider.OPENAI),
+        request(LLMProvider.GOOGLE),
+    )
+    assert peak == 3
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_by_priority_then_arrival():
+    scheduler = LLMScheduler(default_max_in_flight=1)
+    served: list[str] = []
+    release = asyncio.Event()
+
+    async def request(name: str, priority: Priority):
+        async with scheduler.slot(LLMProvider.OPENAI, priority):
+            served.append(name)
+            if name == "busy":
+                await release.wait()
+
+    busy = asyncio.create_task(request("busy", Priority.PLAN))
+    await asyncio.sleep(0)
+    waiters = [
+        asyncio.create_task(request(name, priority))
+        for name, priority in [
+            ("plan", Priority.PLAN),
+            ("act-1", Priority.ACT),
+            ("assert", Priority.VERDICT),
+            ("act-2", Priority.ACT),
+            ("finish", Priority.FINISH),
+        ]
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    _ = await asyncio.gather(busy, *waiters)
+    assert served == ["busy", "assert", "finish", "act-1", "act-2", "plan"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_its_slot():
+    queue = ProviderQueue(max_in_flight=1)
+    await queue.acquire(Priority.ACT)
+    waiter = asyncio.create_task(queue.acquire(Priority.ACT))
+    await asyncio.sleep(0)
+    _ = waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    queue.release()
+    assert queue.in_flight == 0
+    await asyncio.wait_for(queue.acquire(Priority.PLAN), timeout=1)
+    assert queue.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_wait_metrics():
+    scheduler = LLMScheduler(default_max_in_flight=1)
+
+    async def request():
+        async with scheduler.slot(LLMProvider.MISTRAL, Priority.VERDICT):
+            await asyncio.sleep(0.05)
+
+    # the requests wait about 0, 0.05 and 0.1s: the bounds leave room for a
+    # pause of the event loop (e.g. garbage collection) between their starts
+    _ = await asyncio.gather(request(), request(), request())
+    summary = scheduler.metrics()["mistral.verdict"]
+    assert summary["count"] == 3
+    assert 0.07 <= summary["max"] <= 0.5
+    assert summary["p50"] >= 0.025
+
+
+def test_max_in_flight_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("VTAAS_MAX_IN_FLIGHT_ANTHROPIC", "3")
+    scheduler = LLMScheduler()
+    assert scheduler.queue(LLMProvider.ANTHROPIC).max_in_flight == 3
+    assert scheduler.queue(LLMProvider.OPENAI).max_in_flight == 16
+
+
+def test_request_priority():
+    assert request_priority(LLMAssertResponse) == Priority.VERDICT
+    assert request_priority(LLMActResponse) == Priority.ACT
+    assert request_priority(LLMTestStepPlanResponse) == Priority.PLAN
+    with prioritized(Priority.FINISH):
+        assert request_priority(LLMActResponse) == Priority.FINISH
+    assert request_priority(LLMActResponse) == Priority.ACT
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.mistral_client import plan_format_prompt
+from VTAAS.llm.schema_prompts import (
+    SchemaStyle,
+    example_prompt,
+    json_schema,
+    schema_prompt,
+    schema_style,
+)
+from VTAAS.schemas.llm import (
+    LLMActResponse,
+    LLMAssertResponse,
+    WorkerConfig,
+    WorkerType,
+)
+
+
+def test_schema_prompt_is_computed_once():
+    first = schema_prompt(LLMProvider.ANTHROPIC, LLMActResponse, SchemaStyle.COMPACT)
+    second = schema_prompt(LLMProvider.ANTHROPIC, LLMActResponse, SchemaStyle.COMPACT)
+    assert first is second
+    assert json_schema(LLMActResponse) is json_schema(LLMActResponse)
+    assert (
+        schema_prompt(LLMProvider.ANTHROPIC, LLMAssertResponse, SchemaStyle.COMPACT)
+        is not first
+    )
+
+
+def test_compact_schema_is_the_same_schema_in_fewer_tokens():
+    compact = schema_prompt(LLMProvider.GOOGLE, LLMActResponse, SchemaStyle.COMPACT)
+    indented = schema_prompt(LLMProvider.GOOGLE, LLMActResponse, SchemaStyle.INDENTED)
+    assert compact.tokens < indented.tokens
+
+    def embedded(text: str) -> object:
+        return json.loads(text[text.index("{") : text.rindex("}") + 1])
+
+    assert embedded(compact.text) == embedded(indented.text)
+    assert embedded(compact.text) == LLMActResponse.model_json_schema()
+
+
+def test_mistral_prompts_show_an_example():
+    prompt = schema_prompt(LLMProvider.MISTRAL, LLMActResponse, SchemaStyle.COMPACT)
+    assert "similar to this" in prompt.text
+    assert plan_format_prompt() is plan_format_prompt()
+    assert "similar to this" in plan_format_prompt()
+    example = WorkerConfig(type=WorkerType.ACTOR, query="click on login")
+    text = example_prompt(example, SchemaStyle.COMPACT)
+    encoded = text[text.index('"') :]
+    assert json.loads(json.loads(encoded))["query"] == "click on login"
+
+
+def test_schema_style_from_env(monkeypatch: pytest.MonkeyPatch):
+    assert schema_style() == SchemaStyle.COMPACT
+    monkeypatch.setenv("VTAAS_SCHEMA_PROMPT", "indented")
+    assert schema_style() == SchemaStyle.INDENTED
@@ -0,0 +1,57 @@
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from VTAAS.llm.images import ImageConfig, prepare_image
+from VTAAS.llm.screenshot_store import ScreenshotStore
+
+
+def make_screenshot(color: tuple[int, int, int]) -> bytes:
+    image = Image.new("RGB", (64, 32), color)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_screenshot_encoded_once():
+    store = ScreenshotStore(config=ImageConfig())
+    screenshot = make_screenshot((255, 0, 0))
+    with patch(
+        "VTAAS.llm.screenshot_store.prepare_image", wraps=prepare_image
+    ) as mock_prepare:
+        first = store.get(screenshot)
+        for _ in range(5):
+            assert store.get(screenshot) is first
+        # same content, another object
+        assert store.get(bytes(bytearray(screenshot))) is first
+    mock_prepare.assert_called_once()
+    assert first.data_url.startswith("data:image/jpeg;base64,")
+    assert (store.hits, store.misses) == (6, 1)
+
+
+def test_same_object_is_not_hashed_again():
+    store = ScreenshotStore(config=ImageConfig())
+    screenshot = make_screenshot((0, 255, 0))
+    digest = store.digest(screenshot)
+    with patch("VTAAS.llm.screenshot_store.hashlib.sha256") as mock_sha:
+        assert store.digest(screenshot) == digest
+    mock_sha.assert_not_called()
+
+
+def test_least_recently_used_screenshot_evicted():
+    store = ScreenshotStore(max_entries=2, config=ImageConfig())
+    red, green, blue = (
+        make_screenshot((255, 0, 0)),
+        make_screenshot((0, 255, 0)),
+        make_screenshot((0, 0, 255)),
+    )
+    _ = store.get(red)
+    _ = store.get(green)
+    _ = store.get(red)
+    _ = store.get(blue)
+    assert len(store) == 2
+    _ = store.get(red)
+    assert store.misses == 3
+    _ = store.get(green)
+    assert store.misses == 4
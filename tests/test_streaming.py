@@ -0,0 +1,156 @@
+import json
+import logging
+import random
+
+import pytest
+
+from VTAAS.llm.llm_client import LLMProvider
+from VTAAS.llm.retry import RequestExecutor, RetryPolicy
+from VTAAS.llm.streaming import (
+    CommandStartedError,
+    IncrementalObjectParser,
+    StreamEnd,
+    parse_act_response,
+    stream_act,
+)
+from VTAAS.schemas.llm import (
+    ClickCommand,
+    Command,
+    LLMActResponse,
+    LLMStreamedActResponse,
+)
+
+ACT_RESPONSE = LLMStreamedActResponse(
+    current_webpage_identification='Home page, "{ braces }" and \\ slashes',
+    screenshot_analysis="A login button [top right]",
+    query_progress="not started",
+    next_action="click login",
+    element_recognition="labelled 2",
+    command=ClickCommand(name="click", label=2),
+).model_dump_json()
+
+
+def _chunks(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_fields_are_emitted_once_complete(size: int):
+    parser = IncrementalObjectParser()
+    emitted: list[tuple[int, str]] = []
+    for chunk in _chunks(ACT_RESPONSE, size):
+        completed = parser.feed(chunk)
+        emitted += [(len(parser.text), key) for key, _ in completed]
+    keys = [key for _, key in emitted]
+    assert keys == list(LLMStreamedActResponse.model_fields)
+    assert parser.complete
+    assert parser.fields["command"] == {"name": "click", "label": 2}
+    assert parser.fields["current_webpage_identification"] == (
+        'Home page, "{ braces }" and \\ slashes'
+    )
+    # the command is known as soon as its object is closed, before the analyses
+    if size == 1:
+        command_end = dict((key, end) for end, key in emitted)["command"]
+        assert command_end <= ACT_RESPONSE.index('"current_webpage_identification"')
+
+
+def test_text_around_the_object_is_ignored():
+    parser = IncrementalObjectParser()
+    _ = parser.feed('Here is the answer:\n```json\n{"a": [1, {"b": 2}],')
+    _ = parser.feed(' "c": null}\n```')
+    assert parser.complete
+    assert parser.fields == {"a": [1, {"b": 2}], "c": None}
+
+
+def test_parse_act_response_rejects_truncated_answers():
+    assert parse_act_response(ACT_RESPONSE).command == ClickCommand(
+        name="click", label=2
+    )
+    with pytest.raises(ValueError):
+        _ = parse_act_response(ACT_RESPONSE[:-10])
+
+
+def _executor() -> RequestExecutor:
+    return RequestExecutor(
+        LLMProvider.OPENAI,
+        f"streaming-{random.random()}",
+        logging.getLogger("test_streaming"),
+        RetryPolicy(backoff_base=0.01),
+    )
+
+
+@pytest.mark.asyncio
+async def test_command_is_handed_over_before_the_end_of_the_stream():
+    events: list[str] = []
+
+    async def chunks(_: StreamEnd):
+        for chunk in _chunks(ACT_RESPONSE, 1):
+            events.append("chunk")
+            yield chunk
+
+    def on_command(command: Command) -> None:
+        events.append(f"command {command.name}")
+
+    response = await stream_act(_executor(), chunks, on_command)
+    assert response.command == ClickCommand(name="click", label=2)
+    assert events.index("command click") < len(events) - 1
+
+
+@pytest.mark.asyncio
+async def test_invalid_command_is_retried_before_it_starts():
+    invalid = ACT_RESPONSE.replace('"label":2', '"label":"two"')
+    answers = [invalid, ACT_RESPONSE]
+    commands: list[Command] = []
+
+    async def chunks(_: StreamEnd):
+        yield answers.pop(0)
+
+    response = await stream_act(_executor(), chunks, commands.append)
+    assert response.command == ClickCommand(name="click", label=2)
+    assert commands == [ClickCommand(name="click", label=2)]
+
+
+@pytest.mark.asyncio
+async def test_stream_failing_after_command_is_not_retried():
+    calls = 0
+    commands: list[Command] = []
+
+    async def chunks(_: StreamEnd):
+        nonlocal calls
+        calls += 1
+        yield ACT_RESPONSE[:-1]
+        raise ConnectionError("stream reset")
+
+    with pytest.raises(CommandStartedError):
+        _ = await stream_act(_executor(), chunks, commands.append)
+    assert calls == 1
+    assert len(commands) == 1
+
+
+@pytest.mark.asyncio
+async def test_undecodable_end_after_command_keeps_the_parsed_fields():
+    calls = 0
+    commands: list[Command] = []
+    cut = ACT_RESPONSE.index('"query_progress"') + len('"query_progress":"not st')
+
+    async def chunks(end: StreamEnd):
+        nonlocal calls
+        calls += 1
+        yield ACT_RESPONSE[:cut]
+        end.truncated = True
+
+    response = await stream_act(_executor(), chunks, commands.append)
+    assert calls == 1
+    assert commands == [response.command]
+    assert response.screenshot_analysis == "A login button [top right]"
+    assert response.query_progress == ""
+    assert response.element_recognition == ""
+
+
+def test_truncated_act_response_is_closed_at_the_token_limit():
+    text = ACT_RESPONSE[: ACT_RESPONSE.rindex('"')] + '", '
+    with pytest.raises(ValueError):
+        _ = parse_act_response(text)
+    assert parse_act_response(text, truncated=True) == LLMActResponse.model_validate(
+        json.loads(ACT_RESPONSE)
+    )